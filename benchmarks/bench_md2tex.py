@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+md2latex_pandoc.py 的基准测试
+
+生成可调节内嵌SVG数量、图片引用数、引用文献数、中文段落比例和文档长度的合成
+Markdown语料，在模拟的pandoc/xelatex/inkscape（见 fake_toolchain.py，延迟可配置）
+下分别计时 extract_and_save_svg、find_image_file、post_process_latex、
+convert_md_to_latex 和 compile_latex，输出各参数变化时的耗时曲线。
+
+示例:
+    python benchmarks/bench_md2tex.py
+    python benchmarks/bench_md2tex.py --axis svgs --values 0,20,80 --latency inkscape=0.05
+    python benchmarks/bench_md2tex.py --json bench.json --repeat 5
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import tempfile
+import statistics
+import contextlib
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_ROOT = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import md2latex_pandoc as md2tex
+
+TOOLS = ('pandoc', 'xelatex', 'xdvipdfmx', 'inkscape', 'kpsewhich', 'mmdc')
+
+# 未指定扫描参数时，其余参数取这些基准值
+BASE_PARAMS = {
+    'paragraphs': 50,
+    'svgs': 5,
+    'images': 5,
+    'citations': 10,
+    'cjk': 0.5,
+}
+
+# 默认扫描的参数及取值
+DEFAULT_AXES = {
+    'paragraphs': [50, 200, 800],
+    'svgs': [0, 10, 40],
+    'images': [0, 10, 40],
+    'citations': [0, 50, 200],
+    'cjk': [0.0, 0.5, 1.0],
+}
+
+COMPONENTS = ('extract_and_save_svg', 'find_image_file', 'post_process_latex',
+              'convert_md_to_latex', 'compile_latex')
+
+# 1x1像素的PNG文件
+TINY_PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082'
+)
+
+CJK_SENTENCES = [
+    "本文研究了β衰变过程中γ射线的角分布，并讨论了δ函数近似的适用范围。",
+    "实验结果表明，弛豫时间τ与温度之间存在幂律关系，二者的对应关系为A↔B。",
+    "在平均场近似下，序参量满足自洽方程，其解的稳定性由二阶导数决定。",
+    "我们进一步分析了有限尺寸效应，并给出了普适性标度律⇔临界指数的推导。",
+]
+
+LATIN_SENTENCES = [
+    "The solver converges in O(n log n) steps for 95% of the test_cases we tried.",
+    "Each iteration updates the state vector and re-normalises the weights & biases.",
+    "We compare against three baselines using identical hyper-parameters (see #4).",
+    "Inline math such as $E = mc^2$ and $\\alpha + \\beta$ is passed through unchanged.",
+]
+
+
+def generate_markdown(paragraphs=50, svgs=5, images=5, citations=10, cjk=0.5, seed=0):
+    """生成合成Markdown文档
+
+    返回 (Markdown文本, 图片引用路径列表, 引用文献键列表)。内嵌SVG和图片引用
+    均匀分布在正文段落之间，cjk为中文段落（含希腊字母和箭头等特殊字符）的比例。
+    """
+    rng = random.Random(seed)
+    image_refs = []
+    citation_keys = [f"ref{i}" for i in range(citations)]
+    blocks = ['---', 'title: "基准测试文档"', '---', '']
+    total = max(paragraphs, 1)
+    svg_at = {int(i * total / svgs) for i in range(svgs)} if svgs else set()
+    svg_at = sorted(svg_at) + [None] * (svgs - len(svg_at))
+    image_at = [int(i * total / images) for i in range(images)] if images else []
+    svg_index = 0
+    image_index = 0
+
+    for p in range(total):
+        if p % 10 == 0:
+            blocks.append(f"## 第{p // 10 + 1}节\n")
+        sentences = CJK_SENTENCES if rng.random() < cjk else LATIN_SENTENCES
+        text = ' '.join(rng.choice(sentences) for _ in range(3))
+        if citation_keys:
+            # 文献键均匀分配到各段，每段至少引用一篇，保证所有键都被引用到
+            count = len(citation_keys)
+            keys = citation_keys[p * count // total:(p + 1) * count // total] or [citation_keys[p % count]]
+            text += ' [' + '; '.join(f"@{key}" for key in keys) + ']'
+        blocks.append(text + '\n')
+
+        while svg_index < svgs and (svg_at[svg_index] is None or svg_at[svg_index] <= p):
+            blocks.append(
+                f'<svg width="200" height="120" xmlns="http://www.w3.org/2000/svg">'
+                f'<title>图 {svg_index + 1}: 合成示意图</title>'
+                f'<rect x="{svg_index % 50}" y="10" width="80" height="40" fill="#{svg_index * 2654435761 % 0xffffff:06x}"/>'
+                f'<text class="title" x="10" y="100"><tspan>示意图</tspan>{svg_index + 1}</text></svg>\n'
+            )
+            svg_index += 1
+        while image_index < images and image_at[image_index] <= p:
+            # 一半图片与Markdown同目录可直接找到，另一半需要通过资源索引查找
+            if image_index % 2 == 0:
+                path = f"figs/img_{image_index}.png"
+            else:
+                path = f"pics/img_{image_index}.png"
+            image_refs.append(path)
+            blocks.append(f"![图 {image_index + 1}: 合成图片]({path})\n")
+            image_index += 1
+        if p % 25 == 24:
+            blocks.append('```python\nfor i in range(10):\n    print("β", i)\n```\n')
+    return '\n'.join(blocks), image_refs, citation_keys
+
+
+def write_corpus(root, name='doc', **params):
+    """在root下写入一份合成语料（Markdown、图片和.bib文件），返回Markdown路径"""
+    root = Path(root)
+    doc_dir = root / 'src'
+    doc_dir.mkdir(parents=True, exist_ok=True)
+    markdown, image_refs, citation_keys = generate_markdown(**params)
+    for i, ref in enumerate(image_refs):
+        if ref.startswith('figs/'):
+            target = doc_dir / ref
+        else:
+            target = root / 'assets' / f"part{i % 4}" / 'pics' / Path(ref).name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(TINY_PNG)
+    with open(doc_dir / 'refs.bib', 'w', encoding='utf-8') as f:
+        # 除被引用的条目外再加入一些未引用的条目
+        for key in citation_keys + [f"unused{i}" for i in range(100)]:
+            f.write(f"@article{{{key},\n  title = {{Title of {key}}},\n  author = {{Author}},\n  year = {{2020}}\n}}\n\n")
+    md_file = doc_dir / f"{name}.md"
+    md_file.write_text(markdown, encoding='utf-8')
+    return md_file
+
+
+def install_fake_toolchain(bin_dir):
+    """在bin_dir中为每个模拟工具生成包装脚本，返回bin_dir"""
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for tool in TOOLS:
+        wrapper = bin_dir / tool
+        wrapper.write_text(
+            f'#!/bin/sh\nexec "{sys.executable}" "{BENCH_DIR / "fake_toolchain.py"}" {tool} "$@"\n',
+            encoding='utf-8'
+        )
+        wrapper.chmod(0o755)
+    return bin_dir
+
+
+def reset_state():
+    """清除md2latex_pandoc.py的进程内缓存，使每次计时都从冷状态开始"""
+    md2tex._ASSET_INDEXES.clear()
+    md2tex._BIB_KEY_INDEXES.clear()
+    md2tex._TOOL_VERSIONS.clear()
+
+
+def measure(func, setup, repeat):
+    """运行repeat次，返回每次的耗时（秒）；setup在计时之外执行，返回func的参数"""
+    samples = []
+    for _ in range(repeat):
+        args = setup()
+        reset_state()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(*args)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+class CorpusBench:
+    """针对一份合成语料分别计时各个处理环节"""
+
+    def __init__(self, workdir, params, template):
+        self.workdir = Path(workdir)
+        # 输出目录放在语料目录之外，避免被资源索引扫描
+        self.corpus_dir = self.workdir / 'corpus'
+        self.params = params
+        self.template = template
+        self.md_file = write_corpus(self.corpus_dir, **params)
+        self.markdown = self.md_file.read_text(encoding='utf-8')
+        self.runs = 0
+
+    def fresh_dir(self, prefix):
+        self.runs += 1
+        path = self.workdir / 'out' / f"{prefix}_{self.runs}"
+        path.mkdir(parents=True)
+        return path
+
+    def bench_extract_and_save_svg(self, repeat):
+        return measure(md2tex.extract_and_save_svg,
+                       lambda: (self.markdown, self.fresh_dir('svg')), repeat)
+
+    def bench_find_image_file(self, repeat):
+        _, image_refs, _ = generate_markdown(**self.params)
+        md_file = self.md_file.relative_to(self.corpus_dir)
+
+        def resolve_all():
+            for ref in image_refs:
+                md2tex.find_image_file(md_file, ref)
+        return measure(resolve_all, lambda: (), repeat)
+
+    def raw_latex(self):
+        """pandoc直接生成、尚未后处理的LaTeX及SVG信息（不计时）"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            content, svg_files = md2tex.extract_and_save_svg(self.markdown, self.fresh_dir('raw'))
+            latex = md2tex.pandoc_convert_text(content, 'markdown', 'latex', standalone=True, listings=True)
+        return latex, svg_files
+
+    def bench_post_process_latex(self, repeat):
+        latex, svg_files = self.raw_latex()
+
+        def setup():
+            tex_file = self.fresh_dir('post') / 'doc.tex'
+            tex_file.write_text(latex, encoding='utf-8')
+            return tex_file, svg_files
+        return measure(md2tex.post_process_latex, setup, repeat)
+
+    def bench_convert_md_to_latex(self, repeat):
+        return measure(md2tex.convert_md_to_latex,
+                       lambda: (self.md_file, self.fresh_dir('convert'), self.template), repeat)
+
+    def bench_compile_latex(self, repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            tex_file = Path(md2tex.convert_md_to_latex(self.md_file, self.fresh_dir('tex'), self.template))
+
+        def setup():
+            target = self.fresh_dir('compile')
+            shutil.copy(tex_file, target)
+            shutil.copytree(tex_file.parent / 'pics', target / 'pics')
+            return target / tex_file.name,
+        return measure(md2tex.compile_latex, setup, repeat)
+
+
+def run_axis(axis, values, components, repeat, workdir, template):
+    """沿一个参数扫描，返回 {取值: {环节: 耗时样本}}"""
+    results = {}
+    for value in values:
+        params = dict(BASE_PARAMS, **{axis: value})
+        bench = CorpusBench(Path(workdir) / f"{axis}_{value}", params, template)
+        current_dir = os.getcwd()
+        # find_image_file 和资源索引以当前工作目录为项目根目录
+        os.chdir(bench.corpus_dir)
+        try:
+            results[value] = {name: getattr(bench, f"bench_{name}")(repeat) for name in components}
+        finally:
+            os.chdir(current_dir)
+        print(f"  {axis}={value} 完成", file=sys.stderr)
+    return results
+
+
+def slope(values, medians):
+    """最小二乘拟合的每单位参数耗时增量（毫秒）"""
+    if len(values) < 2:
+        return None
+    mean_x = statistics.mean(values)
+    mean_y = statistics.mean(medians)
+    denominator = sum((x - mean_x) ** 2 for x in values)
+    if denominator == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(values, medians)) / denominator * 1000
+
+
+def print_axis_report(axis, results, components):
+    values = list(results)
+    width = max(len(name) for name in components) + 2
+    print(f"\n## {axis}（中位数耗时，毫秒）")
+    print(f"{axis:>12}" + ''.join(f"{name:>{width}}" for name in components))
+    for value in values:
+        row = ''.join(f"{statistics.median(results[value][name]) * 1000:>{width}.1f}" for name in components)
+        print(f"{value:>12}" + row)
+    slopes = []
+    for name in components:
+        k = slope(values, [statistics.median(results[value][name]) for value in values])
+        slopes.append(f"{k:>{width}.3f}" if k is not None else f"{'-':>{width}}")
+    print(f"{'斜率/单位':>10}" + ''.join(slopes))
+
+
+def parse_latency(items):
+    latency = {}
+    for item in items or []:
+        tool, _, seconds = item.partition('=')
+        if tool not in TOOLS or not seconds:
+            raise argparse.ArgumentTypeError(f"无效的延迟设置: {item}（格式为 工具=秒，工具: {', '.join(TOOLS)}）")
+        latency[tool] = float(seconds)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description='md2latex_pandoc.py 各处理环节的基准测试')
+    parser.add_argument('--axis', action='append', choices=sorted(DEFAULT_AXES),
+                        help='要扫描的参数，可重复指定 (默认扫描全部参数)')
+    parser.add_argument('--values', default=None,
+                        help='扫描取值，逗号分隔 (只能与单个 --axis 一起使用)')
+    parser.add_argument('--component', action='append', choices=COMPONENTS,
+                        help='要计时的环节，可重复指定 (默认全部)')
+    parser.add_argument('--repeat', type=int, default=3, help='每个取值重复计时的次数 (默认3)')
+    parser.add_argument('--latency', action='append', metavar='TOOL=SECONDS',
+                        help='模拟工具每次调用的延迟，如 inkscape=0.05 (默认0)')
+    parser.add_argument('--real-tools', action='store_true',
+                        help='使用PATH中真实的pandoc/xelatex/inkscape，而不是模拟工具')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='SVG转换的并行线程数 (默认1)')
+    parser.add_argument('--workdir', default=None, help='语料和输出目录 (默认使用临时目录并在结束后删除)')
+    parser.add_argument('--json', metavar='FILE', default=None, help='将原始计时结果写入JSON文件')
+    args = parser.parse_args()
+
+    axes = args.axis or list(DEFAULT_AXES)
+    if args.values and len(axes) != 1:
+        parser.error('--values 只能与单个 --axis 一起使用')
+    try:
+        latency = parse_latency(args.latency)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    components = args.component or list(COMPONENTS)
+
+    # 只测量本工具自身的开销：关闭缓存和调试输出
+    md2tex.VERBOSE = False
+    md2tex.CACHE_ENABLED = False
+    md2tex.SVG_JOBS = args.jobs
+    template = str(REPO_ROOT / 'latex_style' / 'template.tex')
+
+    workdir = Path(args.workdir).resolve() if args.workdir else Path(tempfile.mkdtemp(prefix='md2tex_bench_'))
+    if not args.real_tools:
+        bin_dir = install_fake_toolchain(workdir / 'bin')
+        os.environ['PATH'] = str(bin_dir) + os.pathsep + os.environ.get('PATH', '')
+        # 模拟工具链中只有inkscape，不让本机的cairosvg或rsvg-convert绕过模拟的延迟
+        md2tex.SVG_BACKENDS = ('inkscape',)
+        for tool, seconds in latency.items():
+            os.environ[f"MD2TEX_FAKE_LATENCY_{tool.upper()}"] = str(seconds)
+
+    report = {'base': BASE_PARAMS, 'repeat': args.repeat, 'latency': latency,
+              'real_tools': args.real_tools, 'axes': {}}
+    try:
+        for axis in axes:
+            if args.values:
+                values = [type(BASE_PARAMS[axis])(value) for value in args.values.split(',')]
+            else:
+                values = DEFAULT_AXES[axis]
+            print(f"扫描 {axis}: {values}", file=sys.stderr)
+            results = run_axis(axis, values, components, args.repeat, workdir, template)
+            print_axis_report(axis, results, components)
+            report['axes'][axis] = [
+                {'value': value, 'samples': samples,
+                 'median': {name: statistics.median(times) for name, times in samples.items()}}
+                for value, samples in results.items()
+            ]
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n计时结果已写入: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
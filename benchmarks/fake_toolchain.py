@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试用的模拟工具链：pandoc、xelatex、xdvipdfmx、inkscape、kpsewhich、mmdc
+
+用法: fake_toolchain.py <工具名> [参数...]
+由 bench_md2tex.py 生成的包装脚本调用，只实现md2latex_pandoc.py用到的参数。
+每次调用的延迟（秒）通过环境变量 MD2TEX_FAKE_LATENCY_<工具名大写> 指定，
+未指定时使用 MD2TEX_FAKE_LATENCY（默认0）。
+"""
+
+import os
+import re
+import sys
+import time
+import hashlib
+
+
+def minimal_pdf(pages=1):
+    """生成指定页数的空白PDF，xref正确，可以被PDF库读取和合并"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               ("<< /Type /Pages /Kids [" + ' '.join(f"{3 + i} 0 R" for i in range(pages)) +
+                f"] /Count {pages} >>").encode('ascii')]
+    objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] >>"] * pages
+    pdf = bytearray(b"%PDF-1.5\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+MINIMAL_PDF = minimal_pdf()
+
+# 与pandoc生成的standalone LaTeX结构相同的简化导言区
+PANDOC_PREAMBLE = r"""% Options for packages loaded elsewhere
+\PassOptionsToPackage{unicode}{hyperref}
+\documentclass[
+  a4paper,
+  UTF8]{ctexart}
+\usepackage{xcolor}
+\usepackage{amsmath,amssymb}
+\usepackage{iftex}
+\ifPDFTeX
+  \usepackage[T1]{fontenc}
+\else % if luatex or xetex
+  \usepackage{unicode-math} % this also loads fontspec
+\fi
+\usepackage{listings}
+\newcommand{\passthrough}[1]{#1}
+\usepackage{graphicx}
+\makeatletter
+\newsavebox\pandoc@box
+\newcommand*\pandocbounded[1]{\sbox\pandoc@box{#1}\usebox{\pandoc@box}}
+\makeatother
+\usepackage{hyperref}
+\hypersetup{
+  pdftitle={@TITLE@},
+  hidelinks}
+
+\title{@TITLE@}
+\author{}
+\date{}
+
+\begin{document}
+\maketitle
+
+"""
+
+IMAGE_LINE = re.compile(r'^!\[(.*?)\]\((.*?)\)\s*$')
+LABEL = re.compile(r'\\label\{([^}]*)\}')
+INCLUDE = re.compile(r'\\include\{([^}]*)\}')
+# 每页按此字符数估算章节页数
+CHARS_PER_PAGE = 2000
+MERMAID_FENCE = re.compile(r'^```mermaid\n(.*?)^```', re.MULTILINE | re.DOTALL)
+INLINE_CITATION = re.compile(r'\[(@[^\]]+)\]')
+INLINE_MATH = re.compile(r'\$([^$]+)\$')
+
+
+def simulate_latency(tool):
+    latency = os.environ.get(f"MD2TEX_FAKE_LATENCY_{tool.upper()}",
+                             os.environ.get('MD2TEX_FAKE_LATENCY', '0'))
+    time.sleep(float(latency or 0))
+
+
+def option_value(args, *names):
+    """取出 --name value 或 --name=value 形式的参数值"""
+    for i, arg in enumerate(args):
+        for name in names:
+            if arg == name and i + 1 < len(args):
+                return args[i + 1]
+            if arg.startswith(name + '='):
+                return arg.split('=', 1)[1]
+    return None
+
+
+def positional_args(args, options_with_value):
+    values = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in options_with_value:
+            skip = True
+        elif not arg.startswith('-'):
+            values.append(arg)
+    return values
+
+
+def escape_text(text):
+    for char in ('%', '&', '#', '_'):
+        text = text.replace(char, '\\' + char)
+    return text
+
+
+def render_inline(text, citations):
+    """行内元素：数学公式、引用和需要转义的字符"""
+    parts = []
+    last = 0
+    for match in INLINE_MATH.finditer(text):
+        parts.append(escape_text(text[last:match.start()]))
+        parts.append(f"\\({match.group(1)}\\)")
+        last = match.end()
+    parts.append(escape_text(text[last:]))
+    text = ''.join(parts)
+
+    def citation(match):
+        keys = [key.strip().lstrip('@') for key in match.group(1).split(';')]
+        citations.update(keys)
+        return '\\citeproc{' + ' '.join(f"ref-{key}" for key in keys) + '}{(' + '; '.join(keys) + ')}'
+    return INLINE_CITATION.sub(citation, text)
+
+
+def markdown_to_latex(markdown, standalone, listings, citeproc):
+    """按行把Markdown粗略转换为pandoc风格的LaTeX"""
+    title = 'Untitled'
+    lines = markdown.split('\n')
+    if lines and lines[0].strip() == '---':
+        end = next((i for i in range(1, len(lines)) if lines[i].strip() == '---'), 0)
+        for line in lines[1:end]:
+            if line.startswith('title:'):
+                title = line.split(':', 1)[1].strip().strip('"\'')
+        lines = lines[end + 1:]
+
+    body = []
+    citations = set()
+    paragraph = []
+    in_code = False
+
+    def flush():
+        if paragraph:
+            body.append(render_inline(' '.join(paragraph), citations) + '\n')
+            paragraph.clear()
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('```'):
+            flush()
+            if in_code:
+                body.append('\\end{lstlisting}\n' if listings else '\\end{verbatim}\n')
+            else:
+                language = stripped[3:].strip()
+                if listings:
+                    body.append(f"\\begin{{lstlisting}}[language={language}]" if language else '\\begin{lstlisting}')
+                else:
+                    body.append('\\begin{verbatim}')
+            in_code = not in_code
+            continue
+        if in_code:
+            body.append(line)
+            continue
+        if not stripped:
+            flush()
+            continue
+        heading = re.match(r'^(#{1,3})\s+(.*)$', stripped)
+        image = IMAGE_LINE.match(stripped)
+        if heading:
+            flush()
+            command = ('section', 'subsection', 'subsubsection')[len(heading.group(1)) - 1]
+            label = hashlib.md5(heading.group(2).encode('utf-8')).hexdigest()[:8]
+            body.append(f"\\{command}{{{render_inline(heading.group(2), citations)}}}\\label{{sec-{label}}}\n")
+        elif image:
+            flush()
+            caption, path = image.group(1), image.group(2)
+            body.append("\\begin{figure}\n\\centering\n"
+                        f"\\pandocbounded{{\\includegraphics[keepaspectratio,alt={{{caption}}}]{{{path}}}}}\n"
+                        f"\\caption{{{caption}}}\n\\end{{figure}}\n")
+        else:
+            paragraph.append(stripped)
+    flush()
+
+    if citeproc and citations:
+        body.append('\\protect\\phantomsection\\label{refs}\n\\begin{CSLReferences}{1}{1}')
+        for key in sorted(citations):
+            body.append(f"\\bibitem[\\citeproctext]{{ref-{key}}}\n{key}. \\emph{{Title}}.\n")
+        body.append('\\end{CSLReferences}\n')
+
+    content = '\n'.join(body)
+    if standalone:
+        content = PANDOC_PREAMBLE.replace("@TITLE@", title) + content + '\n\\end{document}\n'
+    return content
+
+
+def fake_pandoc(args):
+    if '--version' in args:
+        print("pandoc 3.1.11 (md2tex benchmark stub)")
+        return 0
+    if args and args[0] == 'server':
+        print("模拟的pandoc不支持server模式", file=sys.stderr)
+        return 1
+    from_format = option_value(args, '-f', '--from') or 'markdown'
+    to_format = option_value(args, '-t', '--to') or 'latex'
+    if 'json' in (from_format, to_format):
+        print("模拟的pandoc不支持JSON AST", file=sys.stderr)
+        return 1
+    simulate_latency('pandoc')
+
+    inputs = positional_args(args, {'-o', '-f', '-t', '--from', '--to', '--bibliography'})
+    if inputs:
+        with open(inputs[0], 'r', encoding='utf-8') as f:
+            markdown = f.read()
+    else:
+        markdown = sys.stdin.buffer.read().decode('utf-8')
+    latex = markdown_to_latex(markdown, '-s' in args or '--standalone' in args,
+                              '--listings' in args, '--citeproc' in args)
+    output = option_value(args, '-o', '--output')
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(latex)
+    else:
+        sys.stdout.buffer.write(latex.encode('utf-8'))
+    return 0
+
+
+def read_text(*paths):
+    """读取第一个存在的文件，都不存在时返回None"""
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+    return None
+
+
+def typeset_includes(includes, include_only, output_dir):
+    """模拟\\include/\\includeonly：排版选中的章节并写入其.aux，其余章节从.aux恢复页码
+
+    返回 (主.aux内容, {章节.aux路径: 内容}, 排版的页数)。
+    """
+    page = 1
+    typeset = 0
+    chapter_aux = {}
+    for name in includes:
+        if include_only is None or name in include_only:
+            with open(name + '.tex', 'r', encoding='utf-8') as f:
+                text = f.read()
+            pages = 1 + len(text) // CHARS_PER_PAGE
+            labels = ''.join(f"\\newlabel{{{label}}}{{{{{i}}}{{{page}}}}}\n"
+                             for i, label in enumerate(LABEL.findall(text), 1))
+            page += pages
+            typeset += pages
+            chapter_aux[os.path.join(output_dir, name + '.aux')] = (
+                f"\\relax\n{labels}\\@setckpt{{{name}}}{{\n\\setcounter{{page}}{{{page}}}\n}}\n")
+        else:
+            # 未排版的章节：与LaTeX相同，先在输出目录中查找.aux，再查找当前目录
+            aux = read_text(os.path.join(output_dir, name + '.aux'), name + '.aux') or ''
+            match = re.search(r'\\setcounter\{page\}\{(\d+)\}', aux[aux.find('\\@setckpt'):])
+            if match:
+                page = int(match.group(1))
+    main_aux = '\\relax\n' + ''.join(f"\\@input{{{name}.aux}}\n" for name in includes)
+    return main_aux, chapter_aux, typeset
+
+
+def fake_xelatex(args):
+    if '--version' in args:
+        print("XeTeX 3.141592653-2.6-0.999995 (md2tex benchmark stub)")
+        return 0
+    if '-ini' in args:
+        # 不模拟格式文件转储，md2latex_pandoc.py会改用完整导言区
+        print("模拟的xelatex不支持 -ini", file=sys.stderr)
+        return 1
+    simulate_latency('xelatex')
+
+    output_dir = option_value(args, '-output-directory') or '.'
+    source = positional_args(args, set())[-1]
+    include_only = None
+    if source.startswith('\\'):
+        # 命令行中的TeX代码，只识别 \includeonly{...} 和 \input{文件}
+        match = re.search(r'\\includeonly\{([^}]*)\}', source)
+        if match:
+            include_only = set(match.group(1).split(','))
+        source = re.search(r'\\input\{([^}]*)\}', source).group(1)
+    tex_file = source if source.endswith('.tex') else source + '.tex'
+    stem = option_value(args, '-jobname') or os.path.splitext(os.path.basename(tex_file))[0]
+    base = os.path.join(output_dir, stem)
+    with open(tex_file, 'r', encoding='utf-8', errors='replace') as f:
+        content = f.read()
+    includes = INCLUDE.findall(content)
+    if includes:
+        aux, chapter_aux, pages = typeset_includes(includes, include_only, output_dir)
+    else:
+        labels = LABEL.findall(content)
+        aux = '\\relax\n' + ''.join(f"\\newlabel{{{label}}}{{{{{i}}}{{1}}}}\n" for i, label in enumerate(labels, 1))
+        chapter_aux = {}
+        pages = 1 + len(content) // CHARS_PER_PAGE
+    # 第一次编译时写入交叉引用信息并提示需要重新编译，之后辅助文件保持不变
+    outputs = dict(chapter_aux, **{base + '.aux': aux})
+    changed = any(read_text(path) != text for path, text in outputs.items())
+    for path, text in outputs.items():
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    log = ["This is XeTeX (md2tex benchmark stub)", f"({tex_file}"]
+    if changed and '\\newlabel' in ''.join(outputs.values()):
+        log.append("LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.")
+    output = base + ('.xdv' if '-no-pdf' in args else '.pdf')
+    log.append(f"Output written on {output} ({pages} pages).")
+    with open(base + '.log', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(log) + '\n')
+    with open(output, 'wb') as f:
+        f.write(minimal_pdf(pages))
+    print('\n'.join(log))
+    return 0
+
+
+def fake_xdvipdfmx(args):
+    if '--version' in args:
+        print("xdvipdfmx (md2tex benchmark stub)")
+        return 0
+    simulate_latency('xdvipdfmx')
+    output = option_value(args, '-o')
+    # 模拟的XDV就是PDF，直接复制以保留页数
+    inputs = positional_args(args, {'-o'})
+    with open(inputs[-1], 'rb') as f:
+        pdf = f.read()
+    with open(output, 'wb') as f:
+        f.write(pdf)
+    return 0
+
+
+def fake_inkscape_shell():
+    """模拟 inkscape --shell：逐行读取命令，每条命令结束后输出提示符"""
+    sys.stdout.write("Inkscape interactive shell mode. Type 'action-list' to list all actions.\n> ")
+    sys.stdout.flush()
+    for line in sys.stdin:
+        line = line.strip()
+        if line == 'quit':
+            break
+        output = None
+        for action in line.split(';'):
+            if action.startswith('export-filename:'):
+                output = action.split(':', 1)[1]
+        simulate_latency('inkscape')
+        if output:
+            with open(output, 'wb') as f:
+                f.write(MINIMAL_PDF)
+        sys.stdout.write("> ")
+        sys.stdout.flush()
+    return 0
+
+
+def fake_inkscape(args):
+    if '--version' in args:
+        print("Inkscape 1.2.2 (md2tex benchmark stub)")
+        return 0
+    if '--shell' in args:
+        return fake_inkscape_shell()
+    simulate_latency('inkscape')
+    output = option_value(args, '--export-filename', '-o')
+    if not output:
+        print("缺少 --export-filename", file=sys.stderr)
+        return 1
+    with open(output, 'wb') as f:
+        f.write(MINIMAL_PDF)
+    return 0
+
+
+def fake_kpsewhich(args):
+    # 找不到mylatexformat，--latex-format会直接退回完整导言区
+    return 1
+
+
+def fake_mmdc(args):
+    """模拟mermaid-cli：输入为.md时渲染其中所有mermaid代码块，输出 <文件名>-<序号>.pdf
+
+    图表中包含INVALID时模拟语法错误，整个文件渲染失败。
+    """
+    if '--version' in args or '-V' in args:
+        print("10.9.1")
+        return 0
+    simulate_latency('mmdc')
+    source = option_value(args, '-i', '--input')
+    output = option_value(args, '-o', '--output')
+    if not source or not output:
+        print("缺少 -i 或 -o", file=sys.stderr)
+        return 1
+    text = read_text(source)
+    if source.endswith('.md'):
+        diagrams = MERMAID_FENCE.findall(text)
+        stem, ext = os.path.splitext(output)
+        outputs = [f"{stem}-{i}{ext}" for i in range(1, len(diagrams) + 1)]
+    else:
+        diagrams, outputs = [text], [output]
+    if any('INVALID' in code for code in diagrams):
+        print("Error: Parse error on line 1", file=sys.stderr)
+        return 1
+    for path in outputs:
+        with open(path, 'wb') as f:
+            f.write(MINIMAL_PDF)
+    return 0
+
+
+TOOLS = {
+    'pandoc': fake_pandoc,
+    'xelatex': fake_xelatex,
+    'xdvipdfmx': fake_xdvipdfmx,
+    'inkscape': fake_inkscape,
+    'kpsewhich': fake_kpsewhich,
+    'mmdc': fake_mmdc,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in TOOLS:
+        print(f"用法: {sys.argv[0]} <{'|'.join(TOOLS)}> [参数...]", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(TOOLS[sys.argv[1]](sys.argv[2:]))
@@ -9,104 +9,1152 @@ import shutil
 from pathlib import Path
 import re
 import base64
+import hashlib
+import tempfile
+import time
+import queue
+import select
+import concurrent.futures
+import threading
+import io
+import json
+import asyncio
+import xml.etree.ElementTree as ET
+import bisect
+import glob
+import contextlib
+import contextvars
+import collections
+import traceback
+import multiprocessing
+import mmap
+import signal
+import socket
+import atexit
+import abc
+import urllib.request
+import urllib.error
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，峰值内存不可用
+    resource = None
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，资源暂存不使用reflink
+    fcntl = None
+try:
+    import PIL
+    from PIL import Image
+except ImportError:  # Pillow是可选依赖，未安装时栅格图片直接复制
+    PIL = Image = None
+try:
+    import pypdf
+except ImportError:  # pypdf是可选依赖，未安装时用qpdf/pdfunite合并章节PDF
+    pypdf = None
+try:
+    import cairosvg
+except (ImportError, OSError):  # cairosvg是可选依赖；已安装但找不到cairo库时导入会抛出OSError
+    cairosvg = None
 
-def extract_and_save_svg(content, output_dir):
-    """从Markdown内容中提取SVG代码并保存到文件，并转换为PDF"""
-    # 创建保存SVG的目录
-    pics_dir = output_dir / 'pics'
-    if not pics_dir.exists():
-        pics_dir.mkdir(parents=True)
+# 转换结果缓存配置（可通过命令行参数修改）
+CACHE_ENABLED = True
+CACHE_DIR = None                        # None 表示使用默认缓存目录
+CACHE_MAX_BYTES = 512 * 1024 * 1024     # 缓存总大小上限，超出后按LRU淘汰
+
+# SVG转换的并行配置
+SVG_JOBS = os.cpu_count() or 1          # 并行转换的工作线程数
+INKSCAPE_SHELL = False                  # 是否使用 inkscape --shell 批处理模式
+SVG_BACKENDS = None                     # 允许使用的SVG转换后端名称，None表示所有可用的后端
+
+# xelatex最多编译次数（交叉引用稳定后提前停止）
+MAX_LATEX_PASSES = 4
+
+# 使用预编译的xelatex格式文件加载固定的导言区
+LATEX_FORMAT = False
+
+# 输出各阶段耗时等性能剖析报告（JSON）
+PROFILE = False
+
+# 资源索引持久化文件（None 表示不持久化）
+ASSET_INDEX_FILE = None
+
+# 常驻pandoc服务：None 表示每次启动pandoc进程，'auto' 表示在本机启动 pandoc server，
+# 其他值为已有服务的地址
+PANDOC_SERVER = None
+
+# 使用pandoc JSON AST模式（进程内转换AST，代替对LaTeX的多轮正则后处理）
+PANDOC_AST = False
+
+# 查找图片等资源的项目根目录（None 表示当前工作目录）
+PROJECT_ROOT = None
+
+# 栅格图片优化：按渲染宽度下的目标DPI缩小PNG/JPEG并重新压缩（None 表示直接复制原图）
+IMAGE_DPI = None
+IMAGE_QUALITY = 85                      # JPEG重新压缩的质量
+
+# 长文档按顶层标题拆分为\include的章节并行编译：None 表示整体编译，
+# 其他值为同时编译的章节数（0 表示CPU核数）
+SPLIT_CHAPTERS = None
+
+# Converter.convert() 期间（或命令行 --char-map 设置的）生效的配置，未设置时使用上面的模块级全局配置
+_ACTIVE_SETTINGS = contextvars.ContextVar('md2tex_settings', default=None)
+
+def setting(name):
+    """返回当前生效的配置项：在Converter.convert()内为其配置，否则为同名全局变量"""
+    settings = _ACTIVE_SETTINGS.get()
+    if settings is not None and name in settings:
+        return settings[name]
+    return globals()[name]
+
+def project_root():
+    """查找资源的项目根目录"""
+    return Path(setting('PROJECT_ROOT') or '.')
+
+# 外部工具版本信息缓存，避免重复启动进程查询
+_TOOL_VERSIONS = {}
+
+def default_cache_dir():
+    """返回默认的缓存根目录（可通过环境变量MD2TEX_CACHE_DIR覆盖）"""
+    if os.environ.get('MD2TEX_CACHE_DIR'):
+        return Path(os.environ['MD2TEX_CACHE_DIR'])
+    base = os.environ.get('XDG_CACHE_HOME') or (Path.home() / '.cache')
+    return Path(base) / 'md2tex'
+
+def get_tool_version(tool):
+    """获取外部工具的版本字符串，结果在进程内缓存"""
+    if tool not in _TOOL_VERSIONS:
+        version = None
+        try:
+            with profile_tool(f"{tool} --version"):
+                result = subprocess.run(
+                    [tool, '--version'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    check=False
+                )
+            if result.returncode == 0:
+                lines = result.stdout.decode('utf-8', errors='ignore').strip().splitlines()
+                version = lines[0].strip() if lines else 'unknown'
+        except (FileNotFoundError, OSError):
+            version = None
+        _TOOL_VERSIONS[tool] = version
+    return _TOOL_VERSIONS[tool]
+
+class BuildProfiler:
+    """构建性能剖析：记录各阶段和外部进程的墙钟时间、CPU时间、计数以及峰值内存
+
+    阶段可以嵌套，时间均为包含子阶段的累计值。CPU时间分为本进程（所有线程）和已结束
+    子进程两部分；并行执行的阶段会相互计入对方的CPU时间。
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.tools = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = self._cpu()
+
+    @staticmethod
+    def _cpu():
+        times = os.times()
+        return times.user + times.system, times.children_user + times.children_system
+
+    @contextlib.contextmanager
+    def _measure(self, table, name):
+        wall = time.perf_counter()
+        own, children = self._cpu()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            own_end, children_end = self._cpu()
+            with self.lock:
+                entry = table.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'children_cpu': 0.0})
+                entry['calls'] += 1
+                entry['wall'] += wall
+                entry['cpu'] += own_end - own
+                entry['children_cpu'] += children_end - children
+
+    def stage(self, name):
+        return self._measure(self.stages, name)
+
+    def tool(self, name):
+        return self._measure(self.tools, name)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @staticmethod
+    def peak_rss():
+        """本进程和子进程的峰值常驻内存（KB），无法获取时为None"""
+        if resource is None:
+            return None
+        # Linux以KB为单位，macOS以字节为单位
+        scale = 1024 if sys.platform == 'darwin' else 1
+        return {
+            'self_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            'children_kb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale
+        }
+
+    def report(self, **extra):
+        own, children = self._cpu()
+        def rounded(table):
+            return {name: {key: round(value, 4) if isinstance(value, float) else value
+                           for key, value in entry.items()}
+                    for name, entry in table.items()}
+        report = dict(extra)
+        report.update({
+            'wall': round(time.perf_counter() - self.start_wall, 4),
+            'cpu': round(own - self.start_cpu[0], 4),
+            'children_cpu': round(children - self.start_cpu[1], 4),
+            'stages': rounded(self.stages),
+            'subprocesses': rounded(self.tools),
+            'counters': dict(sorted(self.counters.items())),
+            'peak_rss': self.peak_rss()
+        })
+        return report
+
+# 当前构建的性能剖析器，未启用 --profile 时为None（按上下文区分并发的构建）
+_ACTIVE_PROFILER = contextvars.ContextVar('md2tex_profiler', default=None)
+
+def profile_stage(name):
+    """统计一个构建阶段的耗时（未启用剖析时不做任何事）"""
+    profiler = _ACTIVE_PROFILER.get()
+    return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
+
+def profile_tool(name):
+    """统计一次外部进程调用的耗时"""
+    profiler = _ACTIVE_PROFILER.get()
+    return profiler.tool(name) if profiler is not None else contextlib.nullcontext()
+
+def profile_count(name, amount=1):
+    profiler = _ACTIVE_PROFILER.get()
+    if profiler is not None:
+        profiler.count(name, amount)
+
+def profile_pass(name, before, after):
+    """记录改变了内容的后处理步骤，返回处理后的内容"""
+    profiler = _ACTIVE_PROFILER.get()
+    if profiler is not None and before is not after and before != after:
+        profiler.count(f"post_process_changed.{name}")
+    return after
+
+# 超过上限时淘汰到上限的该比例
+CACHE_EVICT_RATIO = 0.9
+
+# 各缓存命名空间目录的已知总大小，首次写入时扫描一次，之后按写入的条目累加
+_CACHE_SIZES = {}
+_CACHE_SIZES_LOCK = threading.Lock()
+
+class ArtifactCache:
+    """基于内容哈希的持久化产物缓存，按总大小上限进行LRU淘汰
+
+    缓存条目以 <根目录>/<命名空间>/<哈希前两位>/<哈希><后缀> 的形式存放，
+    每次命中时刷新文件的修改时间，淘汰时优先删除最久未使用的条目。写入时只累加
+    总大小，超过上限时才扫描目录执行淘汰。
+    """
+
+    def __init__(self, cache_dir, namespace, max_bytes=CACHE_MAX_BYTES):
+        self.root = Path(cache_dir) / namespace
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(*parts):
+        """根据若干组成部分计算缓存键"""
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(part)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def path_for(self, key, suffix):
+        return self.root / key[:2] / f"{key}{suffix}"
+
+    def get(self, key, suffix):
+        """查找缓存条目，命中时返回路径并刷新其使用时间"""
+        path = self.path_for(key, suffix)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, suffix, src_path):
+        """将文件存入缓存并在需要时执行淘汰，返回缓存中的路径
+
+        只使用reflink或复制，不使用硬链接：调用方之后原地改写源文件时不能影响缓存条目。
+        """
+        return self._store(key, suffix, lambda tmp_name: link_or_copy(src_path, tmp_name, allow_hardlink=False))
+
+    def put_bytes(self, key, suffix, data):
+        """将数据直接写入缓存，返回缓存中的路径"""
+        def write(tmp_name):
+            with open(tmp_name, 'wb') as f:
+                f.write(data)
+        return self._store(key, suffix, write)
+
+    def _store(self, key, suffix, write):
+        path = self.path_for(key, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写入临时文件再原子替换，避免并发进程读到不完整的文件
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(tmp_name)
+            # mkstemp创建的文件只有属主可读，条目可能以链接的形式暂存到输出目录
+            os.chmod(tmp_name, 0o644)
+            size = os.path.getsize(tmp_name)
+            replaced = os.path.getsize(path) if path.exists() else 0
+            os.replace(tmp_name, path)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+        self._account(size - replaced)
+        return path
+
+    def _account(self, delta):
+        """累加命名空间的总大小，首次写入或超过上限时扫描目录并淘汰"""
+        if not self.max_bytes:
+            return
+        key = str(self.root)
+        with _CACHE_SIZES_LOCK:
+            total = _CACHE_SIZES.get(key)
+            if total is not None and total + delta <= self.max_bytes:
+                _CACHE_SIZES[key] = total + delta
+                return
+            # 其他进程也可能写入同一缓存，需要淘汰时重新统计实际大小
+            _CACHE_SIZES[key] = self.evict()
+
+    def evict(self):
+        """总大小超过上限时删除最久未使用的条目，返回淘汰后的总大小"""
+        if not self.max_bytes or not self.root.exists():
+            return 0
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                file_path = os.path.join(root, name)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, file_path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return total
+        # 淘汰到上限以下留出余量，缓存写满后不必每次写入都重新扫描
+        target = self.max_bytes * CACHE_EVICT_RATIO
+        entries.sort()
+        for mtime, size, file_path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(file_path)
+                total -= size
+                debug_print(f"缓存淘汰: {file_path}")
+            except OSError:
+                pass
+        return total
+
+def get_artifact_cache(namespace):
+    """按当前配置返回指定命名空间的缓存，禁用缓存时返回None"""
+    if not setting('CACHE_ENABLED'):
+        return None
+    return ArtifactCache(setting('CACHE_DIR') or default_cache_dir(), namespace, setting('CACHE_MAX_BYTES'))
+
+# Linux的FICLONE ioctl：在btrfs、XFS等文件系统上创建共享数据块的写时复制副本
+FICLONE = 0x40049409
+# 已知不支持reflink/硬链接的 (源设备, 目标设备)，不再重复尝试
+_NO_REFLINK = set()
+_NO_HARDLINK = set()
+
+def _reflink(source, target):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+    shutil.copystat(source, target)
+    return True
+
+def link_or_copy(source, target, allow_copy=True, allow_hardlink=True):
+    """用reflink或硬链接把source放到target（原子替换已有文件），文件系统都不支持时复制
+
+    复制时保留源文件的修改时间。返回使用的方式 'reflink'、'hardlink' 或 'copy'；
+    allow_copy为False且无法链接时返回None，不修改target。allow_hardlink为False时
+    不使用硬链接，两个文件不共享inode。
+    """
+    target = Path(target)
+    devices = (os.stat(source).st_dev, os.stat(target.parent).st_dev)
+    tmp_name = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        if devices not in _NO_REFLINK and _reflink(source, tmp_name):
+            method = 'reflink'
+        else:
+            _NO_REFLINK.add(devices)
+            method = None
+            if allow_hardlink and devices not in _NO_HARDLINK:
+                try:
+                    os.link(source, tmp_name)
+                    method = 'hardlink'
+                except OSError:
+                    _NO_HARDLINK.add(devices)
+            if method is None:
+                if not allow_copy:
+                    return None
+                shutil.copy2(source, tmp_name)
+                method = 'copy'
+        os.replace(tmp_name, target)
+        return method
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def stage_file(source, target):
+    """把资源文件放到输出目录：内容未变时跳过，否则优先使用reflink或硬链接，不支持时才复制
+
+    已暂存的文件通过inode或大小和修改时间判断是否过期，不读取文件内容；只有无法链接、
+    且大小相同而修改时间不同时才比较哈希，内容相同则只更新修改时间。
+    返回 'skip'、'reflink'、'hardlink' 或 'copy'。
+    """
+    source_stat = os.stat(source)
+    try:
+        target_stat = os.stat(target)
+    except FileNotFoundError:
+        target_stat = None
+    if target_stat is not None and (
+            (source_stat.st_dev, source_stat.st_ino) == (target_stat.st_dev, target_stat.st_ino)
+            or (source_stat.st_size == target_stat.st_size and source_stat.st_mtime_ns == target_stat.st_mtime_ns)):
+        profile_count('staged_unchanged')
+        return 'skip'
     
-    # 定义正则表达式来匹配SVG代码块
-    svg_pattern = r'<svg[^>]*>[\s\S]*?</svg>'
-    svg_matches = re.finditer(svg_pattern, content)
+    same_size = target_stat is not None and source_stat.st_size == target_stat.st_size
+    method = link_or_copy(source, target, allow_copy=not same_size)
+    if method is None:
+        if file_sha256(source) == file_sha256(target):
+            os.utime(target, ns=(target_stat.st_atime_ns, source_stat.st_mtime_ns))
+            profile_count('staged_unchanged')
+            return 'skip'
+        method = link_or_copy(source, target)
+    profile_count('staged_copied' if method == 'copy' else 'staged_linked')
+    return method
+
+class InkscapeShell:
+    """驱动一个长期运行的 inkscape --shell 进程，批量执行导出命令，避免每张图都重新启动inkscape"""
+
+    PROMPT = b'> '
+
+    def __init__(self, timeout=120):
+        self.timeout = timeout
+        self.proc = subprocess.Popen(
+            ['inkscape', '--shell'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        if not self._read_until_prompt():
+            self.close()
+            raise RuntimeError("inkscape --shell 启动失败")
+
+    def _read_until_prompt(self):
+        """读取输出直到出现命令提示符，超时或进程退出时返回False"""
+        fd = self.proc.stdout.fileno()
+        buffer = b''
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                return False
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                return False
+            buffer = (buffer + chunk)[-256:]
+            if buffer.endswith(self.PROMPT) and (len(buffer) == 2 or buffer[-3:-2] in (b'\n', b'\r')):
+                return True
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def export(self, svg_path, pdf_path):
+        """导出一个SVG为PDF，返回(是否成功, 错误信息)"""
+        pdf_path = Path(pdf_path)
+        if pdf_path.exists():
+            pdf_path.unlink()
+        command = (f"file-open:{Path(svg_path).resolve()};"
+                   f"export-filename:{pdf_path.resolve()};"
+                   f"export-area-drawing;export-do;file-close\n")
+        try:
+            self.proc.stdin.write(command.encode('utf-8'))
+            self.proc.stdin.flush()
+        except OSError as e:
+            return False, str(e)
+        if not self._read_until_prompt():
+            self.close()
+            return False, "inkscape --shell 无响应"
+        if pdf_path.exists():
+            return True, None
+        return False, "inkscape --shell 未生成PDF文件"
+
+    def close(self):
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.write(b"quit\n")
+                self.proc.stdin.flush()
+                self.proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+
+def run_svg_export(tool, command, pdf_path):
+    """运行一个SVG导出命令，返回(是否成功, 错误信息)"""
+    try:
+        with profile_tool(tool):
+            result = subprocess.run(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=False  # 不立即检查，以便捕获错误
+            )
+    except Exception as e:
+        return False, str(e)
+    if result.returncode == 0 and Path(pdf_path).exists():
+        return True, None
+    return False, result.stderr.decode('utf-8', errors='ignore')
+
+async def run_svg_export_async(tool, command, pdf_path):
+    """run_svg_export的asyncio版本：在事件循环中等待导出子进程，返回(是否成功, 错误信息)"""
+    try:
+        with profile_tool(tool):
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+    except Exception as e:
+        return False, str(e)
+    if process.returncode == 0 and Path(pdf_path).exists():
+        return True, None
+    return False, stderr.decode('utf-8', errors='ignore')
+
+def inkscape_export_command(svg_path, pdf_path):
+    return ['inkscape',
+            str(svg_path),
+            '--export-filename', str(pdf_path),
+            '--export-area-drawing']
+
+def convert_svg_to_pdf(svg_path, pdf_path):
+    """调用inkscape将SVG转换为PDF，返回(是否成功, 错误信息)"""
+    return run_svg_export('inkscape', inkscape_export_command(svg_path, pdf_path), pdf_path)
+
+def rsvg_export_command(svg_path, pdf_path):
+    return ['rsvg-convert', '-f', 'pdf', '-o', str(pdf_path), str(svg_path)]
+
+def render_svg_with_cairosvg(svg_path, pdf_path):
+    """在本进程中用cairosvg将SVG转换为PDF，返回(是否成功, 错误信息)"""
+    try:
+        cairosvg.svg2pdf(url=str(svg_path), write_to=str(pdf_path))
+    except Exception as e:
+        return False, f"{type(e).__name__}: {e}"
+    if Path(pdf_path).exists():
+        return True, None
+    return False, "cairosvg未生成PDF文件"
+
+# cairosvg不支持的SVG特性：foreignObject（HTML内容）以及除feOffset/feFlood/feBlend以外的滤镜
+CAIROSVG_UNSUPPORTED = re.compile(r'<(?:foreignObject|fe(?!Offset\b|Flood\b|Blend\b)[A-Za-z]+)\b')
+# rsvg-convert不渲染foreignObject
+RSVG_UNSUPPORTED = re.compile(r'<foreignObject\b')
+
+class SvgBackend(abc.ABC):
+    """SVG转PDF后端：unsupported匹配该后端无法正确渲染的SVG特性"""
+
+    name = None
+    unsupported = None
+    # 在本进程中渲染而不是启动外部进程，多个工作线程时交给进程池执行
+    in_process = False
+
+    @abc.abstractmethod
+    def version(self):
+        """后端的版本字符串，不可用时返回None"""
+
+    def supports(self, svg_code):
+        return self.unsupported is None or not self.unsupported.search(svg_code)
+
+    @abc.abstractmethod
+    def convert(self, svg_path, pdf_path):
+        """转换一个SVG，返回(是否成功, 错误信息)"""
+
+    def command(self, svg_path, pdf_path):
+        """单次转换的外部命令，供asyncio子进程直接运行；不通过外部命令转换的后端返回None"""
+        return None
+
+class CairoSvgBackend(SvgBackend):
+    """cairosvg：没有进程启动开销，但不支持foreignObject和大部分滤镜"""
+
+    name = 'cairosvg'
+    unsupported = CAIROSVG_UNSUPPORTED
+    in_process = True
+
+    def version(self):
+        return f"cairosvg {cairosvg.__version__}" if cairosvg is not None else None
+
+    def convert(self, svg_path, pdf_path):
+        with profile_tool('cairosvg'):
+            return render_svg_with_cairosvg(svg_path, pdf_path)
+
+class RsvgBackend(SvgBackend):
+    """rsvg-convert（librsvg）：启动快，支持滤镜"""
+
+    name = 'rsvg-convert'
+    unsupported = RSVG_UNSUPPORTED
+
+    def version(self):
+        return get_tool_version('rsvg-convert')
+
+    def convert(self, svg_path, pdf_path):
+        return run_svg_export(self.name, self.command(svg_path, pdf_path), pdf_path)
+
+    def command(self, svg_path, pdf_path):
+        return rsvg_export_command(svg_path, pdf_path)
+
+class InkscapeBackend(SvgBackend):
+    """Inkscape：支持的特性最全并裁剪到绘图区域，但每次启动都很慢"""
+
+    name = 'inkscape'
+
+    def version(self):
+        return get_tool_version('inkscape')
+
+    def convert(self, svg_path, pdf_path):
+        return convert_svg_to_pdf(svg_path, pdf_path)
+
+    def command(self, svg_path, pdf_path):
+        return inkscape_export_command(svg_path, pdf_path)
+
+# 所有SVG转换后端；尚未校准时按此顺序选用（进程内渲染没有启动开销）
+SVG_BACKEND_REGISTRY = (CairoSvgBackend(), RsvgBackend(), InkscapeBackend())
+# 各后端吞吐量的校准结果，保存在缓存目录中
+SVG_CALIBRATION_FILE = 'svg_backends.json'
+
+def svg_calibration_path():
+    return Path(setting('CACHE_DIR') or default_cache_dir()) / SVG_CALIBRATION_FILE
+
+def load_svg_calibration():
+    """读取SVG后端校准结果 {后端名称: {'version', 'figures_per_second', ...}}，没有时返回空字典"""
+    try:
+        with open(svg_calibration_path(), 'r', encoding='utf-8') as f:
+            backends = json.load(f).get('backends', {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+    return backends if isinstance(backends, dict) else {}
+
+def svg_backend_versions():
+    """可用SVG转换后端的名称和版本，作为增量构建的输入"""
+    return [[backend.name, backend.version()] for backend in svg_backends()]
+
+def svg_backends():
+    """可用的SVG转换后端，按校准得到的吞吐量从快到慢排列
+
+    只使用SVG_BACKENDS中允许的后端。校准时的版本与当前版本不同或尚未校准的后端排在
+    已校准的后端之后，校准时无法转换任何样本的后端排在最后。
+    """
+    allowed = setting('SVG_BACKENDS')
+    calibration = load_svg_calibration()
+    ranked = []
+    for index, backend in enumerate(SVG_BACKEND_REGISTRY):
+        if allowed and backend.name not in allowed:
+            continue
+        version = backend.version()
+        if not version:
+            continue
+        entry = calibration.get(backend.name) or {}
+        rate = entry.get('figures_per_second') if entry.get('version') == version else None
+        if rate is None:
+            rank = (1, index)
+        elif rate > 0:
+            rank = (0, -rate)
+        else:
+            rank = (2, index)
+        ranked.append((rank, backend))
+    ranked.sort(key=lambda item: item[0])
+    return [backend for _, backend in ranked]
+
+def svg_backend_candidates(backends, svg_code):
+    """支持该SVG特性的后端在前；其余后端排在最后，总比直接使用SVG文件好"""
+    supported = [backend for backend in backends if backend.supports(svg_code)]
+    return supported + [backend for backend in backends if backend not in supported]
+
+class SvgConverter:
+    """按后端顺序转换SVG：每张图选用支持其特性的最快后端，失败时依次回退到后面的后端
+
+    convert()由每个工作线程各用一个实例，convert_async()可以由多个协程共享一个实例。
+    use_shell时Inkscape后端先尝试本线程的inkscape --shell进程；指定pool时进程内渲染的
+    后端在进程池中执行，多张图可以同时渲染而不受GIL限制。
+    """
+
+    def __init__(self, backends, use_shell=False, pool=None):
+        self.backends = backends
+        self.use_shell = use_shell
+        self.pool = pool
+        self.shell = None
+        self.used_backend = None
+
+    def candidates(self, svg_path):
+        with open(svg_path, 'r', encoding='utf-8', errors='ignore') as f:
+            return svg_backend_candidates(self.backends, f.read())
+
+    def convert(self, svg_path, pdf_path):
+        """依次尝试各后端转换一个SVG，返回(是否成功, 错误信息)；成功时used_backend为实际使用的后端名称"""
+        errors = []
+        self.used_backend = None
+        for backend in self.candidates(svg_path):
+            ok, error = self._convert_with(backend, svg_path, pdf_path)
+            if self._attempted(backend, ok, error, svg_path, errors):
+                self.used_backend = backend.name
+                return True, None
+        return False, self._failure(errors)
+
+    async def convert_async(self, svg_path, pdf_path):
+        """convert()的asyncio版本，返回(是否成功, 错误信息, 实际使用的后端名称)
+
+        有外部命令的后端（rsvg-convert、单次调用的inkscape）直接作为asyncio子进程运行，
+        进程内渲染的后端交给进程池（没有时交给线程池）。多个协程可以共享同一个实例；
+        不使用inkscape --shell，它需要阻塞读取管道，由convert_svgs_parallel处理。
+        """
+        loop = asyncio.get_running_loop()
+        errors = []
+        for backend in self.candidates(svg_path):
+            command = backend.command(svg_path, pdf_path)
+            if command is not None:
+                ok, error = await run_svg_export_async(backend.name, command, pdf_path)
+            elif self.pool is not None:
+                with profile_tool(backend.name):
+                    try:
+                        ok, error = await loop.run_in_executor(self.pool, backend.convert, str(svg_path), str(pdf_path))
+                    except Exception as e:  # 工作进程异常退出
+                        ok, error = False, str(e)
+            else:
+                ok, error = await loop.run_in_executor(None, contextvars.copy_context().run,
+                                                       backend.convert, svg_path, pdf_path)
+            if self._attempted(backend, ok, error, svg_path, errors):
+                return True, None, backend.name
+        return False, self._failure(errors), None
+
+    @staticmethod
+    def _attempted(backend, ok, error, svg_path, errors):
+        """记录一次转换尝试，返回是否成功"""
+        if ok:
+            profile_count(f"svg_backend.{backend.name}")
+            return True
+        debug_print(f"{backend.name} 无法转换 {Path(svg_path).name}: {(error or '').strip()[-300:]}")
+        errors.append(f"{backend.name}: {error}")
+        return False
+
+    @staticmethod
+    def _failure(errors):
+        if not errors:
+            return "没有可用的SVG转换后端（需要cairosvg、rsvg-convert或Inkscape）"
+        return '; '.join(errors)
+
+    def _convert_with(self, backend, svg_path, pdf_path):
+        if backend.name == 'inkscape' and self.use_shell:
+            ok, error = self._export_with_shell(svg_path, pdf_path)
+            if ok:
+                return ok, error
+            # 批处理模式失败时回退到单次调用inkscape
+        if backend.in_process and self.pool is not None:
+            with profile_tool(backend.name):
+                try:
+                    return self.pool.submit(backend.convert, str(svg_path), str(pdf_path)).result()
+                except Exception as e:  # 工作进程异常退出
+                    return False, str(e)
+        return backend.convert(svg_path, pdf_path)
+
+    def _export_with_shell(self, svg_path, pdf_path):
+        if self.shell is None or not self.shell.alive():
+            try:
+                self.shell = InkscapeShell()
+            except (OSError, RuntimeError) as e:
+                debug_print(f"无法启动inkscape --shell，改用单次转换: {e}")
+                self.shell = None
+                self.use_shell = False
+                return False, str(e)
+        with profile_tool('inkscape --shell'):
+            return self.shell.export(svg_path, pdf_path)
+
+    def close(self):
+        if self.shell is not None:
+            self.shell.close()
+            self.shell = None
+
+def _svg_conversion_worker(task_queue, results, converter):
+    """工作线程：从队列中取出SVG逐个转换，批处理模式下复用同一个inkscape --shell进程"""
+    try:
+        while True:
+            try:
+                svg_path, pdf_path = task_queue.get_nowait()
+            except queue.Empty:
+                break
+            print(f"尝试将SVG转换为PDF: {Path(svg_path).name}")
+            ok, error = converter.convert(svg_path, pdf_path)
+            results[str(svg_path)] = (ok, error, converter.used_backend)
+    finally:
+        converter.close()
+
+# 待转换的SVG达到该数量时才为进程内渲染的后端启动进程池，图片较少时直接在工作线程中渲染
+SVG_PROCESS_POOL_MIN = 4
+
+def svg_process_pool(workers, task_count, backends):
+    """cairosvg渲染时持有GIL，多个工作线程时交给进程池才能真正并行；不需要时返回None"""
+    if workers > 1 and task_count >= SVG_PROCESS_POOL_MIN and any(backend.in_process for backend in backends):
+        # 此时pandoc和资源复制线程可能正在运行，fork会让子进程继承它们持有的锁，
+        # 因此由forkserver（不支持时用spawn）启动工作进程
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context(start_method))
+    return None
+
+def convert_svgs_parallel(tasks, jobs=1, use_shell=False, backends=None):
+    """使用有界工作池并行转换多个SVG
+
+    tasks为(svg_path, pdf_path)列表，返回 {str(svg_path): (是否成功, 错误信息, 实际使用的后端名称)}。
+    每张图依次尝试backends（默认为svg_backends()）中支持其特性的后端；use_shell为True时
+    每个工作线程驱动一个长期运行的inkscape --shell进程。
+    """
+    if backends is None:
+        backends = svg_backends()
+    task_queue = queue.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    results = {}
+    # inkscape --shell 依赖select读取管道，仅在POSIX系统上启用
+    use_shell = use_shell and os.name == 'posix'
+    workers = max(1, min(jobs or 1, len(tasks)))
+    pool = svg_process_pool(workers, len(tasks), backends)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # 工作线程继承当前上下文（配置、性能剖析器）
+            futures = [executor.submit(contextvars.copy_context().run, _svg_conversion_worker,
+                                       task_queue, results, SvgConverter(backends, use_shell, pool))
+                       for _ in range(workers)]
+            for future in futures:
+                future.result()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return results
+
+def calibration_svgs():
+    """内置的校准样本：柱状图（含中文文字）、折线图、带渐变和箭头的流程图、大量图元的散点图"""
+    header = '<svg xmlns="http://www.w3.org/2000/svg" width="640" height="400" viewBox="0 0 640 400">'
+    bars = ''.join(f'<rect x="{60 + i * 70}" y="{360 - 25 * (i % 7 + 2)}" width="40" height="{25 * (i % 7 + 2)}" '
+                   f'fill="#4a7ebb"/><text x="{80 + i * 70}" y="385" text-anchor="middle" '
+                   f'font-size="14">第{i + 1}组</text>' for i in range(8))
+    bar_chart = (f'{header}<title>柱状图</title><line x1="50" y1="360" x2="620" y2="360" stroke="black"/>'
+                 f'{bars}</svg>')
+    points = ' '.join(f"{20 + i * 3},{200 + round(120 * ((i * 37) % 101 - 50) / 50)}" for i in range(200))
+    line_chart = (f'{header}<title>折线图</title><polyline points="{points}" fill="none" stroke="#c0504d" '
+                  f'stroke-width="1.5"/><path d="M20 360 H620 M20 20 V360" stroke="black"/></svg>')
+    boxes = ''.join(f'<rect x="{30 + i * 150}" y="150" width="120" height="60" rx="10" fill="url(#g)"/>'
+                    f'<text x="{90 + i * 150}" y="185" text-anchor="middle">步骤 {i + 1}</text>'
+                    f'<path d="M{150 + i * 150} 180 h28" stroke="black" marker-end="url(#arrow)"/>'
+                    for i in range(4))
+    flow_chart = (f'{header}<defs><linearGradient id="g"><stop offset="0" stop-color="#dbe5f1"/>'
+                  f'<stop offset="1" stop-color="#95b3d7"/></linearGradient><marker id="arrow" markerWidth="8" '
+                  f'markerHeight="8" refX="6" refY="3" orient="auto"><path d="M0,0 L6,3 L0,6 z"/></marker></defs>'
+                  f'<title>流程图</title>{boxes}</svg>')
+    dots = ''.join(f'<circle cx="{20 + (i * 53) % 600}" cy="{20 + (i * 97) % 360}" r="{2 + i % 4}" '
+                   f'fill="#9bbb59" fill-opacity="0.6"/>' for i in range(1500))
+    scatter = f'{header}<title>散点图</title>{dots}</svg>'
+    return [bar_chart, line_chart, flow_chart, scatter]
+
+def calibrate_svg_backends(svg_codes=None, rounds=3):
+    """测量各可用SVG转换后端的吞吐量（每秒转换的图片数）并写入缓存目录中的校准文件
+
+    svg_codes为样本SVG代码列表（默认使用内置样本）。每个后端在单个线程中把支持的样本
+    转换rounds遍，吞吐量按成功转换的图片数和总耗时计算。返回 {后端名称: 测量结果}。
+    """
+    samples = svg_codes or calibration_svgs()
+    use_shell = setting('INKSCAPE_SHELL') and os.name == 'posix'
+    measurements = {}
+    print(f"使用 {len(samples)} 个SVG样本校准转换后端（每个后端 {rounds} 遍）...")
+    with tempfile.TemporaryDirectory() as work_dir:
+        sample_paths = []
+        for i, svg_code in enumerate(samples):
+            svg_path = Path(work_dir) / f"sample_{i}.svg"
+            with open(svg_path, 'w', encoding='utf-8') as f:
+                f.write(svg_code)
+            sample_paths.append((svg_path, svg_code))
+        
+        for backend in SVG_BACKEND_REGISTRY:
+            version = backend.version()
+            if not version:
+                print(f"  {backend.name}: 不可用")
+                continue
+            supported = [svg_path for svg_path, svg_code in sample_paths if backend.supports(svg_code)]
+            converter = SvgConverter([backend], use_shell)
+            converted = failed = 0
+            start = time.perf_counter()
+            try:
+                for _ in range(rounds):
+                    for svg_path in supported:
+                        pdf_path = svg_path.with_suffix(f".{backend.name}.pdf")
+                        if pdf_path.exists():
+                            pdf_path.unlink()
+                        ok, _ = converter.convert(svg_path, pdf_path)
+                        if ok:
+                            converted += 1
+                        else:
+                            failed += 1
+            finally:
+                converter.close()
+            elapsed = time.perf_counter() - start
+            rate = converted / elapsed if converted and elapsed > 0 else 0.0
+            measurements[backend.name] = {
+                'version': version,
+                'figures_per_second': round(rate, 3),
+                'converted': converted,
+                'failed': failed,
+                'unsupported': len(samples) - len(supported)
+            }
+            print(f"  {backend.name}: {rate:.2f} 张/秒（成功 {converted}，失败 {failed}，"
+                  f"不支持的样本 {len(samples) - len(supported)}）")
     
-    # 存储SVG文件路径和可能的标题
-    svg_files = []
+    path = svg_calibration_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'backends': measurements, 'samples': len(samples), 'rounds': rounds,
+                   'calibrated_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f, ensure_ascii=False, indent=2)
+    order = ', '.join(backend.name for backend in svg_backends()) or '无'
+    print(f"校准结果已保存到: {path}")
+    print(f"SVG转换后端的选用顺序: {order}")
+    return measurements
+
+# 内嵌SVG代码块的起始标签；块在其后第一个</svg>处结束
+SVG_START_PATTERN = re.compile(r'<svg[^>]*>')
+SVG_END_TAG = '</svg>'
+# SVG代码前面的描述文字
+SVG_DESCRIPTION_PATTERN = re.compile(r'(?:^|\n)([^\n]*?SVG\s+Visualization[^\n]*?)(?:\n|$)')
+# 增量解析SVG时每次送入解析器的字符数
+SVG_PARSE_CHUNK = 64 * 1024
+
+def iter_svg_blocks(content):
+    """单次扫描Markdown内容，依次产生每个内嵌SVG代码块的 (起始位置, 结束位置)"""
+    pos = 0
+    while True:
+        start_match = SVG_START_PATTERN.search(content, pos)
+        if not start_match:
+            return
+        end = content.find(SVG_END_TAG, start_match.end())
+        if end < 0:
+            return
+        end += len(SVG_END_TAG)
+        yield start_match.start(), end
+        pos = end
+
+def read_svg_caption(svg_code):
+    """用增量XML解析器读取SVG的标题，遇到第一个<title>或class="title"的<text>元素即停止
+
+    绘图软件导出的SVG可能有数MB的路径数据，标题通常位于开头，因此分块送入解析器，
+    找到标题后不再解析剩余部分。返回 (标题, 来源, 首个较长的<text>文本)，来源为
+    'title'或'text'，没有标题元素时标题和来源为None；SVG不是合法的XML时返回None。
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    first_text = None
+    # 当前所在的<title>/<text>层数，其中的<tspan>等子元素在读取文本前不能释放
+    open_captions = 0
+    try:
+        for offset in range(0, len(svg_code), SVG_PARSE_CHUNK):
+            parser.feed(svg_code[offset:offset + SVG_PARSE_CHUNK])
+            for event, element in parser.read_events():
+                tag = element.tag.rsplit('}', 1)[-1]
+                if event == 'start':
+                    if tag in ('title', 'text'):
+                        open_captions += 1
+                    continue
+                if tag in ('title', 'text'):
+                    open_captions -= 1
+                if tag == 'title':
+                    return ''.join(element.itertext()), 'title', first_text
+                if tag == 'text':
+                    text = ''.join(element.itertext())
+                    if element.get('class') == 'title':
+                        return text.strip(), 'text', first_text
+                    if first_text is None and len(text) > 10:  # 假设长度>10的首个文本可能是标题
+                        first_text = text.strip()
+                # 已处理的元素不再需要，释放其内容以限制内存占用
+                if not open_captions:
+                    element.clear()
+        parser.close()
+    except ET.ParseError:
+        return None
+    return None, None, first_text
+
+def read_svg_caption_by_regex(svg_code):
+    """不是合法XML的SVG（如含有HTML实体）改用正则提取标题，返回值同read_svg_caption"""
+    # 1. 尝试从<title>标签提取
+    title_match = re.search(r'<title[^>]*>(.*?)</title>', svg_code)
+    if title_match:
+        return title_match.group(1), 'title', None
     
-    for i, match in enumerate(svg_matches):
-        svg_code = match.group(0)
-        
-        # 尝试从SVG中提取标题信息 - 多种方式
-        caption = None
+    # 2. 尝试从<text class="title">元素提取
+    # 匹配所有带class="title"属性的text元素及其内容
+    text_match = re.search(r'<text[^>]*class="title"[^>]*>(.*?)</text>', svg_code)
+    if text_match:
+        # 清理tspan等嵌套标签，保留其文本内容
+        return re.sub(r'<[^>]*>', '', text_match.group(1)).strip(), 'text', None
+    
+    # 4. 首个<text>元素，供没有其他标题时使用
+    first_text = re.search(r'<text[^>]*>(.*?)</text>', svg_code)
+    if first_text and len(first_text.group(1)) > 10:
+        return None, None, re.sub(r'<[^>]*>', '', first_text.group(1)).strip()
+    return None, None, None
+
+def scan_svgs(content, pics_dir):
+    """一次扫描Markdown内容，提取SVG代码块及其标题，保存为文件并查询转换缓存
+
+    返回 (figures, pending, converted)：figures为各代码块的 (起始位置, 结束位置, 标题, 哈希)，
+    pending为未命中缓存、需要转换的 (哈希, SVG路径, PDF路径, 后端名称 -> 缓存键)，converted为
+    哈希 -> 当前可用的文件名（命中缓存时为PDF，否则为SVG）。
+    """
+    figures = []
+    unique_svgs = {}
+    
+    # 缓存键包含实际完成转换的后端及其版本，升级或更换后端后自动失效
+    cache = get_artifact_cache('svg')
+    backends = None
+    
+    # SVG代码前文中的描述文字取第一处，已扫描过的前文不再重复搜索
+    description = None
+    described_until = 0
+    
+    for start, end in iter_svg_blocks(content):
+        svg_code = content[start:end]
         
-        # 1. 尝试从<title>标签提取
-        title_match = re.search(r'<title[^>]*>(.*?)</title>', svg_code)
-        if title_match:
-            caption = title_match.group(1)
+        # 尝试从SVG中提取标题信息：<title>标签或class="title"的<text>元素
+        found = read_svg_caption(svg_code)
+        if found is None:
+            found = read_svg_caption_by_regex(svg_code)
+        caption, source, first_text = found
+        if source == 'title':
             print(f"从<title>标签提取到标题: {caption}")
-        
-        # 2. 尝试从<text class="title">元素提取
-        if not caption:
-            # 匹配所有带class="title"属性的text元素及其内容
-            text_title_pattern = r'<text[^>]*class="title"[^>]*>(.*?)</text>'
-            text_match = re.search(text_title_pattern, svg_code)
-            if text_match:
-                # 获取带有可能嵌套标签的文本内容
-                text_content = text_match.group(1)
-                # 处理可能的tspan嵌套标签
-                tspan_pattern = r'<tspan[^>]*>(.*?)</tspan>'
-                tspans = re.finditer(tspan_pattern, text_content)
-                # 替换tspan标签为其内容，保留原始格式
-                for tspan in tspans:
-                    text_content = text_content.replace(tspan.group(0), tspan.group(1))
-                # 清理所有剩余的HTML标签
-                clean_text = re.sub(r'<[^>]*>', '', text_content)
-                caption = clean_text.strip()
-                print(f"从<text class='title'>提取到标题: {caption}")
+        elif source == 'text':
+            print(f"从<text class='title'>提取到标题: {caption}")
         
         # 3. 尝试查找SVG代码前面的描述文字作为标题
         if not caption:
-            text_before = content[:match.start()].strip()
-            desc_match = re.search(r'(?:^|\n)([^\n]*?SVG\s+Visualization[^\n]*?)(?:\n|$)', text_before)
-            if desc_match:
-                caption = desc_match.group(1).strip()
+            if description is None and start > described_until:
+                # 从上次扫描位置所在行的行首继续，不漏掉跨越扫描边界的行
+                line_start = content.rfind('\n', 0, described_until)
+                desc_match = SVG_DESCRIPTION_PATTERN.search(content, max(line_start, 0), start)
+                if desc_match:
+                    description = desc_match.group(1).strip()
+                described_until = start
+            if description:
+                caption = description
                 print(f"从SVG代码前文本提取到标题: {caption}")
         
         # 4. 尝试从SVG文本内容中提取可能的标题
-        if not caption:
-            # 搜索所有text元素
-            all_texts = re.findall(r'<text[^>]*>(.*?)</text>', svg_code)
-            if all_texts and len(all_texts[0]) > 10:  # 假设长度>10的首个文本可能是标题
-                caption = re.sub(r'<[^>]*>', '', all_texts[0]).strip()
-                print(f"从首个<text>元素提取到可能的标题: {caption}")
+        if not caption and first_text:
+            caption = first_text
+            print(f"从首个<text>元素提取到可能的标题: {caption}")
         
-        # 生成SVG文件名和PDF文件名
-        svg_filename = f"figure_{i+1}.svg"
-        pdf_filename = f"figure_{i+1}.pdf"
-        svg_path = pics_dir / svg_filename
-        pdf_path = pics_dir / pdf_filename
-        
-        # 保存SVG到文件
-        with open(svg_path, 'w', encoding='utf-8') as f:
-            f.write(svg_code)
-        
-        # 尝试使用inkscape将SVG转换为PDF
-        try:
-            print(f"尝试将SVG转换为PDF: {svg_filename}")
-            convert_cmd = ['inkscape', 
-                          str(svg_path), 
-                          '--export-filename', str(pdf_path),
-                          '--export-area-drawing']
+        # 按SVG内容哈希命名文件，插入或删除图片不会导致其他文件改名
+        svg_hash = hashlib.sha256(svg_code.encode('utf-8')).hexdigest()[:16]
+        if svg_hash not in unique_svgs:
+            svg_path = pics_dir / f"svg_{svg_hash}.svg"
             
-            result = subprocess.run(
-                convert_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=False  # 不立即检查，以便捕获错误
-            )
-            
-            if result.returncode == 0 and pdf_path.exists():
-                print(f"成功将SVG转换为PDF: {pdf_filename}")
-                # 使用PDF文件路径
-                file_to_use = pdf_filename
-            else:
-                print(f"无法转换SVG到PDF: {result.stderr.decode('utf-8', errors='ignore')}")
-                print("将直接使用SVG文件")
-                file_to_use = svg_filename
-        except Exception as e:
-            print(f"转换SVG到PDF时出错: {e}")
-            file_to_use = svg_filename
+            # 保存SVG到文件（同名文件内容必然相同，无需重写）
+            if not svg_path.exists():
+                with open(svg_path, 'w', encoding='utf-8') as f:
+                    f.write(svg_code)
+            # 按转换时尝试后端的顺序查找，首选后端失败时缓存的是回退后端的结果；
+            # 遇到第一个SVG时才查询后端（及其版本）
+            if backends is None:
+                backends = svg_backends() if cache is not None else []
+            unique_svgs[svg_hash] = {backend.name: ArtifactCache.make_key('svg2pdf', backend.name, backend.version(), svg_code)
+                                     for backend in svg_backend_candidates(backends, svg_code)}
+        
+        figures.append((start, end, caption, svg_hash))
+    
+    profile_count('svg_figures', len(figures))
+    profile_count('svg_unique', len(unique_svgs))
+    
+    # 先查缓存，同一文档中重复出现的SVG只转换一次
+    converted = {}
+    pending = []
+    for svg_hash, cache_keys in unique_svgs.items():
+        svg_filename = f"svg_{svg_hash}.svg"
+        pdf_filename = f"svg_{svg_hash}.pdf"
+        pdf_path = pics_dir / pdf_filename
+        converted[svg_hash] = svg_filename
+        for cache_key in cache_keys.values():
+            cached_pdf = cache.get(cache_key, '.pdf')
+            if cached_pdf:
+                stage_file(cached_pdf, pdf_path)
+                debug_print(f"使用缓存的PDF: {pdf_filename}")
+                converted[svg_hash] = pdf_filename
+                profile_count('svg_cache_hits')
+                break
+        else:
+            # 上次的PDF可能是指向缓存条目的链接，重新转换前先删除，避免inkscape原地写入
+            if pdf_path.exists():
+                pdf_path.unlink()
+            pending.append((svg_hash, pics_dir / svg_filename, pdf_path, cache_keys))
+    
+    return figures, pending, converted
+
+def record_svg_results(pending, results, converted):
+    """处理SVG转换结果：转换成功的改用PDF文件并写入缓存，返回转换失败的SVG哈希列表"""
+    cache = get_artifact_cache('svg')
+    failed = []
+    for svg_hash, svg_path, pdf_path, cache_keys in pending:
+        ok, error, backend_name = results[str(svg_path)]
+        profile_count('svg_converted' if ok else 'svg_failed')
+        if ok:
+            print(f"成功将SVG转换为PDF: {pdf_path.name}")
+            # 使用PDF文件路径
+            converted[svg_hash] = pdf_path.name
+            if cache is not None and backend_name in cache_keys:
+                cache.put(cache_keys[backend_name], '.pdf', pdf_path)
+        else:
+            print(f"无法转换SVG到PDF: {error}")
+            print("将直接使用SVG文件")
+            converted[svg_hash] = svg_path.name
+            failed.append(svg_hash)
+    return failed
+
+def substitute_svgs(content, figures, converted, output_dir):
+    """把各SVG代码块替换为引用转换结果的图片占位符，按片段一次拼接出新的文档
+
+    返回 (替换后的内容, SVG文件信息列表)。
+    """
+    pics_dir = output_dir / 'pics'
+    svg_files = []
+    segments = []
+    pos = 0
+    for i, (start, end, caption, svg_hash) in enumerate(figures):
+        file_to_use = converted[svg_hash]
         
         # 添加文件信息
         svg_files.append({
@@ -119,36 +1167,472 @@ def extract_and_save_svg(content, output_dir):
         
         # 在Markdown内容中替换SVG代码为占位符，方便后续处理
         placeholder_text = f"![图 {i+1}: {caption if caption else 'SVG_PLACEHOLDER_'+str(i)}](pics/{file_to_use})"
-        content = content.replace(match.group(0), placeholder_text)
+        segments.append(content[pos:start])
+        segments.append(placeholder_text)
+        pos = end
+    segments.append(content[pos:])
+    
+    return ''.join(segments), svg_files
+
+async def convert_svgs_async(tasks, jobs=1, use_shell=False, backends=None):
+    """convert_svgs_parallel的asyncio版本，最多同时转换jobs张图，返回值相同
+
+    外部命令后端的子进程直接在事件循环中等待，不占用线程；后端回退顺序与
+    convert_svgs_parallel相同。inkscape --shell 模式需要阻塞读取管道，此时整体交给
+    线程池中的convert_svgs_parallel执行。
+    """
+    if backends is None:
+        backends = svg_backends()
+    loop = asyncio.get_running_loop()
+    if use_shell and os.name == 'posix' and any(backend.name == 'inkscape' for backend in backends):
+        return await loop.run_in_executor(None, contextvars.copy_context().run,
+                                          convert_svgs_parallel, tasks, jobs, True, backends)
+    workers = max(1, min(jobs or 1, len(tasks)))
+    semaphore = asyncio.Semaphore(workers)
+    pool = svg_process_pool(workers, len(tasks), backends)
+    converter = SvgConverter(backends, pool=pool)
+    
+    async def convert(svg_path, pdf_path):
+        async with semaphore:
+            print(f"尝试将SVG转换为PDF: {Path(svg_path).name}")
+            return str(svg_path), await converter.convert_async(svg_path, pdf_path)
+    try:
+        return dict(await asyncio.gather(*(convert(svg_path, pdf_path) for svg_path, pdf_path in tasks)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def extract_and_save_svg(content, output_dir):
+    """从Markdown内容中提取SVG代码并保存到文件，并转换为PDF"""
+    # 创建保存SVG的目录
+    pics_dir = output_dir / 'pics'
+    if not pics_dir.exists():
+        pics_dir.mkdir(parents=True)
+    
+    figures, pending, converted = scan_svgs(content, pics_dir)
+    
+    # 未命中缓存的SVG提交到工作池并行转换
+    if pending:
+        results = convert_svgs_parallel([(svg_path, pdf_path) for _, svg_path, pdf_path, _ in pending],
+                                        setting('SVG_JOBS'), setting('INKSCAPE_SHELL'))
+        record_svg_results(pending, results, converted)
+    
+    # 按原始顺序生成文件信息并替换占位符，保证结果与转换完成顺序无关
+    return substitute_svgs(content, figures, converted, output_dir)
+
+# ```mermaid代码块，也支持~~~围栏和pandoc属性写法 ```{.mermaid caption="..."}
+MERMAID_BLOCK_PATTERN = re.compile(
+    r'^(?P<fence>`{3,}|~{3,})[ \t]*(?P<info>mermaid|\{[^}\n]*\.mermaid\b[^}\n]*\})[ \t]*\n'
+    r'(?P<code>.*?)^(?P=fence)[ \t]*$',
+    re.MULTILINE | re.DOTALL
+)
+MERMAID_CAPTION_ATTRIBUTE = re.compile(r'caption="([^"]*)"')
+# 图表代码中的标题：frontmatter的 title: ... 或饼图、甘特图等的 title ... 语句
+MERMAID_TITLE_PATTERN = re.compile(r'^\s*title:?[ \t]+(.+?)\s*$', re.MULTILINE)
+# 每个mmdc进程至少渲染的图表数：启动无头浏览器的开销远大于渲染单张图表
+MERMAID_BATCH_MIN = 8
+
+def scan_mermaid(content, pics_dir):
+    """提取Mermaid代码块并查询渲染缓存
+
+    返回 (diagrams, pending)：diagrams为各代码块的 (起始位置, 结束位置, 标题, 哈希)，
+    pending为未命中缓存、需要渲染的 (哈希, 代码, PDF路径, 缓存键)。命中缓存的PDF
+    直接放入pics目录。未安装mmdc时两者都为空，代码块保持原样。
+    """
+    matches = list(MERMAID_BLOCK_PATTERN.finditer(content))
+    if not matches:
+        return [], []
+    mmdc_version = get_tool_version('mmdc')
+    if not mmdc_version:
+        print("未找到mmdc（mermaid-cli），Mermaid图表保留为代码块")
+        return [], []
+    
+    cache = get_artifact_cache('mermaid')
+    diagrams = []
+    pending = []
+    seen = set()
+    for match in matches:
+        code = match.group('code')
+        caption = MERMAID_CAPTION_ATTRIBUTE.search(match.group('info')) or MERMAID_TITLE_PATTERN.search(code)
+        caption = caption.group(1).strip('"\'') if caption else ''
+        # 按图表代码的哈希命名文件，与内嵌SVG相同
+        diagram_hash = hashlib.sha256(code.encode('utf-8')).hexdigest()[:16]
+        diagrams.append((match.start(), match.end(), caption, diagram_hash))
+        if diagram_hash in seen:
+            continue
+        seen.add(diagram_hash)
+        
+        pdf_path = pics_dir / f"mermaid_{diagram_hash}.pdf"
+        cache_key = ArtifactCache.make_key('mermaid', 'mmdc', mmdc_version, code) if cache is not None else None
+        if cache_key is not None:
+            cached_pdf = cache.get(cache_key, '.pdf')
+            if cached_pdf:
+                stage_file(cached_pdf, pdf_path)
+                debug_print(f"使用缓存的Mermaid图表: {pdf_path.name}")
+                profile_count('mermaid_cache_hits')
+                continue
+        # 上次的PDF可能是指向缓存条目的链接，重新渲染前先删除
+        if pdf_path.exists():
+            pdf_path.unlink()
+        mmd_path = pdf_path.with_suffix('.mmd')
+        if not mmd_path.exists():
+            with open(mmd_path, 'w', encoding='utf-8') as f:
+                f.write(code)
+        pending.append((diagram_hash, code, pdf_path, cache_key))
+    
+    profile_count('mermaid_diagrams', len(diagrams))
+    return diagrams, pending
+
+def mermaid_command(input_path, output_path):
+    """mmdc渲染命令，PDF裁剪到图表大小"""
+    return ['mmdc', '--quiet', '--pdfFit', '-i', str(input_path), '-o', str(output_path)]
+
+def render_mermaid_batch(batch, pics_dir):
+    """启动一次mmdc渲染一批Mermaid图表，返回 {哈希: 是否成功}
+
+    各图表写入同一个Markdown文件交给mmdc，只启动一次无头浏览器，输出为
+    batch-1.pdf、batch-2.pdf……。整批失败时（通常是其中某个图表有语法错误）
+    将这一批对半拆开分别重新渲染，只需少数几次额外启动就能找出出错的图表。
+    """
+    if len(batch) == 1:
+        diagram_hash, _, pdf_path, _ = batch[0]
+        print(f"尝试渲染Mermaid图表: {pdf_path.with_suffix('.mmd').name}")
+        result = run_cancellable(mermaid_command(pdf_path.with_suffix('.mmd'), pdf_path), cwd=pics_dir)
+        if result.returncode == 0 and pdf_path.exists():
+            return {diagram_hash: True}
+        error = (result.stderr or result.stdout or '').strip()
+        debug_print(f"mmdc错误: {error[-500:]}")
+        return {diagram_hash: False}
+    
+    results = {}
+    # 临时目录放在pics目录中，渲染结果可以直接移动到位
+    with tempfile.TemporaryDirectory(dir=pics_dir) as work_dir:
+        work_dir = Path(work_dir)
+        source = work_dir / 'batch.md'
+        with open(source, 'w', encoding='utf-8') as f:
+            for _, code, _, _ in batch:
+                f.write(f"```mermaid\n{code.rstrip()}\n```\n\n")
+        print(f"使用mmdc渲染 {len(batch)} 个Mermaid图表...")
+        result = run_cancellable(mermaid_command(source, work_dir / 'batch.pdf'), cwd=work_dir)
+        if result.returncode == 0:
+            for i, (diagram_hash, _, pdf_path, _) in enumerate(batch, 1):
+                output = work_dir / f"batch-{i}.pdf"
+                if output.exists():
+                    os.replace(output, pdf_path)
+                    results[diagram_hash] = True
+    
+    remaining = [item for item in batch if item[0] not in results]
+    if remaining:
+        debug_print(f"mmdc未能渲染整批图表，拆分后重新渲染剩余的 {len(remaining)} 个")
+        if len(remaining) == len(batch):
+            middle = len(remaining) // 2
+            parts = [remaining[:middle], remaining[middle:]]
+        else:
+            parts = [remaining]
+        for part in parts:
+            results.update(render_mermaid_batch(part, pics_dir))
+    return results
+
+def render_mermaid_parallel(pending, pics_dir, jobs=1):
+    """把待渲染的图表分成若干批，最多jobs个mmdc进程同时运行，返回 {哈希: 是否成功}"""
+    batch_count = max(1, min(jobs or 1, len(pending) // MERMAID_BATCH_MIN))
+    batches = [pending[i::batch_count] for i in range(batch_count)]
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=batch_count) as executor:
+        # 工作线程继承当前上下文（配置、性能剖析器、取消事件）
+        futures = [executor.submit(contextvars.copy_context().run, render_mermaid_batch, batch, pics_dir)
+                   for batch in batches]
+        for future in futures:
+            results.update(future.result())
+    return results
+
+def render_mermaid_blocks(content, pics_dir):
+    """将Mermaid代码块渲染为PDF（pics/mermaid_<哈希>.pdf）并替换为图片引用
+
+    渲染结果按图表代码和mmdc版本缓存，未修改的图表在重复构建之间直接复用；
+    渲染失败的图表保留为代码块。返回 (替换后的内容, 图表PDF路径列表)。
+    """
+    diagrams, pending = scan_mermaid(content, pics_dir)
+    if pending:
+        results = render_mermaid_parallel(pending, pics_dir, setting('SVG_JOBS'))
+        cache = get_artifact_cache('mermaid')
+        for diagram_hash, _, pdf_path, cache_key in pending:
+            ok = results.get(diagram_hash, False)
+            profile_count('mermaid_rendered' if ok else 'mermaid_failed')
+            if ok:
+                print(f"成功渲染Mermaid图表: {pdf_path.name}")
+                if cache is not None and cache_key is not None:
+                    cache.put(cache_key, '.pdf', pdf_path)
+            else:
+                print(f"无法渲染Mermaid图表 {pdf_path.with_suffix('.mmd').name}，保留为代码块")
+    
+    segments = []
+    diagram_files = []
+    pos = 0
+    for start, end, caption, diagram_hash in diagrams:
+        pdf_path = pics_dir / f"mermaid_{diagram_hash}.pdf"
+        if not pdf_path.exists():
+            continue
+        caption = caption.replace('[', '\\[').replace(']', '\\]')
+        segments.append(content[pos:start])
+        # 图片单独成段，带标题时pandoc生成figure环境
+        segments.append(f"\n![{caption}](pics/{pdf_path.name})\n")
+        pos = end
+        if pdf_path not in diagram_files:
+            diagram_files.append(pdf_path)
+    segments.append(content[pos:])
+    return ''.join(segments), diagram_files
+
+# 图片的渲染宽度（英寸）：0.8\textwidth，A4纸左右各1英寸页边距
+RENDERED_IMAGE_WIDTH = 0.8 * (210 / 25.4 - 2)
+# 参与优化的栅格图片格式
+RASTER_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+_PILLOW_WARNED = False
+
+def optimizes_raster(path):
+    """当前配置下该图片是否需要优化而不是直接复制"""
+    return bool(setting('IMAGE_DPI')) and Path(path).suffix.lower() in RASTER_FORMATS
+
+def copy_asset(source, target):
+    """把资源文件放到输出目录（见stage_file）；启用栅格图片优化时PNG/JPEG写入优化后的版本"""
+    if optimizes_raster(source):
+        stage_raster_image(source, target)
+    else:
+        stage_file(source, target)
+
+def optimize_raster_image(source, dpi, quality):
+    """把栅格图片缩小到渲染宽度下的目标DPI并重新压缩，返回编码后的数据
+
+    DPI元数据按缩放比例调整，保持图片的物理尺寸不变，未指定宽度的图片排版不受影响；
+    图片方向（EXIF）与原图一样不做处理。结果不比原图小时返回None。
+    """
+    image_format = RASTER_FORMATS[Path(source).suffix.lower()]
+    max_width = max(1, round(dpi * RENDERED_IMAGE_WIDTH))
+    with Image.open(source) as image:
+        width, height = image.size
+        original_dpi = float(image.info.get('dpi', (72, 72))[0] or 72)
+        scale = min(1.0, max_width / width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if image_format == 'JPEG' and scale < 1:
+            # 让libjpeg直接按1/2、1/4、1/8比例解码，大照片不必完整解码
+            image.draft(image.mode, size)
+        if image.mode in ('P', '1'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        if image.size != size:
+            image = image.resize(size, Image.LANCZOS)
+        options = {'dpi': (original_dpi * scale, original_dpi * scale), 'optimize': True}
+        if image_format == 'JPEG':
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+            options.update(quality=quality, progressive=True)
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **options)
+    data = buffer.getvalue()
+    if len(data) >= os.path.getsize(source):
+        return None
+    return data
+
+def stage_raster_image(source, target):
+    """把优化后的栅格图片写入输出目录，原图保持不变
+
+    结果按原图内容哈希、DPI、质量和Pillow版本缓存；没有Pillow或图片无法解码时直接复制原图。
+    """
+    global _PILLOW_WARNED
+    if Image is None:
+        if not _PILLOW_WARNED:
+            _PILLOW_WARNED = True
+            print("未安装Pillow，跳过栅格图片优化（pip install Pillow）")
+        stage_file(source, target)
+        return
+    target = Path(target)
+    dpi, quality = setting('IMAGE_DPI'), setting('IMAGE_QUALITY')
+    cache = get_artifact_cache('raster')
+    cache_key = None
+    if cache is not None:
+        cache_key = ArtifactCache.make_key('raster', PIL.__version__, str(dpi), str(quality),
+                                           f"{RENDERED_IMAGE_WIDTH:.4f}", file_sha256(source))
+        cached = cache.get(cache_key, target.suffix.lower())
+        # 优化无效的图片只缓存一个空标记，不把原图放进缓存（缓存条目命中时会更新修改时间）
+        keep_original = cached is None and cache.get(cache_key, '.keep') is not None
+        if cached or keep_original:
+            stage_file(source if keep_original else cached, target)
+            debug_print(f"使用缓存的优化图片: {target.name}")
+            profile_count('raster_cache_hits')
+            return
     
-    return content, svg_files
+    try:
+        with profile_stage('raster'):
+            data = optimize_raster_image(source, dpi, quality)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"无法优化图片 {Path(source).name}，使用原图: {e}")
+        data = None
+    if data is None:
+        stage_file(source, target)
+        if cache_key is not None:
+            cache.put_bytes(cache_key, '.keep', b'')
+        return
+    if cache_key is not None:
+        stage_file(cache.put_bytes(cache_key, target.suffix.lower(), data), target)
+    else:
+        # 输出文件可能是指向原图的链接，写入新文件后原子替换，不能原地覆盖
+        tmp_name = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_name, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, target)
+    saved = os.path.getsize(source) - len(data)
+    profile_count('raster_optimized')
+    profile_count('raster_bytes_saved', saved)
+    debug_print(f"优化图片: {target.name}，减少 {saved // 1024} KB")
+
+class AssetIndex:
+    """资源文件索引：一次扫描搜索根目录，建立 文件名 -> 路径列表 的映射
+
+    路径按优先级排序：先按根目录的给定顺序，同一根目录内按自顶向下的遍历顺序。
+    不进入隐藏目录（.git等）和SKIP_DIRS中的目录，其中的同名图片不会被找到。
+    每个目录记录其修改时间，刷新时只对目录执行stat，未变化的目录直接复用上次的
+    文件列表。指定persist_path时目录列表会持久化到磁盘，供下次运行复用。
+    """
+
+    # 不参与扫描的目录
+    SKIP_DIRS = {'__pycache__', 'node_modules'}
+
+    def __init__(self, roots, persist_path=None):
+        self.roots = [Path(root).resolve() for root in roots]
+        self.persist_path = Path(persist_path) if persist_path else None
+        self._listings = {}   # 目录 -> (mtime_ns, 文件名列表, 子目录名列表)
+        self._index = {}
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        self._load()
+        self.refresh()
+
+    def _load(self):
+        if not self.persist_path or not self.persist_path.exists():
+            return
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._listings = {d: (entry[0], entry[1], entry[2]) for d, entry in data.get('dirs', {}).items()}
+            debug_print(f"已加载资源索引: {self.persist_path} ({len(self._listings)} 个目录)")
+        except (OSError, ValueError, IndexError, TypeError) as e:
+            debug_print(f"忽略无效的资源索引文件 {self.persist_path}: {e}")
+            self._listings = {}
+
+    def _save(self):
+        try:
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.persist_path.with_name(self.persist_path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'dirs': {d: list(entry) for d, entry in self._listings.items()}}, f)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            debug_print(f"无法保存资源索引 {self.persist_path}: {e}")
+
+    def _list_dir(self, directory):
+        """列出目录内容，目录mtime未变化时复用已有结果，返回(列表, 是否重新读取)"""
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None, True
+        cached = self._listings.get(directory)
+        if cached and cached[0] == mtime:
+            return cached, False
+        files, subdirs = [], []
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            # 与os.walk一致，不进入符号链接指向的目录
+                            if not entry.is_symlink():
+                                subdirs.append(entry.name)
+                        else:
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None, True
+        return (mtime, files, subdirs), True
+
+    def refresh(self):
+        """按目录mtime校验索引，只重新读取发生变化的目录"""
+        with self._lock:
+            listings = {}
+            index = {}
+            changed = False
+            for root in self.roots:
+                stack = [str(root)]
+                while stack:
+                    directory = stack.pop()
+                    if directory in listings:
+                        continue
+                    listing, reread = self._list_dir(directory)
+                    if listing is None:
+                        continue
+                    changed = changed or reread
+                    listings[directory] = listing
+                    for name in listing[1]:
+                        index.setdefault(name, []).append(Path(directory) / name)
+                    for name in reversed(listing[2]):
+                        if name.startswith('.') or name in self.SKIP_DIRS:
+                            continue
+                        stack.append(os.path.join(directory, name))
+            changed = changed or len(listings) != len(self._listings)
+            self._listings = listings
+            self._index = index
+            self._last_refresh = time.monotonic()
+            if changed and self.persist_path:
+                self._save()
+
+    def lookup(self, name, predicate=None):
+        """按优先级返回第一个文件名为name且满足predicate的路径，找不到时返回None"""
+        for path in self.lookup_all(name):
+            if predicate is None or predicate(path):
+                return path
+        return None
+
+    def lookup_all(self, name):
+        """返回文件名为name的所有路径（按优先级排序）"""
+        paths = self._index.get(name)
+        if not paths and time.monotonic() - self._last_refresh > 1.0:
+            # 未命中时按目录mtime刷新一次，以发现新创建的文件
+            self.refresh()
+            paths = self._index.get(name)
+        return [path for path in (paths or []) if path.exists()]
+
+# 资源索引实例缓存，键为搜索根目录
+_ASSET_INDEXES = {}
+_ASSET_INDEXES_LOCK = threading.Lock()
+
+def get_asset_index(roots, persist_path=None):
+    """返回指定搜索根目录的资源索引，同一组根目录在进程内只扫描一次"""
+    key = tuple(str(Path(root).resolve()) for root in roots)
+    with _ASSET_INDEXES_LOCK:
+        index = _ASSET_INDEXES.get(key)
+        if index is None:
+            index = AssetIndex(roots, persist_path)
+            _ASSET_INDEXES[key] = index
+    return index
+
+def get_project_asset_index():
+    """返回项目根目录的资源索引：gemini_paper目录优先，其次是整个项目根目录"""
+    root = project_root()
+    roots = [root / 'gemini_paper', root] if (root / 'gemini_paper').exists() else [root]
+    return get_asset_index(roots, setting('ASSET_INDEX_FILE'))
 
 def find_image_file(md_file_path, img_path):
     """查找图片文件的实际位置"""
     img_file_path = None
     img_file_name = Path(img_path).name
     
-    # 递归搜索可能的图片位置
+    # 直接可确定的位置
     possible_locations = [
         md_file_path.parent / img_path,                  # 相对于Markdown文件
-        Path(img_path),                                  # 当前工作目录
+        project_root() / img_path,                       # 项目根目录
         md_file_path.parent / 'pics' / img_file_name,    # pics子目录
-        Path('pics') / img_file_name,                    # 当前工作目录下的pics
+        project_root() / 'pics' / img_file_name,         # 项目根目录下的pics
     ]
     
-    # 添加gemini_paper路径
-    if Path('gemini_paper').exists():
-        for root, dirs, files in os.walk('gemini_paper'):
-            possible_locations.append(Path(root) / img_file_name)
-            # 检查pics子目录
-            if 'pics' in dirs:
-                possible_locations.append(Path(root) / 'pics' / img_file_name)
-    
-    # 添加所有可能的pics目录
-    for root, dirs, files in os.walk('.'):
-        if 'pics' in dirs:
-            possible_locations.append(Path(root) / 'pics' / img_file_name)
-    
     debug_print(f"查找图片 '{img_file_name}' 的可能位置:")
     # 检查所有可能的位置
     for loc in possible_locations:
@@ -158,21 +1642,362 @@ def find_image_file(md_file_path, img_path):
             debug_print(f"  找到图像文件: {img_file_path}")
             break
     
+    if not img_file_path:
+        # 在资源索引中查找：gemini_paper下的任意位置，或任意pics目录
+        gemini_root = (project_root() / 'gemini_paper').resolve()
+        index = get_project_asset_index()
+        img_file_path = index.lookup(
+            img_file_name,
+            lambda path: path.parent.name == 'pics' or gemini_root in path.parents
+        )
+        if img_file_path:
+            debug_print(f"  在资源索引中找到图像文件: {img_file_path}")
+    
     if not img_file_path:
         debug_print(f"  未找到图像文件: {img_file_name}")
     
     return img_file_path
 
-def convert_md_to_latex(input_file, output_dir, template_path):
-    """使用pandoc将Markdown转换为LaTeX"""
+# Markdown中的pandoc引用：@key 或 @{key}，@前不能是单词字符（排除邮箱地址），
+# 键中允许的标点只能出现在中间
+CITATION_PATTERN = re.compile(r'(?<![\w@])@(?:\{([^{}\s]+)\}|(\w(?:[\w:.#$%&\-+?<>~/]*\w)?))')
+# 代码块（```/~~~围栏，未闭合时到文末为止）和行内代码中的 @Override、@media 等不是引用；
+# 行内代码不跨越空行，避免落单的反引号吞掉后续段落
+MARKDOWN_CODE_PATTERN = re.compile(
+    r'^[ \t]{0,3}(?P<fence>`{3,}|~{3,})[^\n]*\n.*?(?:^[ \t]{0,3}(?P=fence)[`~]*[ \t]*$|\Z)'
+    r'|(?<!`)(?P<ticks>`+)(?!`)(?:(?!\n[ \t]*\n).)+?(?<!`)(?P=ticks)(?!`)',
+    re.MULTILINE | re.DOTALL
+)
+# .bib文件中的条目头 @type{key, ，忽略@string/@preamble/@comment
+BIB_ENTRY_PATTERN = re.compile(rb'@(\w+)\s*[{(]\s*([^,\s{}()]+)\s*,')
+BIB_NON_ENTRY_TYPES = frozenset((b'string', b'preamble', b'comment'))
+
+# 进程内的条目键索引，按 (路径, 大小, 修改时间) 缓存
+_BIB_KEY_INDEXES = {}
+
+def extract_citation_keys(content):
+    """一次扫描提取Markdown中引用的所有文献键，忽略代码块和行内代码"""
+    content = MARKDOWN_CODE_PATTERN.sub(' ', content)
+    return {brace or bare for brace, bare in CITATION_PATTERN.findall(content)}
+
+def scan_bib_keys(bib_path):
+    """使用mmap流式扫描.bib文件，返回其中所有条目键的集合"""
+    keys = set()
+    with open(bib_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return keys
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in BIB_ENTRY_PATTERN.finditer(data):
+                if match.group(1).lower() not in BIB_NON_ENTRY_TYPES:
+                    keys.add(match.group(2).decode('utf-8', errors='ignore'))
+    return keys
+
+def load_bib_keys(bib_path):
+    """返回.bib文件的条目键集合
+
+    索引按文件路径和修改时间缓存在进程内和持久化缓存中，文件未修改时无需重新扫描。
+    """
+    bib_path = Path(bib_path).resolve()
+    st = bib_path.stat()
+    signature = (str(bib_path), st.st_size, st.st_mtime_ns)
+    keys = _BIB_KEY_INDEXES.get(signature)
+    if keys is not None:
+        return keys
+
+    cache = get_artifact_cache('bib')
+    cache_key = ArtifactCache.make_key('bibkeys', *map(str, signature))
+    if cache is not None:
+        cached = cache.get(cache_key, '.json')
+        if cached:
+            try:
+                with open(cached, 'r', encoding='utf-8') as f:
+                    keys = set(json.load(f))
+                debug_print(f"使用缓存的参考文献索引: {bib_path.name}")
+            except (OSError, ValueError):
+                keys = None
+
+    if keys is None:
+        keys = scan_bib_keys(bib_path)
+        debug_print(f"扫描参考文献文件 {bib_path.name}: {len(keys)} 个条目")
+        if cache is not None:
+            cache.put_bytes(cache_key, '.json', json.dumps(sorted(keys), ensure_ascii=False).encode('utf-8'))
+    _BIB_KEY_INDEXES[signature] = keys
+    return keys
+
+class BuildManifest:
+    """增量构建清单：记录各构建阶段的输入与输出哈希，保存在输出目录中
+
+    文件哈希按 (大小, 修改时间) 缓存，未变化的文件无需重新读取。某阶段的输入与
+    上次记录一致、且其输出文件仍然存在且未被修改时，该阶段可以跳过。
+    """
+
+    FILENAME = '.md2tex_manifest.json'
+    VERSION = 1
+
+    def __init__(self, output_dir):
+        self.path = Path(output_dir) / self.FILENAME
+        self.data = {'version': self.VERSION, 'files': {}, 'stages': {}}
+        self.skipped = set()
+        self._used_files = set()
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == self.VERSION:
+                    self.data = data
+            except (OSError, ValueError) as e:
+                debug_print(f"忽略无效的构建清单 {self.path}: {e}")
+
+    def digest_file(self, path):
+        """返回文件内容的SHA-256，文件不存在时返回None"""
+        key = str(Path(path).resolve())
+        try:
+            st = os.stat(key)
+        except OSError:
+            return None
+        self._used_files.add(key)
+        cached = self.data['files'].get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(key, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        self.data['files'][key] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def digest_files(self, paths):
+        """返回 {路径: 哈希} 映射，路径按字符串排序"""
+        return {str(path): self.digest_file(path) for path in sorted(paths, key=str)}
+
+    def stage(self, name):
+        return self.data['stages'].get(name)
+
+    def is_fresh(self, name, inputs):
+        """判断阶段的输入是否与上次一致，且上次的输出文件均未变化"""
+        entry = self.stage(name)
+        if not entry or entry['inputs'] != inputs:
+            return False
+        return all(self.digest_file(path) == digest for path, digest in entry['outputs'].items())
+
+    def record(self, name, inputs, outputs, extra=None):
+        """记录阶段的输入和输出文件"""
+        self.data['stages'][name] = {
+            'inputs': inputs,
+            'outputs': self.digest_files(outputs),
+            'extra': extra or {}
+        }
+
+    def update_outputs(self, name, outputs):
+        """阶段的输出文件被后续步骤修改后，更新其记录的哈希"""
+        entry = self.stage(name)
+        if entry:
+            entry['outputs'] = self.digest_files(outputs)
+
+    def skip(self, name, message):
+        self.skipped.add(name)
+        print(message)
+
+    def save(self):
+        # 只保留本次构建用到的文件哈希，避免清单无限增长
+        self.data['files'] = {k: v for k, v in self.data['files'].items() if k in self._used_files}
+        try:
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"无法保存构建清单 {self.path}: {e}")
+
+def md2tex_version():
+    """本脚本的内容哈希，脚本更新后增量构建的结果自动失效"""
+    if 'md2tex' not in _TOOL_VERSIONS:
+        with open(__file__, 'rb') as f:
+            _TOOL_VERSIONS['md2tex'] = hashlib.sha256(f.read()).hexdigest()
+    return _TOOL_VERSIONS['md2tex']
+
+def get_output_dir(input_file, output_dir):
+    """返回Markdown文件对应的输出目录（与Markdown文件同名的目录）"""
+    input_path = Path(input_file)
+    return Path(output_dir) / input_path.stem if output_dir else input_path.parent / input_path.stem
+
+class PandocServer:
+    """常驻的pandoc服务（pandoc server），通过HTTP提交内存中的文档进行转换
+
+    未指定地址时在本机空闲端口上启动 pandoc server 子进程，进程退出时自动关闭。
+    """
+
+    def __init__(self, url=None, timeout=120):
+        self.url = url.rstrip('/') if url else None
+        self.timeout = timeout
+        self.process = None
+
+    def start(self):
+        """启动（或连接）服务，成功返回True"""
+        if self.url is None:
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+            try:
+                self.process = subprocess.Popen(
+                    ['pandoc', 'server', '--port', str(port), '--timeout', str(self.timeout)],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+            except (FileNotFoundError, OSError):
+                return False
+            atexit.register(self.close)
+            self.url = f"http://127.0.0.1:{port}"
+            # 等待服务开始监听
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and self.process.poll() is None:
+                if self.alive():
+                    return True
+                time.sleep(0.1)
+            self.close()
+            return False
+        return self.alive()
+
+    def alive(self):
+        try:
+            with urllib.request.urlopen(f"{self.url}/version", timeout=2) as response:
+                return response.status == 200
+        except (OSError, ValueError):
+            return False
+
+    def convert(self, text, from_format, to_format, standalone=False, listings=False, bib_file=None):
+        """转换文本并返回输出，参考文献文件随请求一起发送"""
+        params = {
+            'text': text,
+            'from': from_format,
+            'to': to_format,
+            'standalone': standalone,
+            'listings': listings
+        }
+        if bib_file:
+            bib_name = Path(bib_file).name
+            with open(bib_file, 'rb') as f:
+                params['files'] = {bib_name: base64.b64encode(f.read()).decode('ascii')}
+            params['metadata'] = {'bibliography': bib_name}
+            params['citeproc'] = True
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(params, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'}
+        )
+        with profile_tool('pandoc server'), urllib.request.urlopen(request, timeout=self.timeout) as response:
+            result = json.loads(response.read().decode('utf-8'))
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        for message in result.get('messages') or []:
+            debug_print(f"pandoc: {message.get('verbosity', '')} {message.get('type', '')}")
+        return result['output']
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+# 常驻pandoc服务，键为PANDOC_SERVER配置，值为False表示不可用
+_PANDOC_BACKENDS = {}
+_PANDOC_BACKEND_LOCK = threading.Lock()
+
+def get_pandoc_server():
+    """按当前配置返回常驻pandoc服务，未启用或不可用时返回None（改用pandoc命令行）"""
+    address = setting('PANDOC_SERVER')
+    if not address:
+        return None
+    with _PANDOC_BACKEND_LOCK:
+        if address not in _PANDOC_BACKENDS:
+            backend = PandocServer(None if address == 'auto' else address)
+            if backend.start():
+                debug_print(f"使用常驻pandoc服务: {backend.url}")
+            else:
+                print("pandoc server不可用，改为每次启动pandoc进程")
+                backend = False
+            _PANDOC_BACKENDS[address] = backend
+        return _PANDOC_BACKENDS[address] or None
+
+def pandoc_server_convert(text, from_format, to_format, **options):
+    """通过常驻pandoc服务转换，返回输出文本；服务未启用或请求失败时返回None，由调用方改用pandoc命令行"""
+    server = get_pandoc_server()
+    if server is None:
+        return None
+    try:
+        return server.convert(text, from_format, to_format, **options)
+    except urllib.error.HTTPError as e:
+        print(f"pandoc server转换失败: {e.read().decode('utf-8', errors='ignore')[:500]}")
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"pandoc server请求失败: {e}")
+        if not server.alive():
+            # 服务已退出，之后的转换都改用pandoc命令行
+            with _PANDOC_BACKEND_LOCK:
+                _PANDOC_BACKENDS[setting('PANDOC_SERVER')] = False
+    return None
+
+def pandoc_convert_text(text, from_format, to_format, standalone=False, listings=False, bib_file=None):
+    """在内存中转换文本：优先使用常驻pandoc服务，否则通过标准输入输出调用pandoc命令
+
+    pandoc命令失败时抛出subprocess.CalledProcessError，找不到pandoc时抛出FileNotFoundError。
+    """
+    output = pandoc_server_convert(text, from_format, to_format, standalone=standalone,
+                                   listings=listings, bib_file=bib_file)
+    if output is not None:
+        return output
+    pandoc_cmd = ['pandoc', '-f', from_format, '-t', to_format]
+    if standalone:
+        pandoc_cmd.append('-s')
+    if listings:
+        pandoc_cmd.append('--listings')
+    if bib_file:
+        pandoc_cmd.extend(['--bibliography', str(bib_file), '--citeproc'])
+    with profile_tool('pandoc'):
+        result = subprocess.run(
+            pandoc_cmd,
+            input=text.encode('utf-8'),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True
+        )
+    return result.stdout.decode('utf-8')
+
+def markdown_document(title, content):
+    """为Markdown正文加上YAML头信息（文档类、页面设置和常用宏包），作为pandoc的输入"""
+    return f"""---
+title: "{title}"
+documentclass: ctexart
+classoption:
+  - a4paper
+  - UTF8
+header-includes:
+  - \\usepackage{{geometry}}
+  - \\geometry{{a4paper, margin=1in}}
+  - \\usepackage{{graphicx}}
+  - \\usepackage{{xcolor}}
+  - \\usepackage{{hyperref}}
+  - \\usepackage{{fontspec}}
+  - \\usepackage{{float}}
+---
+
+{content}
+"""
+
+def convert_md_to_latex(input_file, output_dir, template_path, manifest=None):
+    """使用pandoc将Markdown转换为LaTeX
+
+    传入manifest时启用增量构建：预处理结果和LaTeX文件的输入均未变化时跳过对应阶段。
+    """
     input_path = Path(input_file)
     if not input_path.exists():
         print(f"错误: 找不到输入文件 {input_file}")
         return False
     
     # 创建输出目录
-    output_dirname = input_path.stem
-    output_dir_path = Path(output_dir) / output_dirname if output_dir else input_path.parent / output_dirname
+    output_dir_path = get_output_dir(input_file, output_dir)
     
     if not output_dir_path.exists():
         output_dir_path.mkdir(parents=True)
@@ -185,11 +2010,56 @@ def convert_md_to_latex(input_file, output_dir, template_path):
     # 输出LaTeX文件路径
     tex_file = output_dir_path / f"{input_path.stem}.tex"
     
+    template_dir = Path(template_path).parent
+    input_dir = input_path.parent
+    bib_files = list(input_dir.glob('*.bib'))
+    
+    if manifest is not None:
+        # 预处理阶段（资源复制、SVG转换）的输入：Markdown、上次解析到的图片、样式文件和工具版本
+        previous = manifest.stage('preprocess')
+        previous_extra = previous['extra'] if previous else {}
+        source_inputs = {
+            'markdown': manifest.digest_file(input_path),
+            'images': manifest.digest_files(previous_extra.get('images', [])),
+            'styles': manifest.digest_files(template_dir.glob("*.sty")),
+            'bib': manifest.digest_files(bib_files),
+            # 只有上次包含SVG或Mermaid图表时才查询转换后端和mmdc的版本，避免每次启动inkscape和node
+            'svg_backends': svg_backend_versions() if previous_extra.get('svg_files') else None,
+            'mmdc': get_tool_version('mmdc') if previous_extra.get('mermaid') else None,
+            'raster': [setting('IMAGE_DPI'), setting('IMAGE_QUALITY'), PIL.__version__ if PIL else None],
+            'md2tex': md2tex_version()
+        }
+        tex_inputs = {
+            'preprocessed': previous_extra.get('preprocessed'),
+            'bib': source_inputs['bib'],
+            'template': manifest.digest_file(template_path),
+            'pandoc': get_tool_version('pandoc'),
+            'md2tex': source_inputs['md2tex'],
+            'ast': setting('PANDOC_AST'),
+            'latex_format': setting('LATEX_FORMAT'),
+            # --char-map 会改变特殊字符的替换结果
+            'char_map': hashlib.sha256(json.dumps(setting('SPECIAL_CHAR_MAP'), sort_keys=True,
+                                                  ensure_ascii=False).encode('utf-8')).hexdigest()
+        }
+        # 上次存在无法解析的图片时，新文件可能已经出现，需要重新预处理
+        if (not previous_extra.get('unresolved') and manifest.is_fresh('preprocess', source_inputs)
+                and manifest.is_fresh('tex', tex_inputs)):
+            manifest.skip('preprocess', "输入未变化，跳过资源复制和SVG转换")
+            manifest.skip('tex', f"输入未变化，跳过pandoc转换: {tex_file}")
+            return str(tex_file)
+    
+    # 记录本次复制到输出目录的文件，供增量构建校验
+    staged_files = []
+    resolved_images = []
+    unresolved_images = []
+    # 需要复制到输出目录的资源（目标路径 -> 源文件），与pandoc转换并行执行
+    copy_jobs = {}
+    
     # 复制相关资源文件到输出目录
     # 复制模板目录中的样式文件到输出目录
-    template_dir = Path(template_path).parent
     for file in template_dir.glob("*.sty"):
-        shutil.copy(file, output_dir_path)
+        copy_jobs[output_dir_path / file.name] = file
+        staged_files.append(output_dir_path / file.name)
     
     # 从Markdown内容中提取图像引用，复制图像文件
     # 读取Markdown内容
@@ -215,16 +2085,16 @@ def convert_md_to_latex(input_file, output_dir, template_path):
     
     # 处理标准图片引用： ![alt](path)
     for alt_text, img_path in re.findall(standard_img_pattern, content):
-        img_file_path = find_image_file(input_path, img_path)
+        with profile_stage('resolve_images'):
+            img_file_path = find_image_file(input_path, img_path)
         
         if img_file_path:
             img_file_name = Path(img_file_path).name
             target_path = pics_dir / img_file_name
             
-            # 复制图片到输出目录
-            if not target_path.exists():
-                debug_print(f"复制图像文件: {img_file_path} 到 {target_path}")
-                shutil.copy(img_file_path, target_path)
+            # 暂存图片到输出目录，未变化的图片由stage_file跳过
+            debug_print(f"复制图像文件: {img_file_path} 到 {target_path}")
+            copy_jobs.setdefault(target_path, img_file_path)
             
             # 更新Markdown中的图片引用 - 确保使用正确的相对路径
             new_path = f"pics/{img_file_name}"
@@ -233,29 +2103,38 @@ def convert_md_to_latex(input_file, output_dir, template_path):
             content = content.replace(old_ref, new_ref)
             
             referenced_images.append((alt_text, target_path, img_file_name))
+            resolved_images.append(str(Path(img_file_path).resolve()))
+            staged_files.append(target_path)
+            profile_count('images_resolved')
             debug_print(f"处理标准图片引用: '{alt_text}' -> {new_path}")
         else:
+            unresolved_images.append(img_path)
+            profile_count('images_unresolved')
             debug_print(f"警告: 无法找到图像文件: {img_path}")
     
     # 处理特殊图片引用： !(caption)(path)
     for caption, img_path in re.findall(special_img_pattern, content):
-        img_file_path = find_image_file(input_path, img_path)
+        with profile_stage('resolve_images'):
+            img_file_path = find_image_file(input_path, img_path)
         
         if img_file_path:
             img_file_name = Path(img_file_path).name
             target_path = pics_dir / img_file_name
             
-            # 复制图片到输出目录
-            if not target_path.exists():
-                debug_print(f"复制图像文件: {img_file_path} 到 {target_path}")
-                shutil.copy(img_file_path, target_path)
+            # 暂存图片到输出目录，未变化的图片由stage_file跳过
+            debug_print(f"复制图像文件: {img_file_path} 到 {target_path}")
+            copy_jobs.setdefault(target_path, img_file_path)
             
             # 更新Markdown中的图片引用 - 特殊格式
             new_path = f"pics/{img_file_name}"
             old_ref = f"!({caption})({img_path})"
-            # 直接创建LaTeX图片环境
-            fig_num = re.search(r'图\s+(\d+)', caption).group(1) if re.search(r'图\s+(\d+)', caption) else "1"
-            new_ref = f"""
+            if setting('PANDOC_AST'):
+                # AST模式下改写为标准图片引用，由AST转换生成figure环境
+                new_ref = f"![{caption}]({new_path})"
+            else:
+                # 直接创建LaTeX图片环境
+                fig_num = re.search(r'图\s+(\d+)', caption).group(1) if re.search(r'图\s+(\d+)', caption) else "1"
+                new_ref = f"""
 \\begin{{figure}}[htbp]
 \\centering
 \\includegraphics[width=0.8\\textwidth]{{{new_path}}}
@@ -266,29 +2145,29 @@ def convert_md_to_latex(input_file, output_dir, template_path):
             content = content.replace(old_ref, new_ref)
             
             referenced_images.append((caption, target_path, img_file_name))
+            resolved_images.append(str(Path(img_file_path).resolve()))
+            staged_files.append(target_path)
+            profile_count('images_resolved')
             debug_print(f"处理特殊图片引用: '{caption}' -> LaTeX图片环境")
         else:
+            unresolved_images.append(img_path)
+            profile_count('images_unresolved')
             debug_print(f"警告: 无法找到图像文件: {img_path}")
     
     # 检查是否有参考文献文件
-    input_dir = input_path.parent
-    bib_files = list(input_dir.glob('*.bib'))
     if bib_files:
+        # 提取一次文中的引用键，与各bib文件的条目键索引求交集
+        citation_keys = extract_citation_keys(content)
+        profile_count('citations', len(citation_keys))
         for bib_file in bib_files:
             # 检查Markdown内容中是否有引用这个bib文件的内容
-            bib_referenced = False
-            # 简单检查是否有类似@cite的模式
-            with open(bib_file, 'r', encoding='utf-8', errors='ignore') as f:
-                bib_content = f.read()
-                entry_ids = re.findall(r'@\w+\{([^,]+),', bib_content)
-                for entry_id in entry_ids:
-                    if f"@{entry_id}" in content or f"[@{entry_id}]" in content:
-                        bib_referenced = True
-                        break
+            with profile_stage('bib_scan'):
+                bib_referenced = bool(citation_keys) and not citation_keys.isdisjoint(load_bib_keys(bib_file))
             
             if bib_referenced:
                 print(f"复制参考文献文件: {bib_file.name}")
-                shutil.copy(bib_file, output_dir_path)
+                copy_jobs[output_dir_path / bib_file.name] = bib_file
+                staged_files.append(output_dir_path / bib_file.name)
     
     # 提取标题信息
     title = input_path.stem
@@ -296,55 +2175,38 @@ def convert_md_to_latex(input_file, output_dir, template_path):
     if title_match:
         title = title_match.group(1)
     
-    # 处理SVG图像
-    content, svg_files = extract_and_save_svg(content, output_dir_path)
+    # 渲染Mermaid图表并替换为图片引用（在解析图片引用之后，生成的PDF已在pics目录中）
+    has_mermaid = MERMAID_BLOCK_PATTERN.search(content) is not None
+    with profile_stage('mermaid'):
+        content, mermaid_files = render_mermaid_blocks(content, pics_dir)
+    staged_files.extend(mermaid_files)
     
-    # 使用pandoc将Markdown转换为LaTeX
-    print("使用pandoc转换Markdown到LaTeX...")
-    
-    # 首先创建一个包含YAML头信息的临时文件
-    temp_md_file = output_dir_path / f"{input_path.stem}_temp.md"
-    with open(temp_md_file, 'w', encoding='utf-8') as f:
-        f.write(f"""---
-title: "{title}"
-documentclass: ctexart
-classoption:
-  - a4paper
-  - UTF8
-header-includes:
-  - \\usepackage{{geometry}}
-  - \\geometry{{a4paper, margin=1in}}
-  - \\usepackage{{graphicx}}
-  - \\usepackage{{xcolor}}
-  - \\usepackage{{hyperref}}
-  - \\usepackage{{fontspec}}
-  - \\usepackage{{float}}
----
-
-{content}
-""")
+    # 处理SVG图像：先提取代码块并生成占位符，未命中缓存的SVG与pandoc并行转换，
+    # 占位符先按转换成功引用PDF文件
+    with profile_stage('svg'):
+        figures, pending_svgs, converted = scan_svgs(content, pics_dir)
+        for svg_hash, _, pdf_path, _ in pending_svgs:
+            converted[svg_hash] = pdf_path.name
+        content, svg_files = substitute_svgs(content, figures, converted, output_dir_path)
     
-    # 调用pandoc进行转换
-    pandoc_cmd = [
-        'pandoc',
-        str(temp_md_file),
-        '-o', str(tex_file),
-        '--pdf-engine=xelatex',
-        '-s',
-        '--listings'
-    ]
+    # 包含YAML头信息的完整Markdown
+    markdown_text = markdown_document(title, content)
     
-    if bib_files:
-        pandoc_cmd.extend(['--bibliography', str(bib_files[0]), '--citeproc'])
+    if manifest is not None:
+        preprocessed = hashlib.sha256(markdown_text.encode('utf-8')).hexdigest()
+        tex_inputs['preprocessed'] = preprocessed
+        if manifest.is_fresh('tex', tex_inputs):
+            manifest.skip('tex', f"预处理后的Markdown未变化，跳过pandoc转换: {tex_file}")
+            markdown_text = None
     
+    # 使用pandoc将Markdown转换为LaTeX，整个过程在内存中完成，最后只写一次LaTeX文件；
+    # 同时复制图片、转换SVG，两者都完成后才继续
+    if markdown_text is not None:
+        print("使用pandoc转换Markdown到LaTeX...")
     try:
-        result = subprocess.run(
-            pandoc_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True
-        )
-        print(f"pandoc成功将Markdown转换为LaTeX")
+        latex_text = run_coroutine(render_latex_with_assets(
+            markdown_text, output_dir_path, bib_files[0] if bib_files else None, svg_files, copy_jobs, pending_svgs
+        ))
     except subprocess.CalledProcessError as e:
         print(f"pandoc转换失败: {e}")
         print(f"错误输出: {e.stderr.decode('utf-8', errors='ignore')}")
@@ -352,19 +2214,526 @@ header-includes:
     except FileNotFoundError:
         print("找不到pandoc命令，请确保已安装pandoc")
         return False
-    finally:
-        # 删除临时文件
-        if temp_md_file.exists():
-            temp_md_file.unlink()
     
-    # 对生成的LaTeX文件进行后处理，包括SVG引用处理
-    post_process_latex(tex_file, svg_files)
+    if manifest is not None:
+        # 记录预处理阶段，图片按解析到的源文件记录，以便下次直接校验
+        for svg_info in svg_files:
+            staged_files.append(output_dir_path / svg_info['path'])
+        source_inputs['images'] = manifest.digest_files(set(resolved_images))
+        # 与下次校验时一样按本次是否包含SVG和Mermaid图表记录工具版本
+        source_inputs['svg_backends'] = svg_backend_versions() if svg_files else None
+        source_inputs['mmdc'] = get_tool_version('mmdc') if has_mermaid else None
+        manifest.record('preprocess', source_inputs, set(staged_files), {
+            'images': sorted(set(resolved_images)),
+            'unresolved': unresolved_images,
+            'mermaid': has_mermaid,
+            'preprocessed': tex_inputs['preprocessed'],
+            'svg_files': svg_files
+        })
+    
+    if latex_text is None:
+        return str(tex_file)
+    
+    with open(tex_file, 'w', encoding='utf-8') as f:
+        f.write(latex_text)
+    
+    if manifest is not None:
+        manifest.record('tex', tex_inputs, [tex_file])
     
     print(f"已生成LaTeX文件: {tex_file}")
     return str(tex_file)
 
+async def stage_assets(copy_jobs, pending_svgs):
+    """复制资源文件并转换SVG，返回SVG转换结果 {str(svg_path): (是否成功, 错误信息, 实际使用的后端名称)}"""
+    loop = asyncio.get_running_loop()
+    with profile_stage('assets'):
+        copies = [loop.run_in_executor(None, contextvars.copy_context().run, copy_asset, source, target)
+                  for target, source in copy_jobs.items()]
+        results = {}
+        if pending_svgs:
+            results = await convert_svgs_async([(svg_path, pdf_path) for _, svg_path, pdf_path, _ in pending_svgs],
+                                               setting('SVG_JOBS'), setting('INKSCAPE_SHELL'))
+        await asyncio.gather(*copies)
+    return results
+
+async def render_latex_with_assets(markdown_text, output_dir, bib_file, svg_files, copy_jobs, pending_svgs):
+    """pandoc转换与资源复制、SVG转换同时进行，两者都完成后返回最终的LaTeX文本
+
+    pandoc只需要占位符中的图片路径，不需要转换好的PDF，因此关键路径是两者中较长的
+    一个而不是两者之和。pandoc及后处理在线程池中运行，SVG转换由convert_svgs_async在事件
+    循环中以asyncio子进程运行（逐个后端回退，cairosvg在进程池中渲染）；后处理只修正文本，
+    图片是否齐全在资源就绪后（xelatex之前）再检查。转换失败的SVG改为引用SVG文件。markdown_text为None时只处理资源，返回None。
+    """
+    loop = asyncio.get_running_loop()
+    rendering = None
+    if markdown_text is not None:
+        rendering = loop.run_in_executor(None, contextvars.copy_context().run,
+                                         render_latex, markdown_text, None, bib_file, svg_files)
+    assets = asyncio.ensure_future(stage_assets(copy_jobs, pending_svgs))
+    try:
+        latex_text = await rendering if rendering is not None else None
+    finally:
+        # 汇合点：pandoc出错时也要等资源处理结束
+        results = await assets
+    
+    failed = record_svg_results(pending_svgs, results, {})
+    failed_paths = {f"pics/svg_{svg_hash}.pdf" for svg_hash in failed}
+    for svg_info in svg_files:
+        if svg_info['path'] in failed_paths:
+            svg_info['path'] = svg_info['path'][:-len('.pdf')] + '.svg'
+            svg_info['is_pdf'] = False
+    if latex_text is None:
+        return None
+    for path in failed_paths:
+        latex_text = latex_text.replace(path, path[:-len('.pdf')] + '.svg')
+    ensure_latex_images(latex_text, output_dir)
+    return latex_text
+
+def run_coroutine(coroutine):
+    """在新的事件循环中运行协程；当前线程已有运行中的事件循环（如在异步服务中调用）时改在独立线程中运行"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coroutine).result()
+
+def convert_string(markdown, output_dir=None, bib_file=None, title=None):
+    """字符串到字符串的转换：Markdown文本 -> 最终的LaTeX文本，供服务等场景在内存中调用
+
+    title默认取第一个一级标题。指定output_dir时内嵌SVG转换为PDF、Mermaid图表渲染为
+    PDF保存到其中的pics目录，后处理也会把缺失的图片复制过去；不指定时不写任何文件，内嵌SVG保持原样交给pandoc。
+    pandoc失败时抛出subprocess.CalledProcessError，找不到pandoc时抛出FileNotFoundError。
+    """
+    if title is None:
+        title_match = re.search(r'^#\s+(.+)$', markdown, re.MULTILINE)
+        title = title_match.group(1) if title_match else 'document'
+    svg_files = []
+    if output_dir is not None:
+        output_dir = Path(output_dir)
+        with profile_stage('svg'):
+            markdown, svg_files = extract_and_save_svg(markdown, output_dir)
+        with profile_stage('mermaid'):
+            markdown, _ = render_mermaid_blocks(markdown, output_dir / 'pics')
+    return render_latex(markdown_document(title, markdown), output_dir, bib_file, svg_files)
+
+# 交叉引用辅助文件，内容变化说明需要再编译一遍
+LATEX_AUX_EXTENSIONS = ('.aux', '.toc', '.lof', '.lot', '.out')
+# 日志中提示需要重新编译的信息
+LATEX_RERUN_PATTERN = re.compile(
+    r'Rerun to get|Label\(s\) may have changed|Please rerun LaTeX|Rerun LaTeX|rerunfilecheck.*rerun',
+    re.IGNORECASE
+)
+
+def latex_aux_checksum(base):
+    """计算交叉引用辅助文件（.aux/.toc等）的合并校验和，base为不含扩展名的路径"""
+    digest = hashlib.sha256()
+    for ext in LATEX_AUX_EXTENSIONS:
+        try:
+            with open(base + ext, 'rb') as f:
+                digest.update(ext.encode('ascii'))
+                digest.update(f.read())
+        except OSError:
+            continue
+    return digest.hexdigest()
+
+class LatexLogParser:
+    """逐行解析xelatex的输出，边编译边提取结构化诊断信息
+
+    不保存完整日志：只记录错误、缺失文件、未定义的引用、overfull盒子和字体警告，
+    每类最多MAX_ENTRIES条，其余只计数。feed()遇到致命错误时返回True，调用方可以
+    立即终止本次编译；输出结束后调用finish()处理最后一行。
+    """
+
+    MAX_ENTRIES = 100
+    # TeX按max_print_line（默认79）折行。run_xelatex_passes通过环境变量关闭折行，该设置
+    # 不起作用时（如texmf.cnf中固定了该值），恰好79个字符的行与下一行拼接后再解析，
+    # 除非下一行本身是一条新信息的开头
+    WRAP_WIDTH = 79
+    MESSAGE_START = re.compile(r'^(?:! |l\.\d|LaTeX |Package |Overfull |Underfull |Missing character)')
+    ERROR = re.compile(r'^! (.*)')
+    LINE_NUMBER = re.compile(r'^l\.(\d+) ?(.*)')
+    FATAL = re.compile(r'Emergency stop|Fatal error occurred|job aborted|TeX capacity exceeded|'
+                       r'==> Fatal error|I can\'t find file')
+    MISSING_FILE = re.compile(r"File [`']([^']+)' not found|I can't find file [`']([^']+)'|"
+                              r"Unable to load picture or PDF file '([^']+)'")
+    UNDEFINED_REFERENCE = re.compile(r"(?:Reference|Citation) [`']([^']+)' on page \d+ undefined")
+    OVERFULL = re.compile(r'^Overfull \\([hv]box) \(([^)]*)\)(?: in .*? at lines? (\d+)(?:--(\d+))?)?')
+    FONT = re.compile(r'^(?:LaTeX Font Warning: |Package fontspec (?:Warning|Error): |Missing character: )(.*)|'
+                      r'The font "[^"]*" cannot be found')
+
+    def __init__(self):
+        self.errors = []
+        self.missing_files = []
+        self.undefined_references = []
+        self.overfull_boxes = []
+        self.font_warnings = []
+        self.counts = {'errors': 0, 'missing_files': 0, 'undefined_references': 0,
+                       'overfull_boxes': 0, 'font_warnings': 0}
+        self.rerun = False
+        self.fatal = False
+        self._pending_error = None
+        self._wrapped = None
+
+    def _add(self, kind, entry):
+        self.counts[kind] += 1
+        entries = getattr(self, kind)
+        if len(entries) < self.MAX_ENTRIES:
+            entries.append(entry)
+        return entry
+
+    def feed(self, line):
+        """处理一行输出，返回是否遇到了致命错误"""
+        line = line.rstrip('\r\n')
+        wrapped = len(line) == self.WRAP_WIDTH
+        if self._wrapped is not None:
+            if self.MESSAGE_START.match(line):
+                self._parse(self._wrapped)
+            else:
+                line = self._wrapped + line
+            self._wrapped = None
+        if wrapped:
+            # 可能被折行，等下一行到达后再解析
+            self._wrapped = line
+            return self.fatal
+        return self._parse(line)
+
+    def finish(self):
+        """输出结束：解析暂存的最后一行，返回是否遇到了致命错误"""
+        if self._wrapped is not None:
+            self._parse(self._wrapped)
+            self._wrapped = None
+        return self.fatal
+
+    def _parse(self, line):
+        if LATEX_RERUN_PATTERN.search(line):
+            self.rerun = True
+
+        match = self.ERROR.match(line)
+        if match:
+            self._pending_error = self._add('errors', {'message': match.group(1), 'line': None, 'context': None})
+        elif self._pending_error is not None:
+            match = self.LINE_NUMBER.match(line)
+            if match:
+                self._pending_error['line'] = int(match.group(1))
+                self._pending_error['context'] = match.group(2)
+                self._pending_error = None
+
+        match = self.MISSING_FILE.search(line)
+        if match:
+            name = next(group for group in match.groups() if group)
+            if name not in self.missing_files:
+                self._add('missing_files', name)
+
+        match = self.UNDEFINED_REFERENCE.search(line)
+        if match and match.group(1) not in self.undefined_references:
+            self._add('undefined_references', match.group(1))
+
+        match = self.OVERFULL.match(line)
+        if match:
+            lines = [int(n) for n in match.group(3, 4) if n]
+            self._add('overfull_boxes', {'box': match.group(1), 'amount': match.group(2), 'lines': lines or None})
+
+        match = self.FONT.search(line)
+        if match:
+            self._add('font_warnings', match.group(1) or match.group(0))
+
+        if self.FATAL.search(line):
+            self.fatal = True
+        return self.fatal
+
+    def merge(self, other):
+        """合并另一次编译（如另一个章节）的诊断信息"""
+        for kind in self.counts:
+            self.counts[kind] += other.counts[kind]
+            entries = getattr(self, kind)
+            entries.extend(getattr(other, kind)[:self.MAX_ENTRIES - len(entries)])
+        self.rerun = self.rerun or other.rerun
+        self.fatal = self.fatal or other.fatal
+
+    def diagnostics(self):
+        """结构化的诊断结果"""
+        return {
+            'fatal': self.fatal,
+            'rerun': self.rerun,
+            'counts': dict(self.counts),
+            'errors': self.errors,
+            'missing_files': self.missing_files,
+            'undefined_references': self.undefined_references,
+            'overfull_boxes': self.overfull_boxes,
+            'font_warnings': self.font_warnings
+        }
+
+    def summary(self):
+        """一行摘要，没有任何问题时为空字符串"""
+        labels = (('errors', '个错误'), ('missing_files', '个缺失文件'), ('undefined_references', '个未定义的引用'),
+                  ('overfull_boxes', '个overfull盒子'), ('font_warnings', '个字体警告'))
+        return '，'.join(f"{self.counts[kind]}{label}" for kind, label in labels if self.counts[kind])
+
+# 监视模式下出现新的修改时置位，正在运行的xelatex会被终止
+BUILD_CANCEL_EVENT = threading.Event()
+# Converter.convert() 期间使用各自的取消事件
+_ACTIVE_CANCEL_EVENT = contextvars.ContextVar('md2tex_cancel_event', default=None)
+
+class BuildCancelled(Exception):
+    """构建被新的修改取消"""
+
+def cancel_requested():
+    """当前构建是否已被取消"""
+    event = _ACTIVE_CANCEL_EVENT.get()
+    return (event or BUILD_CANCEL_EVENT).is_set()
+
+def _kill_process_tree(process):
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        process.kill()
+
+def _stream_lines(process, on_line):
+    """逐行把进程输出交给on_line，on_line返回True时终止进程；返回是否提前终止"""
+    lines = queue.Queue(maxsize=1000)
+    
+    def reader():
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+    threading.Thread(target=reader, daemon=True).start()
+    
+    def stop():
+        _kill_process_tree(process)
+        # 继续读取直到管道关闭，让读取线程正常退出
+        while lines.get() is not None:
+            pass
+    
+    while True:
+        try:
+            line = lines.get(timeout=0.2)
+        except queue.Empty:
+            if cancel_requested():
+                stop()
+                raise BuildCancelled()
+            continue
+        if line is None:
+            return False
+        if on_line(line):
+            stop()
+            return True
+
+def run_cancellable(cmd, env=None, on_line=None, cwd=None):
+    """在cwd目录中运行外部命令并返回结果，构建被取消时终止进程并抛出BuildCancelled
+
+    指定on_line时逐行处理输出而不在内存中保存（stderr合并到stdout），on_line
+    返回True时立即终止进程；返回结果中的stdout为None，stderr为最后几行输出。
+    """
+    if cancel_requested():
+        raise BuildCancelled()
+    with profile_tool(Path(cmd[0]).name):
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if on_line else subprocess.PIPE,
+            universal_newlines=True,  # 使用文本模式
+            errors='replace',
+            env=env,
+            cwd=cwd,
+            # 独立进程组，取消时连同xelatex启动的子进程一起终止
+            start_new_session=(os.name == 'posix')
+        )
+        if on_line is not None:
+            tail = collections.deque(maxlen=20)
+            
+            def handle(line):
+                tail.append(line)
+                return on_line(line)
+            try:
+                _stream_lines(process, handle)
+            finally:
+                process.stdout.close()
+            process.wait()
+            return subprocess.CompletedProcess(cmd, process.returncode, None, ''.join(tail))
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=0.2)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_requested():
+                    _kill_process_tree(process)
+                    process.communicate()
+                    raise BuildCancelled()
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+# 导言区中与具体文档相关的部分（标题、PDF元数据等）从这些命令开始，不放入格式文件
+PREAMBLE_DUMP_STOP = re.compile(r'^\\(?:hypersetup|title|author|date|subtitle)\b', re.MULTILINE)
+# mylatexformat的导言区结束标记，未使用格式文件时等价于\relax
+ENDOFDUMP_MARKER = '\\csname endofdump\\endcsname'
+
+def insert_endofdump_marker(content):
+    """在导言区中与文档相关的部分之前插入转储结束标记，已有标记时不重复插入
+
+    返回 (内容, 标记位置)；没有\\begin{document}时位置为None。
+    """
+    preamble_end = content.find('\\begin{document}')
+    if preamble_end < 0:
+        return content, None
+    marker_pos = content.find(ENDOFDUMP_MARKER, 0, preamble_end)
+    if marker_pos < 0:
+        stop = PREAMBLE_DUMP_STOP.search(content, 0, preamble_end)
+        marker_pos = stop.start() if stop else preamble_end
+        content = content[:marker_pos] + ENDOFDUMP_MARKER + '\n' + content[marker_pos:]
+    return content, marker_pos
+
+def prepare_latex_format(tex_file):
+    """为LaTeX文件的固定导言区准备预编译的xelatex格式文件（mylatexformat）
+
+    导言区中与文档无关的前半部分被转储为格式文件，按该部分内容、本地样式文件和
+    xelatex版本缓存，之后的编译直接加载格式文件，跳过ctex、fontspec等宏包的加载。
+    转储结束标记通常在生成LaTeX时已经插入；文件中没有标记时只在格式文件可用时才写入。
+    返回 (格式名, 格式文件目录)；无法使用格式文件时返回None，按完整导言区编译。
+    """
+    tex_file = Path(tex_file)
+    cache = get_artifact_cache('xelatex-fmt')
+    xelatex_version = get_tool_version('xelatex')
+    if cache is None or not xelatex_version:
+        return None
+    with open(tex_file, 'r', encoding='utf-8') as f:
+        original = f.read()
+    content, marker_pos = insert_endofdump_marker(original)
+    if marker_pos is None:
+        return None
+    
+    styles = [path.read_bytes() for path in sorted(tex_file.parent.glob('*.sty'))]
+    key = ArtifactCache.make_key('xelatex-fmt', xelatex_version, content[:marker_pos], *styles)
+    fmt_path = cache.get(key, '.fmt')
+    if fmt_path:
+        debug_print(f"使用缓存的xelatex格式文件: {fmt_path.name}")
+        write_if_changed(tex_file, content)
+        return key, str(fmt_path.parent)
+    if cache.get(key, '.failed'):
+        # 此导言区之前已无法转储（例如字体无法写入格式文件），直接完整编译
+        return None
+    
+    try:
+        located = subprocess.run(['kpsewhich', 'mylatexformat.ltx'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+    except (FileNotFoundError, OSError):
+        return None
+    if located.returncode != 0 or not located.stdout.strip():
+        debug_print("未找到mylatexformat.ltx，不使用预编译格式")
+        return None
+    
+    debug_print("转储导言区为xelatex格式文件...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = tex_file.name
+        if content != original:
+            # 文件中还没有转储结束标记：从临时副本转储，确认格式文件可用之前不改动LaTeX文件
+            source = (Path(tmp_dir) / tex_file.name).as_posix()
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write(content)
+        result = run_cancellable([
+            'xelatex', '-ini', '-interaction=nonstopmode', f'-jobname={key}',
+            f'-output-directory={tmp_dir}', '&xelatex', 'mylatexformat.ltx', source
+        ], cwd=tex_file.parent)
+        built = Path(tmp_dir) / f"{key}.fmt"
+        if result.returncode != 0 or not built.exists():
+            debug_print("导言区无法转储为格式文件，改用完整导言区编译")
+            cache.put_bytes(key, '.failed', b'')
+            return None
+        fmt_path = cache.put(key, '.fmt', built)
+    write_if_changed(tex_file, content)
+    return key, str(fmt_path.parent)
+
+def run_xelatex_passes(tex_file, max_passes=None, latex_format=None, output_directory=None, include_only=None):
+    """自适应地运行xelatex，返回 (最后一次运行的结果, 其LatexLogParser)
+
+    保留上次构建的.aux/.toc等辅助文件，每次编译后检查输出中的重新编译提示和辅助文件
+    校验和，二者都未变化时即停止，最多运行max_passes次。输出边运行边解析，遇到致命
+    错误时立即终止xelatex，不再进行后续编译。存在xdvipdfmx时各次编译都使用-no-pdf
+    只生成XDV，最后统一转换为PDF，避免为中间结果生成PDF。
+    latex_format为prepare_latex_format()的返回值，指定时加载预编译的格式文件。
+    xelatex在LaTeX文件所在目录中运行；output_directory为该目录下存放输出和辅助文件的
+    相对路径，include_only指定时只排版该\\include文件（章节拆分编译）。
+    """
+    max_passes = max_passes or setting('MAX_LATEX_PASSES')
+    tex_file = Path(tex_file)
+    tex_dir = tex_file.parent
+    stem = tex_file.stem
+    
+    def output_path(name):
+        return f"{output_directory}/{name}" if output_directory else name
+    base = str(tex_dir / output_path(stem))
+    use_xdv = shutil.which('xdvipdfmx') is not None
+    xelatex_cmd = ['xelatex', '-interaction=nonstopmode']
+    job_args = []
+    if output_directory:
+        job_args.append(f'-output-directory={output_directory}')
+    source = tex_file.name
+    if include_only:
+        # 通过命令行在读入主文件前定义\includeonly，多个章节可以同时编译同一个主文件
+        job_args.append(f'-jobname={stem}')
+        source = f"\\def\\mdtexincludeonly{{\\includeonly{{{include_only}}}}}\\input{{{tex_file.name}}}"
+    if latex_format:
+        xelatex_cmd.append(f'-fmt={latex_format[0]}')
+    if use_xdv:
+        xelatex_cmd.append('-no-pdf')
+    xelatex_cmd += job_args + [source]
+    # 避免日志按79列折行，保证日志信息可以按行匹配
+    env = dict(os.environ, max_print_line='10000')
+    if latex_format:
+        # 格式文件目录放在搜索路径最前，末尾的分隔符保留默认路径
+        env['TEXFORMATS'] = latex_format[1] + os.pathsep + os.environ.get('TEXFORMATS', '')
+    prefix = f"{Path(include_only).name}: " if include_only else ''
+    
+    previous = latex_aux_checksum(base)
+    for pass_num in range(1, max_passes + 1):
+        debug_print(f"{prefix}第{pass_num}次编译...")
+        log = LatexLogParser()
+        xelatex_result = run_cancellable(xelatex_cmd, env, on_line=log.feed, cwd=tex_dir)
+        log.finish()
+        profile_count('xelatex_passes')
+        if log.fatal:
+            debug_print(f"{prefix}xelatex遇到致命错误，停止编译")
+            profile_count('xelatex_aborted')
+            return xelatex_result, log
+        current = latex_aux_checksum(base)
+        if not log.rerun and current == previous:
+            break
+        if pass_num == max_passes:
+            debug_print(f"{prefix}已达到最大编译次数 {max_passes}，交叉引用可能仍未稳定")
+        previous = current
+    
+    if use_xdv and os.path.exists(base + '.xdv'):
+        # 将最终的XDV转换为PDF
+        result = run_cancellable(['xdvipdfmx', '-q', '-o', output_path(stem + '.pdf'), output_path(stem + '.xdv')],
+                                 cwd=tex_dir)
+        if result.returncode != 0 or not os.path.exists(base + '.pdf'):
+            debug_print("xdvipdfmx转换失败，直接使用xelatex生成PDF...")
+            log = LatexLogParser()
+            xelatex_result = run_cancellable(xelatex_cmd[:2] + job_args + [source], env, on_line=log.feed, cwd=tex_dir)
+            log.finish()
+    return xelatex_result, log
+
+def save_latex_diagnostics(log, tex_file):
+    """将编译诊断写入LaTeX文件旁的 <文件名>.diagnostics.json"""
+    summary = log.summary()
+    if summary:
+        debug_print(f"xelatex诊断: {summary}")
+    profile_count('latex_errors', log.counts['errors'])
+    profile_count('latex_overfull_boxes', log.counts['overfull_boxes'])
+    try:
+        with open(Path(tex_file).with_suffix('.diagnostics.json'), 'w', encoding='utf-8') as f:
+            json.dump(log.diagnostics(), f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        debug_print(f"无法写入编译诊断: {e}")
+
 def compile_latex(tex_file, fix_images=False):
-    """编译LaTeX文件生成PDF"""
+    """编译LaTeX文件生成PDF
+
+    不切换工作目录：xelatex等外部命令都在LaTeX文件所在目录中运行（cwd=），
+    可以在多个线程中同时编译不同的文件。
+    """
     try:
         # 确保输入文件存在
         tex_path = Path(tex_file)
@@ -374,177 +2743,778 @@ def compile_latex(tex_file, fix_images=False):
         
         # LaTeX文件所在目录
         tex_dir = tex_path.parent
-        tex_filename = tex_path.name
-        pdf_filename = tex_path.stem + '.pdf'
-        pdf_file = tex_dir / pdf_filename
+        pdf_file = tex_path.with_suffix('.pdf')
         
         # 先移除可能存在的旧PDF，避免误判
         if pdf_file.exists():
             os.remove(pdf_file)
         
-        # 获取初始目录文件列表
-        initial_files = os.listdir(tex_dir)
-        debug_print("正在编译LaTeX生成PDF...")
+        # 获取初始目录文件列表
+        initial_files = os.listdir(tex_dir)
+        debug_print("正在编译LaTeX生成PDF...")
+        
+        # 自适应编译：交叉引用稳定后即停止
+        latex_format = None
+        if setting('LATEX_FORMAT'):
+            with profile_stage('latex_format'):
+                latex_format = prepare_latex_format(tex_path)
+        with profile_stage('xelatex'):
+            compiled = None
+            if setting('SPLIT_CHAPTERS') is not None and not fix_images:
+                # 强化图片修复模式会改写并重新编译整个文件，此时不拆分章节
+                compiled = run_chapter_passes(tex_path, latex_format)
+            xelatex_result, log = compiled or run_xelatex_passes(tex_path, latex_format=latex_format)
+            if latex_format and not pdf_file.exists():
+                debug_print("使用预编译格式编译失败，改用完整导言区重新编译")
+                xelatex_result, log = run_xelatex_passes(tex_path)
+        
+        # 检查编译结果和PDF文件
+        pdf_success = pdf_file.exists()
+        
+        # 检查PDF大小
+        pdf_size = 0
+        if pdf_success:
+            pdf_size = pdf_file.stat().st_size
+            debug_print(f"找到PDF文件: {pdf_file.name}, 大小: {pdf_size} 字节")
+        
+        # 检查是否真正成功（PDF存在且不为空）
+        if pdf_success and pdf_size > 0:
+            debug_print(f"PDF文件已成功生成: {pdf_file}")
+        else:
+            # 可能有错误，输出编译时解析到的诊断信息
+            save_latex_diagnostics(log, tex_path)
+            if log.errors:
+                print("编译时遇到错误:")
+                for error in log.errors[:5]:  # 只显示前5个错误
+                    location = f"第{error['line']}行: " if error['line'] else ''
+                    print(f"  {location}! {error['message']}")
+            else:
+                print("编译过程可能有未知错误，请检查日志文件")
+            if log.missing_files:
+                print(f"缺失文件: {', '.join(log.missing_files[:5])}")
+            
+            # 检查编译过程的输出
+            if xelatex_result.returncode != 0:
+                print(f"xelatex返回错误码: {xelatex_result.returncode}")
+                error_output = xelatex_result.stderr
+                if error_output:
+                    print("错误输出:", error_output[-500:])  # 限制输出长度
+            
+            return False, None
+    
+        # 列出目录中的当前文件
+        debug_print("当前目录文件列表:")
+        for f in tex_dir.glob("*.pdf"):
+            debug_print(f"  {f.name} - {f.stat().st_size} 字节")
+        
+        # 检查图片文件
+        pics_dir = tex_dir / "pics"
+        if pics_dir.exists():
+            debug_print("检查图片文件:")
+            for img_file in pics_dir.glob("*.*"):
+                debug_print(f"  {img_file.name} - {img_file.stat().st_size} 字节")
+        
+        # 强化图片修复模式
+        if fix_images and pdf_success:
+            try:
+                debug_print("使用强化图片修复模式...")
+                
+                # 读取LaTeX文件内容
+                with open(tex_path, 'r', encoding='utf-8') as f:
+                    tex_content = f.read()
+                
+                # 找出所有图片引用
+                img_refs = re.findall(r'\\includegraphics(?:\[.*?\])?\{(.*?)\}', tex_content)
+                debug_print(f"发现 {len(img_refs)} 个图片引用")
+                # 在LaTeX文件所在目录中查找
+                asset_index = get_asset_index([tex_dir])
+                
+                # 创建一个新版本的LaTeX内容，确保图片引用正确
+                new_tex_content = tex_content
+                
+                # 如果是进一步强化模式，可以在这里添加额外的处理
+                # 例如，确保图片路径正确
+                for img_ref in img_refs:
+                    # 检查图片是否存在
+                    img_path = Path(img_ref)
+                    if not (img_path.is_absolute() or (tex_dir / img_path).exists()):
+                        # 如果是相对路径且不存在，尝试查找
+                        img_name = img_path.name
+                        # 在LaTeX目录的资源索引中查找
+                        found_path = asset_index.lookup(img_name)
+                        if found_path:
+                            rel_path = os.path.relpath(found_path, tex_dir).replace("\\", "/")
+                            debug_print(f"替换图片路径: {img_ref} -> {rel_path}")
+                            new_tex_content = new_tex_content.replace(f"{{{img_ref}}}", f"{{{rel_path}}}")
+                
+                # 只有当内容发生变化时才重写文件和重新编译
+                if new_tex_content != tex_content:
+                    debug_print("LaTeX内容已更新，重新编译...")
+                    with open(tex_path, 'w', encoding='utf-8') as f:
+                        f.write(new_tex_content)
+                    
+                    # 重新编译，沿用上次的辅助文件
+                    with profile_stage('xelatex'):
+                        xelatex_result, log = run_xelatex_passes(tex_path, latex_format=latex_format)
+                    
+                    # 再次检查PDF
+                    pdf_success = pdf_file.exists()
+                    if pdf_success:
+                        pdf_size = pdf_file.stat().st_size
+                        debug_print(f"找到PDF文件: {pdf_file.name}, 大小: {pdf_size} 字节")
+                    
+                        if not (pdf_success and pdf_size > 0):
+                            print("强化修复后编译失败，请检查LaTeX错误")
+                            return False, None
+            
+            except BuildCancelled:
+                raise
+            except Exception as e:
+                print(f"强化图片修复模式出错: {e}")
+                # 继续使用原始编译结果
+        
+        save_latex_diagnostics(log, tex_path)
+        return True, pdf_file
+
+    
+    except BuildCancelled:
+        raise
+    except Exception as e:
+        print(f"编译LaTeX时出错: {e}")
+        return False, None
+
+# 章节拆分编译（--split-chapters）：输出目录中的主文件按顺序\include chapters/chapter-NN.tex，
+# 每个章节用\includeonly在chapters/chapter-NN/中单独编译，各章节的.aux复制到chapters/供其他章节读取
+CHAPTER_DIR = 'chapters'
+CHAPTER_MASTER = 'chapters-main'
+CHAPTER_STATE_FILE = '.md2tex_chapters.json'
+CHAPTER_HEADING_PATTERN = re.compile(r'^\\(part|chapter|section|subsection)\*?[\[{]', re.MULTILINE)
+CHAPTER_HEADING_LEVELS = ('part', 'chapter', 'section', 'subsection')
+# 主文件导言区中的钩子，命令行定义\mdtexincludeonly时展开为\includeonly
+INCLUDE_ONLY_HOOK = '\\csname mdtexincludeonly\\endcsname\n'
+# 排版时输出标签编号或页码的引用；\hyperref[标签]{文本}只输出文本，不依赖标签的值
+LATEX_REF_PATTERN = re.compile(r'\\(?:ref|pageref|autoref|eqref|nameref|cref|Cref|vref)\*?\{([^}]*)\}')
+LATEX_GRAPHICS_PATTERN = re.compile(r'\\includegraphics(?:\[[^\]]*\])?\{([^}]*)\}')
+CONTENTS_COMMAND_PATTERN = re.compile(r'\\(?:tableofcontents|listoffigures|listoftables)(?![A-Za-z])')
+AUX_LABEL_PATTERN = re.compile(r'^\\newlabel\{([^}]*)\}.*$', re.MULTILINE)
+AUX_CONTENTS_PATTERN = re.compile(r'^\\@writefile\{(?:toc|lof|lot)\}.*$', re.MULTILINE)
+AUX_COUNTER_PATTERN = re.compile(r'\\setcounter\{([^}]*)\}\{(-?\d+)\}')
+AUX_CHECKPOINT = '\\@setckpt'
+# 跨章节延续、影响后续章节排版的计数器；被顶层标题重置的计数器除外
+CHAPTER_CARRIED_COUNTERS = ('page', 'part', 'chapter', 'section', 'subsection', 'figure', 'table', 'equation',
+                            'footnote', 'lstlisting')
+CHAPTER_RESET_COUNTERS = {
+    'chapter': ('section', 'subsection', 'figure', 'table', 'equation', 'footnote', 'lstlisting'),
+    'section': ('subsection',)
+}
+
+def split_latex_chapters(content):
+    """在顶层标题处拆分LaTeX文档
+
+    顶层标题为\\part、\\chapter、\\section和\\subsection中至少出现两次的最高一级，
+    因此只有一个 # 文档标题（\\section）、正文为多个 ## 小节时在\\subsection处拆分。
+    返回 (导言区到\\begin{document}, 各章节正文列表, \\end{document}及其后内容, 顶层标题
+    级别)，导言区中已插入\\includeonly钩子；第一个顶层标题之前的标题页、目录以及单独的
+    文档标题等作为第一个章节。没有任何一级标题出现两次时返回None。
+    """
+    structure = LatexStructure(content)
+    documents = structure.spans('document')
+    if not documents:
+        return None
+    begin, end = documents[0]
+    body_start = content.find('\n', begin) + 1
+    body_end = end - len('\\end{document}')
+    if body_start <= 0 or body_start > body_end:
+        return None
+    
+    headings = {}
+    for match in CHAPTER_HEADING_PATTERN.finditer(content, body_start, body_end):
+        pos = match.start()
+        if not (structure.inside(pos, 'lstlisting') or structure.inside(pos, 'figure')):
+            headings.setdefault(match.group(1), []).append(pos)
+    level = next((level for level in CHAPTER_HEADING_LEVELS if len(headings.get(level, ())) >= 2), None)
+    if level is None:
+        return None
+    
+    starts = []
+    for pos in headings[level]:
+        # 较早版本的pandoc把标题包在 \hypertarget{...}{% 中，从该行开始拆分
+        line_start = content.rfind('\n', body_start, pos - 1) + 1
+        if line_start >= body_start and content.startswith('\\hypertarget{', line_start) \
+                and content[line_start:pos].rstrip().endswith('{%'):
+            pos = line_start
+        starts.append(pos)
+    chapters = [content[body_start:starts[0]]]
+    chapters += [content[start:stop] for start, stop in zip(starts, starts[1:] + [body_end])]
+    if not chapters[0].strip():
+        chapters.pop(0)
+    preamble = content[:begin] + INCLUDE_ONLY_HOOK + content[begin:body_start]
+    return preamble, chapters, content[body_end:], level
+
+def write_if_changed(path, text):
+    """内容变化时才写入文本文件"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return
+    except OSError:
+        pass
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def chapter_source_digest(tex_dir, text):
+    """章节正文及其引用图片（大小和修改时间）的摘要"""
+    digest = hashlib.sha256(text.encode('utf-8'))
+    for path in LATEX_GRAPHICS_PATTERN.findall(text):
+        try:
+            stat = (tex_dir / path).stat()
+            digest.update(f"\0{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode('utf-8'))
+        except OSError:
+            digest.update(f"\0{path}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+def latex_references(text):
+    """章节中\\ref、\\pageref、\\autoref、\\cref等引用的标签"""
+    labels = set()
+    for value in LATEX_REF_PATTERN.findall(text):
+        labels.update(label.strip() for label in value.split(',') if label.strip())
+    return labels
+
+def read_chapter_aux(path):
+    """读取章节的.aux文件，返回 (标签定义行, 目录条目行, 章节结束时的计数器)；文件不存在时都为空"""
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+    except OSError:
+        return {}, [], {}
+    labels = {match.group(1): match.group(0) for match in AUX_LABEL_PATTERN.finditer(text)}
+    contents = AUX_CONTENTS_PATTERN.findall(text)
+    checkpoint = text.find(AUX_CHECKPOINT)
+    counters = {}
+    if checkpoint >= 0:
+        counters = {name: int(value) for name, value in AUX_COUNTER_PATTERN.findall(text, checkpoint)}
+    return labels, contents, counters
+
+def predict_chapter_checkpoint(end, old_start, new_start):
+    """章节内容未变而起始计数器变化时，推测其结束时的计数器
+
+    old_start和new_start只包含跨章节延续的计数器（页码、图表和公式编号等），它们在
+    章节内只递增，结束值随起始值平移；缺少的计数器按LaTeX的初始值（页码为1，其余
+    为0）计算。推测错误时下一轮会按实际结果重新编译后续章节。
+    """
+    predicted = dict(end)
+    for name, value in new_start.items():
+        before = old_start.get(name, 1 if name == 'page' else 0)
+        if name in end and end[name] >= before:
+            predicted[name] = end[name] + value - before
+    return predicted
+
+def rewrite_aux_checkpoint(path, counters):
+    """替换.aux文件中\\@setckpt记录的计数器值"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    checkpoint = text.find(AUX_CHECKPOINT)
+    if checkpoint < 0:
+        return
+    tail = AUX_COUNTER_PATTERN.sub(
+        lambda match: f"\\setcounter{{{match.group(1)}}}{{{counters.get(match.group(1), match.group(2))}}}",
+        text[checkpoint:])
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text[:checkpoint] + tail)
+
+def merge_pdfs(paths, output):
+    """按顺序合并PDF文件（pypdf，或qpdf/pdfunite命令），没有可用工具或合并失败时返回False"""
+    output = Path(output)
+    tmp_path = output.with_name(output.name + '.tmp')
+    try:
+        if pypdf is not None:
+            writer = pypdf.PdfWriter()
+            for path in paths:
+                writer.append(str(path))
+            with open(tmp_path, 'wb') as f:
+                writer.write(f)
+        elif shutil.which('qpdf'):
+            # qpdf只有警告时返回3，输出仍然可用
+            result = run_cancellable(['qpdf', '--empty', '--pages', *map(str, paths), '--', str(tmp_path)])
+            if result.returncode not in (0, 3):
+                return False
+        elif shutil.which('pdfunite'):
+            result = run_cancellable(['pdfunite', *map(str, paths), str(tmp_path)])
+            if result.returncode != 0:
+                return False
+        else:
+            return False
+    except BuildCancelled:
+        raise
+    except Exception as e:
+        debug_print(f"合并章节PDF失败: {e}")
+        return False
+    if not tmp_path.exists() or tmp_path.stat().st_size == 0:
+        return False
+    os.replace(tmp_path, output)
+    return True
+
+def run_chapter_passes(tex_file, latex_format=None):
+    """按顶层标题拆分LaTeX文件，并行编译受影响的章节并合并为完整PDF
+
+    每个章节写入chapters/chapter-NN.tex，由主文件chapters-main.tex按顺序\\include；
+    各章节通过\\includeonly在独立的输出目录中编译，同时运行的xelatex数由
+    SPLIT_CHAPTERS限制。章节只在以下情况下重新编译：导言区、正文或其中的图片
+    变化，起始计数器（页码、编号，来自前一章节的.aux）变化，所引用标签的定义
+    变化，或者包含目录的章节中目录条目变化。起始计数器变化的章节会推测其结束
+    时的计数器，使后续章节在同一轮中并行编译。最多进行MAX_LATEX_PASSES轮。
+    返回 (最后一次运行的结果, 各章节合并的LatexLogParser)；文档不适合拆分时返回None。
+    """
+    tex_file = Path(tex_file)
+    tex_dir = tex_file.parent
+    with open(tex_file, 'r', encoding='utf-8') as f:
+        split = split_latex_chapters(f.read())
+    if split is None:
+        debug_print("没有出现两次以上的同级标题，不拆分章节")
+        return None
+    preamble, chapters, tail, level = split
+    carried = [name for name in CHAPTER_CARRIED_COUNTERS if name not in CHAPTER_RESET_COUNTERS.get(level, ())]
+    chapter_dir = tex_dir / CHAPTER_DIR
+    chapter_dir.mkdir(exist_ok=True)
+    names = [f"chapter-{i:02d}" for i in range(len(chapters))]
+    master = tex_dir / f"{CHAPTER_MASTER}.tex"
+    write_if_changed(master, preamble + ''.join(f"\\include{{{CHAPTER_DIR}/{name}}}\n" for name in names) + tail)
+    sources, references = {}, {}
+    for name, text in zip(names, chapters):
+        write_if_changed(chapter_dir / f"{name}.tex", text)
+        sources[name] = chapter_source_digest(tex_dir, text)
+        references[name] = latex_references(text)
+    contents_readers = {name for name, text in zip(names, chapters) if CONTENTS_COMMAND_PATTERN.search(text)}
+    # 删除文档变短后多余的章节文件
+    for path in chapter_dir.glob('chapter-*'):
+        if path.name.split('.')[0] not in names:
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink()
+    
+    # 导言区、样式文件、xelatex或格式文件变化时所有章节都重新编译
+    styles = [path.read_bytes() for path in sorted(tex_dir.glob('*.sty'))]
+    preamble_key = ArtifactCache.make_key('chapters', preamble, get_tool_version('xelatex') or '',
+                                          latex_format[0] if latex_format else '', *styles)
+    state_path = chapter_dir / CHAPTER_STATE_FILE
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    compiled = state.get('chapters', {}) if state.get('preamble') == preamble_key else {}
+    compiled = {name: entry for name, entry in compiled.items() if name in names}
+    
+    jobs = setting('SPLIT_CHAPTERS') or os.cpu_count() or 1
+    max_rounds = setting('MAX_LATEX_PASSES')
+    chapter_pdfs = [chapter_dir / name / f"{CHAPTER_MASTER}.pdf" for name in names]
+    logs = {}
+    xelatex_result = subprocess.CompletedProcess([], 0, None, '')
+    
+    def merged_log():
+        log = LatexLogParser()
+        for name in names:
+            if name in logs:
+                log.merge(logs[name])
+        return log
+    
+    for round_num in range(1, max_rounds + 1):
+        auxes = [read_chapter_aux(chapter_dir / f"{name}.aux") for name in names]
+        labels = {}
+        for chapter_labels, _, _ in auxes:
+            labels.update(chapter_labels)
+        contents = [line for _, chapter_contents, _ in auxes for line in chapter_contents]
+        
+        # 按顺序确定需要编译的章节，每个章节的起始计数器为前一章节结束时的计数器
+        todo, pending, predicted = [], {}, {}
+        start = {}
+        for name, (_, _, end), pdf in zip(names, auxes, chapter_pdfs):
+            refs = sorted(references[name])
+            inputs = ArtifactCache.make_key(json.dumps(
+                [start, refs, [labels.get(ref) for ref in refs], contents if name in contents_readers else None],
+                ensure_ascii=False, sort_keys=True))
+            entry = compiled.get(name)
+            if entry is None or entry['source'] != sources[name] or entry['inputs'] != inputs or not pdf.exists():
+                todo.append(name)
+                pending[name] = {'source': sources[name], 'inputs': inputs, 'start': start}
+                if entry is not None and entry['source'] == sources[name] and end and entry['start'] != start:
+                    # 只有起始计数器变化，推测结束时的计数器，后续章节可以在同一轮中编译
+                    end = predict_chapter_checkpoint(end, entry['start'], start)
+                    predicted[name] = end
+            start = {counter: end[counter] for counter in carried if counter in end}
+        if not todo:
+            break
+        debug_print(f"第{round_num}轮: 编译 {len(todo)}/{len(names)} 个章节 ({', '.join(todo)})")
+        for name, counters in predicted.items():
+            rewrite_aux_checkpoint(chapter_dir / f"{name}.aux", counters)
+        profile_count('chapters_compiled', len(todo))
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(jobs, len(todo)))) as executor:
+            futures = {}
+            for name in todo:
+                (chapter_dir / name / CHAPTER_DIR).mkdir(parents=True, exist_ok=True)
+                job = f"{CHAPTER_DIR}/{name}"
+                # 工作线程继承当前上下文（配置、性能剖析器、取消事件）
+                futures[name] = executor.submit(contextvars.copy_context().run, run_xelatex_passes,
+                                                master, None, latex_format, job, job)
+            results = {name: future.result() for name, future in futures.items()}
+        
+        failed = None
+        for name, pdf in zip(names, chapter_pdfs):
+            if name not in results:
+                continue
+            result, logs[name] = results[name]
+            if logs[name].fatal or not pdf.exists():
+                print(f"章节 {name} 编译失败")
+                failed = failed or result
+                continue
+            xelatex_result = result
+            # 发布本章节的.aux，其他章节的编译从输出目录之外读取它
+            shutil.copyfile(chapter_dir / name / CHAPTER_DIR / f"{name}.aux", chapter_dir / f"{name}.aux")
+            compiled[name] = pending[name]
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump({'preamble': preamble_key, 'chapters': compiled}, f, ensure_ascii=False)
+        if failed is not None:
+            return failed, merged_log()
+    else:
+        debug_print(f"已达到最大编译轮数 {max_rounds}，章节间的交叉引用可能仍未稳定")
+    profile_count('chapters_unchanged', len(names) - len(logs))
+    
+    pdf_file = tex_file.with_suffix('.pdf')
+    if merge_pdfs(chapter_pdfs, pdf_file):
+        debug_print(f"已合并 {len(names)} 个章节的PDF（重新编译 {len(logs)} 个）")
+        return xelatex_result, merged_log()
+    
+    # 无法合并时在所有章节的.aux都已稳定的情况下整体编译一次主文件
+    debug_print("未找到pypdf、qpdf或pdfunite，整体编译主文件生成完整PDF")
+    (chapter_dir / 'full' / CHAPTER_DIR).mkdir(parents=True, exist_ok=True)
+    xelatex_result, log = run_xelatex_passes(master, latex_format=latex_format,
+                                             output_directory=f"{CHAPTER_DIR}/full")
+    full_pdf = chapter_dir / 'full' / f"{CHAPTER_MASTER}.pdf"
+    if full_pdf.exists():
+        shutil.copyfile(full_pdf, pdf_file)
+    return xelatex_result, log
+
+# 普通文本中需要替换为TeX命令的特殊字符，可通过 --char-map 扩展
+SPECIAL_CHAR_MAP = {
+    "β": "\\betasym{}",
+    "γ": "\\gammasym{}",
+    "δ": "\\deltasym{}",
+    "τ": "\\tausym{}",
+    "↔": "\\doublearrow{}",
+    "⟺": "\\doublelarrow{}"
+}
+
+class SymbolSubstituter:
+    """特殊字符替换引擎：一次扫描完成映射表中所有字符的替换
+
+    数学公式（$...$、$$...$$、\\(...\\)、\\[...\\]及数学环境）和原样输出区域
+    （lstlisting、verbatim等环境及\\verb）保持不变；紧跟在 \\ 或 { 之后的字符
+    视为已有命令的一部分，同样不替换。
+    """
+
+    SKIP_ENVIRONMENTS = (
+        'lstlisting', 'verbatim', 'Verbatim', 'minted', 'comment',
+        'equation', 'equation*', 'align', 'align*', 'gather', 'gather*',
+        'multline', 'multline*', 'eqnarray', 'eqnarray*', 'displaymath', 'math'
+    )
+
+    def __init__(self, mapping):
+        self.mapping = dict(mapping)
+        envs = '|'.join(re.escape(env) for env in self.SKIP_ENVIRONMENTS)
+        skip_patterns = [
+            rf'\\begin\{{(?P<env>{envs})\}}.*?\\end\{{(?P=env)\}}',
+            r'\\verb\*?(?P<delim>[^\sa-zA-Z*]).*?(?P=delim)',
+            r'(?<!\\)\$\$.*?(?<!\\)\$\$',
+            r'(?<!\\)\$(?:\\.|[^$\\])+\$',
+            r'\\\(.*?\\\)',
+            r'\\\[.*?\\\]',
+        ]
+        # 较长的字符序列优先匹配
+        symbols = '|'.join(re.escape(char) for char in sorted(self.mapping, key=len, reverse=True))
+        self.symbol_pattern = re.compile(symbols) if symbols else None
+        self.pattern = re.compile(
+            f"(?P<skip>{'|'.join(skip_patterns)})|(?P<sym>{symbols})" if symbols else r'(?!)',
+            re.DOTALL
+        )
+
+    def substitute(self, content):
+        """返回替换后的文本"""
+        # 文本中不含任何待替换字符时直接返回，避免无谓的扫描
+        if not any(char in content for char in self.mapping):
+            return content
+        def replace(match):
+            symbol = match.group('sym')
+            if symbol is None:
+                return match.group(0)
+            # 检查前一个字符，避免替换已有的命令
+            if match.start() > 0 and content[match.start() - 1] in '\\{':
+                return symbol
+            return self.mapping[symbol]
+        return self.pattern.sub(replace, content)
+
+    def split(self, text):
+        """将纯文本拆分为 (片段, TeX命令) 序列，普通片段的TeX命令为None
+
+        用于AST模式：文本节点中不存在数学公式或命令，无需跳过任何区域。
+        """
+        if self.symbol_pattern is None or not any(char in text for char in self.mapping):
+            return [(text, None)]
+        pieces = []
+        pos = 0
+        for match in self.symbol_pattern.finditer(text):
+            if match.start() > pos:
+                pieces.append((text[pos:match.start()], None))
+            pieces.append((match.group(0), self.mapping[match.group(0)]))
+            pos = match.end()
+        if pos < len(text):
+            pieces.append((text[pos:], None))
+        return pieces
+
+# 已编译的替换引擎，按映射表内容缓存
+_SYMBOL_SUBSTITUTERS = {}
+
+def get_symbol_substituter(mapping):
+    """返回指定映射表对应的替换引擎（编译结果会被缓存）"""
+    key = tuple(sorted(mapping.items()))
+    substituter = _SYMBOL_SUBSTITUTERS.get(key)
+    if substituter is None:
+        substituter = SymbolSubstituter(mapping)
+        _SYMBOL_SUBSTITUTERS[key] = substituter
+    return substituter
+
+def load_char_map(path):
+    """从JSON文件加载额外的字符映射表，格式为 {"字符": "TeX命令"}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        mapping = json.load(f)
+    if not isinstance(mapping, dict) or not all(isinstance(k, str) and isinstance(v, str) and k
+                                                for k, v in mapping.items()):
+        raise ValueError(f"字符映射文件格式错误，应为 {{\"字符\": \"TeX命令\"}}: {path}")
+    return mapping
+
+class LatexStructure:
+    """LaTeX文档的环境结构索引
+
+    一次线性扫描记录figure、lstlisting、document环境的区间以及导言区的范围，
+    之后可以用二分查找在对数时间内回答"某个位置是否位于某环境内"之类的问题。
+    lstlisting内部的内容视为原样文本，其中的\\begin/\\end不计入结构。
+    """
+
+    ENVIRONMENTS = ('figure', 'lstlisting', 'document')
+    _ENV_PATTERN = re.compile(r'\\(begin|end)\{(figure\*?|lstlisting|document)\}')
+
+    def __init__(self, content):
+        self.content = content
+        spans = {env: [] for env in self.ENVIRONMENTS}
+        open_stack = {env: [] for env in self.ENVIRONMENTS}
+        in_listing = False
+        for match in self._ENV_PATTERN.finditer(content):
+            kind, env = match.group(1), match.group(2).rstrip('*')
+            if in_listing and env != 'lstlisting':
+                continue
+            if kind == 'begin':
+                open_stack[env].append(match.start())
+                if env == 'lstlisting':
+                    in_listing = True
+            elif open_stack[env]:
+                spans[env].append((open_stack[env].pop(), match.end()))
+                if env == 'lstlisting':
+                    in_listing = False
+        self._spans = {}
+        self._starts = {}
+        self._reach = {}
+        for env, env_spans in spans.items():
+            env_spans.sort()
+            self._spans[env] = env_spans
+            self._starts[env] = [start for start, _ in env_spans]
+            # 前缀最大结束位置，用于处理嵌套区间
+            reach = []
+            furthest = -1
+            for _, end in env_spans:
+                furthest = max(furthest, end)
+                reach.append(furthest)
+            self._reach[env] = reach
+        documents = self._spans['document']
+        self.preamble_end = documents[0][0] if documents else None
+
+    def spans(self, env):
+        """返回指定环境的所有区间（按起始位置排序）"""
+        return self._spans[env]
+
+    def inside(self, pos, env):
+        """判断位置pos是否位于指定环境内部"""
+        i = bisect.bisect_right(self._starts[env], pos) - 1
+        return i >= 0 and self._reach[env][i] > pos
+
+    def next_span(self, pos, env):
+        """返回起始位置不早于pos的第一个环境区间，没有时返回None"""
+        i = bisect.bisect_left(self._starts[env], pos)
+        spans = self._spans[env]
+        return spans[i] if i < len(spans) else None
+
+    def in_preamble(self, pos):
+        """判断位置pos是否位于导言区"""
+        return self.preamble_end is not None and pos < self.preamble_end
+
+def apply_splices(content, edits):
+    """将 (起始, 结束, 替换文本) 形式的编辑一次性拼接到原文中
+
+    编辑按起始位置排序，与前一个编辑重叠的编辑会被忽略。整个拼接只复制一次文本。
+    """
+    if not edits:
+        return content
+    pieces = []
+    last = 0
+    for start, end, text in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+        if start < last:
+            continue
+        pieces.append(content[last:start])
+        pieces.append(text)
+        last = end
+    pieces.append(content[last:])
+    return ''.join(pieces)
+
+# 后处理第4步用到的模式：无嵌套花括号的\caption、\includegraphics以及SVG占位符
+SVG_CAPTION_PATTERN = re.compile(r'\\caption\{([^{}\n]*)\}')
+SVG_GRAPHICS_PATTERN = re.compile(r'\\includegraphics(\[[^\]\n]*\])?\{([^{}\n]*)\}')
+SVG_PLACEHOLDER_PATTERN = re.compile(r'(?:图 \d+: )?SVG_PLACEHOLDER_\d+(?!\d)|图 \d+:')
+SVG_FIGURE_WIDTH = '[width=0.8\\textwidth]'
+
+def fix_svg_references(content, svg_files):
+    """修复SVG图片的标题和引用：替换占位符标题、补全图片路径、为只剩占位符的段落插入figure
+
+    一次扫描收集所有\\caption、\\includegraphics和占位符的位置，各SVG依次查表决定
+    编辑（已被前面的编辑覆盖的位置视为不存在），最后用apply_splices一次拼接，
+    不再对每个SVG搜索和替换整个文档。
+    """
+    captions = collections.defaultdict(list)
+    for match in SVG_CAPTION_PATTERN.finditer(content):
+        captions[match.group(1)].append(match.span())
+    graphics = collections.defaultdict(list)
+    for match in SVG_GRAPHICS_PATTERN.finditer(content):
+        graphics[(match.group(1) or '', match.group(2))].append(match.span())
+    
+    # 占位符 -> 包含它的行（按出现顺序），只有文档中有占位符时才需要
+    placeholder_lines = collections.defaultdict(list)
+    raw_placeholders = [match.start() for match in re.finditer('SVG_PLACEHOLDER', content)]
+    if raw_placeholders:
+        for match in SVG_PLACEHOLDER_PATTERN.finditer(content):
+            line_start = content.rfind('\n', 0, match.start()) + 1
+            line_end = content.find('\n', match.end())
+            line = (line_start, len(content) if line_end < 0 else line_end)
+            placeholder = match.group(0)
+            keys = [placeholder]
+            if ': SVG_PLACEHOLDER_' in placeholder:
+                keys += [placeholder[placeholder.index('SVG_PLACEHOLDER_'):], placeholder[:placeholder.index(':') + 1]]
+            for key in keys:
+                placeholder_lines[key].append((match.start(), line))
+    
+    edits = []
+    replaced = []  # 已编辑的区间（有序、互不重叠）
+    
+    def removed(pos):
+        i = bisect.bisect_right(replaced, (pos, float('inf'))) - 1
+        return i >= 0 and replaced[i][1] > pos
+    
+    def replace(start, end, text):
+        edits.append((start, end, text))
+        bisect.insort(replaced, (start, end))
+    
+    def edited_within(start, end):
+        i = bisect.bisect_left(replaced, (start, start))
+        return [span for span in replaced[i:bisect.bisect_left(replaced, (end, end))] if span[1] <= end]
+    
+    def untouched(start, end):
+        return not removed(start) and not removed(end - 1) and not edited_within(start, end)
+    
+    first_raw = 0
+    for svg_info in svg_files:
+        index = svg_info['index']
+        fig_caption = svg_info['caption'] if svg_info['caption'] else f"图 {index}"
+        placeholder_patterns = [
+            f"图 {index}: SVG_PLACEHOLDER_{index-1}",
+            f"SVG_PLACEHOLDER_{index-1}",
+            f"图 {index}:"
+        ]
+        
+        # 标题恰好是占位符时替换为SVG的标题
+        for pattern in placeholder_patterns:
+            spans = [span for span in captions.get(pattern, ()) if not removed(span[0])]
+            if spans:
+                captions.pop(pattern)
+                for start, end in spans:
+                    replace(start, end, f"\\caption{{{fig_caption}}}")
+                debug_print(f"替换了图像标题: '{pattern}' -> '{fig_caption}'")
+                break
         
-        # 进入LaTeX文件所在目录
-        current_dir = os.getcwd()
-        os.chdir(tex_dir)
+        svg_path = svg_info['path']
+        if any(not removed(start) for start, _ in graphics.get(('', svg_path), ())) or \
+           any(not removed(start) for start, _ in graphics.get((SVG_FIGURE_WIDTH, svg_path), ())):
+            continue
+        image_name = svg_path.split('/')[-1]
+        spans = [span for span in graphics.get(('', image_name), ()) if not removed(span[0])]
+        if spans:
+            # 修复相对路径问题；之后同一路径的SVG视为已有引用
+            for start, end in spans:
+                replace(start, end, f"\\includegraphics{SVG_FIGURE_WIDTH}{{{svg_path}}}")
+            graphics[(SVG_FIGURE_WIDTH, svg_path)] = spans
+            graphics.pop(('', image_name))
+            debug_print(f"修复了图像路径: '{image_name}' -> '{svg_path}'")
+            continue
         
-        try:
-            # 第一次编译: xelatex
-            debug_print("第一次编译...")
-            xelatex_cmd = ['xelatex', '-interaction=nonstopmode', tex_filename]
-            xelatex_result = subprocess.run(
-                xelatex_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True  # 使用文本模式
-            )
-            
-            # 第二次编译: xelatex
-            debug_print("第二次编译...")
-            xelatex_result = subprocess.run(
-                xelatex_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
-            )
-            
-            # 检查编译结果和PDF文件
-            pdf_success = os.path.exists(pdf_filename)
-            
-            # 检查PDF大小
-            pdf_size = 0
-            if pdf_success:
-                pdf_size = os.path.getsize(pdf_filename)
-                debug_print(f"找到PDF文件: {pdf_filename}, 大小: {pdf_size} 字节")
-            
-            # 检查是否真正成功（PDF存在且不为空）
-            if pdf_success and pdf_size > 0:
-                pdf_path = tex_dir / pdf_filename
-                debug_print(f"PDF文件已成功生成: {pdf_path}")
+        while first_raw < len(raw_placeholders) and removed(raw_placeholders[first_raw]):
+            first_raw += 1
+        if first_raw == len(raw_placeholders):
+            continue
+        for placeholder in placeholder_patterns:
+            line = next((line for pos, line in placeholder_lines.get(placeholder, ()) if not removed(pos)), None)
+            if line is None:
+                continue
+            # 用图像代码替换包含占位符的段落
+            figure_code = f"""
+\\begin{{figure}}[htbp]
+\\centering
+\\includegraphics{SVG_FIGURE_WIDTH}{{{svg_path}}}
+\\caption{{{fig_caption}}}
+\\label{{fig:svg_{index}}}
+\\end{{figure}}
+"""
+            inner = edited_within(*line)
+            if inner:
+                # 行内已有编辑（例如已替换的标题）时只替换这一行，并覆盖行内的编辑
+                replaced[:] = [span for span in replaced if span not in inner]
+                edits[:] = [edit for edit in edits if (edit[0], edit[1]) not in inner]
+                replace(line[0], line[1], figure_code)
             else:
-                # 可能有错误，检查LaTeX日志
-                if os.path.exists(f"{tex_path.stem}.log"):
-                    with open(f"{tex_path.stem}.log", 'r', encoding='utf-8', errors='ignore') as log_file:
-                        log_content = log_file.read()
-                        error_lines = [line for line in log_content.split('\n') if '! ' in line]
-                        if error_lines:
-                            print("编译时遇到错误:")
-                            for line in error_lines[:5]:  # 只显示前5个错误
-                                print(f"  {line}")
-                        else:
-                            print("编译过程可能有未知错误，请检查日志文件")
-                
-                # 检查编译过程的标准输出
-                if xelatex_result.returncode != 0:
-                    print(f"xelatex返回错误码: {xelatex_result.returncode}")
-                    error_output = xelatex_result.stderr
-                    if error_output:
-                        print("错误输出:", error_output[:500])  # 限制输出长度
-                
-                return False, None
-        
-            # 列出目录中的当前文件
-            current_files = os.listdir(".")
-            debug_print("当前目录文件列表:")
-            for f in current_files:
-                if f.endswith(".pdf"):
-                    debug_print(f"  {f} - {os.path.getsize(f)} 字节")
-            
-            # 检查图片文件
-            pics_dir = Path("pics")
-            if pics_dir.exists():
-                debug_print("检查图片文件:")
-                for img_file in pics_dir.glob("*.*"):
-                    debug_print(f"  {img_file.name} - {img_file.stat().st_size} 字节")
-            
-            # 强化图片修复模式
-            if fix_images and pdf_success:
-                try:
-                    debug_print("使用强化图片修复模式...")
-                    
-                    # 读取LaTeX文件内容
-                    with open(tex_filename, 'r', encoding='utf-8') as f:
-                        tex_content = f.read()
-                    
-                    # 找出所有图片引用
-                    img_refs = re.findall(r'\\includegraphics(?:\[.*?\])?\{(.*?)\}', tex_content)
-                    debug_print(f"发现 {len(img_refs)} 个图片引用")
-                    
-                    # 创建一个新版本的LaTeX内容，确保图片引用正确
-                    new_tex_content = tex_content
-                    
-                    # 如果是进一步强化模式，可以在这里添加额外的处理
-                    # 例如，确保图片路径正确
-                    for img_ref in img_refs:
-                        # 检查图片是否存在
-                        img_path = Path(img_ref)
-                        if not (img_path.is_absolute() or img_path.exists()):
-                            # 如果是相对路径且不存在，尝试查找
-                            img_name = img_path.name
-                            # 搜索可能的位置
-                            for root, dirs, files in os.walk('.'):
-                                if img_name in files:
-                                    found_path = Path(root) / img_name
-                                    rel_path = str(found_path.relative_to(".")).replace("\\", "/")
-                                    debug_print(f"替换图片路径: {img_ref} -> {rel_path}")
-                                    new_tex_content = new_tex_content.replace(f"{{{img_ref}}}", f"{{{rel_path}}}")
-                                    break
-                    
-                    # 只有当内容发生变化时才重写文件和重新编译
-                    if new_tex_content != tex_content:
-                        debug_print("LaTeX内容已更新，重新编译...")
-                        with open(tex_filename, 'w', encoding='utf-8') as f:
-                            f.write(new_tex_content)
-                        
-                        # 重新编译两次
-                        debug_print("第一次编译...")
-                        subprocess.run(xelatex_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        debug_print("第二次编译...")
-                        subprocess.run(xelatex_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        
-                        # 再次检查PDF
-                        pdf_success = os.path.exists(pdf_filename)
-                        if pdf_success:
-                            pdf_size = os.path.getsize(pdf_filename)
-                            debug_print(f"找到PDF文件: {pdf_filename}, 大小: {pdf_size} 字节")
-                        
-                            if not (pdf_success and pdf_size > 0):
-                                print("强化修复后编译失败，请检查LaTeX错误")
-                                return False, None
-                
-                except Exception as e:
-                    print(f"强化图片修复模式出错: {e}")
-                    # 继续使用原始编译结果
-            
-            return True, tex_dir / pdf_filename
-        
-        finally:
-            # 确保返回原始目录
-            os.chdir(current_dir)
+                # 与逐个替换时一样，文档中所有相同的文本都替换
+                text = content[line[0]:line[1]]
+                start = content.find(text)
+                while start >= 0:
+                    if untouched(start, start + len(text)):
+                        replace(start, start + len(text), figure_code)
+                        start = content.find(text, start + len(text))
+                    else:
+                        start = content.find(text, start + 1)
+            debug_print(f"添加了图像引用: 图 {index}")
+            break
     
-    except Exception as e:
-        print(f"编译LaTeX时出错: {e}")
-        return False, None
+    return apply_splices(content, edits)
 
-def remove_lstlisting_wrappers(content):
+def remove_lstlisting_wrappers(content, svg_files=None):
     """
     删除lstlisting环境的包装，保留内部的图片引用代码
     """
     # 查找被lstlisting环境包装的图片引用代码
     pattern = r'\\begin\{lstlisting\}(\[language=XML\])?\s*(\\begin\{figure\}.*?\\end\{figure\})\s*\\end\{lstlisting\}'
     
-    # 查找匹配项并替换
-    matches = list(re.finditer(pattern, content, re.DOTALL))
-    if matches:
-        debug_print(f"找到了{len(matches)}处被lstlisting包装的图片引用")
-        for match in matches:
-            # 提取图片引用代码
-            figure_code = match.group(2).strip()
-            # 替换整个匹配为仅保留的图片引用代码
-            content = content.replace(match.group(0), figure_code)
-            debug_print("已移除lstlisting包装，保留图片引用代码")
+    # 查找匹配项，替换为仅保留的图片引用代码
+    edits = [(match.start(), match.end(), match.group(2).strip())
+             for match in re.finditer(pattern, content, re.DOTALL)]
+    if edits:
+        debug_print(f"找到了{len(edits)}处被lstlisting包装的图片引用")
+        content = apply_splices(content, edits)
+        debug_print("已移除lstlisting包装，保留图片引用代码")
     
     # 查找并移除空的lstlisting环境
     empty_pattern = r'\\begin\{lstlisting\}(\[language=XML\])?\s*\\end\{lstlisting\}'
@@ -553,91 +3523,93 @@ def remove_lstlisting_wrappers(content):
     # 需要单独处理"以下 SVG 图展示..."后面接着的lstlisting环境
     svg_intro_pattern = r'(以下 SVG 图展示[^\n]*)\s*\\begin\{lstlisting\}(\[language=XML\])?\s*(.*?)\\end\{lstlisting\}'
     
-    for match in re.finditer(svg_intro_pattern, content, re.DOTALL):
+    matches = list(re.finditer(svg_intro_pattern, content, re.DOTALL))
+    if not matches:
+        return content
+    
+    structure = LatexStructure(content)
+    # 文档中第一个带编号的subsection，用于推断默认图片编号
+    first_subsection = re.search(r'\\subsection\{(\d+)', content)
+    edits = []
+    for match in matches:
         intro_text = match.group(1)
         listing_content = match.group(3).strip()
         
         # 检查listing内容是否为空或只有图片引用
         if not listing_content or listing_content.isspace():
             # lstlisting为空，检查后面是否有figure环境
-            after_listing = content[match.end():].strip()
-            figure_pattern = r'\\begin\{figure\}.*?\\end\{figure\}'
-            figure_match = re.search(figure_pattern, after_listing, re.DOTALL)
+            figure_span = structure.next_span(match.end(), 'figure')
             
-            if figure_match:
-                # 找到了紧随其后的figure环境，保留intro和figure
-                replacement = f"{intro_text}\n\n{figure_match.group(0)}"
+            if figure_span:
+                # 找到了其后的figure环境，保留intro和figure
+                figure_code = content[figure_span[0]:figure_span[1]]
+                replacement = f"{intro_text}\n\n{figure_code}"
                 # 替换原文本（包括intro、lstlisting和figure）
-                original = content[match.start():match.end() + figure_match.end()]
-                content = content.replace(original, replacement)
+                edits.append((match.start(), figure_span[1], replacement))
                 debug_print("已处理SVG介绍后的lstlisting并保留图片")
             else:
                 # 没有找到紧随其后的figure，尝试在pics目录查找合适的图片
                 figure_num = 1  # 默认图片编号
-                section_match = re.search(r'\\subsection\{(\d+)', content[:match.start()])
-                if section_match:
+                if first_subsection and first_subsection.end() <= match.start():
                     try:
-                        section_num = section_match.group(1)
+                        section_num = first_subsection.group(1)
                         figure_num = int(section_num)
                     except ValueError:
                         pass
                 
+                # SVG图片按内容哈希命名，优先使用对应序号的SVG文件
+                default_image = f"pics/figure_{figure_num}.pdf"
+                if svg_files and 0 < figure_num <= len(svg_files):
+                    default_image = svg_files[figure_num - 1]['path']
+                
                 # 创建新的图片引用
                 replacement = f"""{intro_text}
 
 \\begin{{figure}}[htbp]
 \\centering
-\\includegraphics[width=0.8\\textwidth]{{pics/figure_{figure_num}.pdf}}
+\\includegraphics[width=0.8\\textwidth]{{{default_image}}}
 \\caption{{研究脉络图}}
 \\label{{fig:figure_{figure_num}}}
 \\end{{figure}}
 """
-                content = content.replace(match.group(0), replacement)
-                debug_print(f"已替换空lstlisting为默认图片figure_{figure_num}.pdf")
+                edits.append((match.start(), match.end(), replacement))
+                debug_print(f"已替换空lstlisting为默认图片{default_image}")
         elif '\\begin{figure}' in listing_content and '\\end{figure}' in listing_content:
             # lstlisting中包含图片引用，直接提取
             figure_pattern = r'\\begin\{figure\}.*?\\end\{figure\}'
             figure_match = re.search(figure_pattern, listing_content, re.DOTALL)
             if figure_match:
                 replacement = f"{intro_text}\n\n{figure_match.group(0)}"
-                content = content.replace(match.group(0), replacement)
+                edits.append((match.start(), match.end(), replacement))
                 debug_print("已从lstlisting中提取并保留图片引用")
     
-    return content
+    return apply_splices(content, edits)
 
-def post_process_latex(tex_file, svg_files=None):
-    """后处理LaTeX文件，修复一些特定问题，处理SVG引用"""
-    try:
-        debug_print(f"\n调试: 对LaTeX文件进行后处理: {tex_file}")
-        with open(tex_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 1. 确保文件中包含了正确的字体设置
-        if '\\begin{document}' in content and '\\setCJKmainfont' not in content:
-            content = content.replace('\\begin{document}', 
-                                    '\\setCJKmainfont{STSong}\n'
-                                    '\\begin{document}')
-            debug_print("已添加CJK字体设置")
-            
-        # 新增：移除lstlisting环境包装，保留图片引用代码
-        content = remove_lstlisting_wrappers(content)
-        
-        # 2. 确保包含必要的包定义
-        preamble_additions = []
+def fix_latex_preamble(content):
+    """修正pandoc生成的LaTeX导言区：中文字体、特殊字符命令定义和图片相关的包"""
+    # 1. 确保文件中包含了正确的字体设置
+    if '\\begin{document}' in content and '\\setCJKmainfont' not in content:
+        content = content.replace('\\begin{document}', 
+                                '\\setCJKmainfont{STSong}\n'
+                                '\\begin{document}')
+        debug_print("已添加CJK字体设置")
+    
+    # 2. 确保包含必要的包定义
+    preamble_additions = []
+    
+    # 添加对特殊字符的支持（希腊字母、数学符号等）- 使用更简单的方式
+    if "\\usepackage{unicode-math}" in content:
+        # 移除可能导致问题的unicode-math包
+        content = content.replace("\\usepackage{unicode-math}", "")
         
-        # 添加对特殊字符的支持（希腊字母、数学符号等）- 使用更简单的方式
-        if "\\usepackage{unicode-math}" in content:
-            # 移除可能导致问题的unicode-math包
-            content = content.replace("\\usepackage{unicode-math}", "")
+        # 添加基本的amsmath和amssymb包用于数学符号支持
+        if "\\usepackage{amsmath}" not in content:
+            preamble_additions.append("\\usepackage{amsmath}")
+        if "\\usepackage{amssymb}" not in content:
+            preamble_additions.append("\\usepackage{amssymb}")
             
-            # 添加基本的amsmath和amssymb包用于数学符号支持
-            if "\\usepackage{amsmath}" not in content:
-                preamble_additions.append("\\usepackage{amsmath}")
-            if "\\usepackage{amssymb}" not in content:
-                preamble_additions.append("\\usepackage{amssymb}")
-                
-            # 添加直接的希腊字母命令定义
-            preamble_additions.append("""
+        # 添加直接的希腊字母命令定义
+        preamble_additions.append("""
 % 定义希腊字母和特殊符号的简单命令
 \\newcommand{\\betasym}{$\\beta$}
 \\newcommand{\\gammasym}{$\\gamma$}
@@ -646,122 +3618,115 @@ def post_process_latex(tex_file, svg_files=None):
 \\newcommand{\\doublearrow}{$\\leftrightarrow$}
 \\newcommand{\\doublelarrow}{$\\Leftrightarrow$}
 """)
-            debug_print("已添加特殊字符支持（简化版本）")
-        
-        # 添加所有前言需要的包和命令
-        if preamble_additions:
-            preamble_text = '\n'.join(preamble_additions) + '\n'
-            # 找一个合适的位置插入这些定义
-            if "\\usepackage{amsmath}" in content:
-                content = content.replace("\\usepackage{amsmath}", "\\usepackage{amsmath}\n" + preamble_text)
-            else:
-                content = content.replace('\\begin{document}', preamble_text + '\\begin{document}')
-            debug_print(f"已添加必要的LaTeX包和命令定义")
+        debug_print("已添加特殊字符支持（简化版本）")
+    
+    # 添加所有前言需要的包和命令
+    if preamble_additions:
+        preamble_text = '\n'.join(preamble_additions) + '\n'
+        # 找一个合适的位置插入这些定义
+        if "\\usepackage{amsmath}" in content:
+            content = content.replace("\\usepackage{amsmath}", "\\usepackage{amsmath}\n" + preamble_text)
+        else:
+            content = content.replace('\\begin{document}', preamble_text + '\\begin{document}')
+        debug_print(f"已添加必要的LaTeX包和命令定义")
+    
+    # 3. 确保在LaTeX中正确加载图片所需的包
+    img_packages = [
+        "\\usepackage{graphicx}",  # 基本图形包
+        "\\usepackage{float}"      # 用于控制图片位置
+    ]
+    
+    # 确保需要的包都被加载
+    for pkg in img_packages:
+        if pkg not in content:
+            content = content.replace('\\documentclass', f'{pkg}\n\\documentclass')
+    
+    # 4. 在preamble中添加额外的图片支持
+    if '\\begin{document}' in content:
+        preamble_additions = """
+% 增强图片处理支持
+\\usepackage{graphicx}
+\\usepackage{float}
+\\DeclareGraphicsExtensions{.pdf,.png,.jpg}
+\\graphicspath{{./pics/}}  % 指定图片搜索路径
+
+% 定义图片样式
+\\renewcommand{\\figurename}{图}
+"""
+        # 检查是否已经有这些设置
+        if '\\graphicspath' not in content:
+            # 在文档开始前添加这些设置
+            content = content.replace('\\begin{document}', preamble_additions + '\\begin{document}')
+            debug_print("添加了图片处理增强设置")
+    return content
+
+def post_process_latex(tex_file, svg_files=None):
+    """后处理LaTeX文件：读入后交给post_process_latex_text处理并写回"""
+    debug_print(f"\n调试: 对LaTeX文件进行后处理: {tex_file}")
+    with open(tex_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    content = post_process_latex_text(content, Path(tex_file).parent, svg_files)
+    if content is None:
+        return False
+    with open(tex_file, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return True
+
+def ensure_latex_images(content, output_dir):
+    """检查LaTeX中引用的pics/下的图片，缺失的从项目资源索引中查找同名文件复制过去"""
+    tex_dir = Path(output_dir)
+    pics_dir = tex_dir / 'pics'
+    if not pics_dir.exists():
+        pics_dir.mkdir(parents=True)
+        debug_print(f"创建图片目录: {pics_dir}")
+    
+    img_refs = list(dict.fromkeys(re.findall(r'\\includegraphics(?:\[.*?\])?\{(pics/[^}]+)\}', content)))
+    for img_ref in img_refs:
+        img_path = tex_dir / img_ref
+        if not img_path.exists():
+            debug_print(f"警告: 图片文件不存在 {img_path}")
+            # 在整个项目的资源索引中查找同名图片
+            source = get_project_asset_index().lookup(img_path.name)
+            if source:
+                debug_print(f"找到替代图片: {source}")
+                # 确保目标目录存在
+                img_path.parent.mkdir(parents=True, exist_ok=True)
+                copy_asset(source, img_path)
+                debug_print(f"已复制图片: {source} -> {img_path}")
+    
+    # 添加调试输出 - 列出所有图片引用和状态
+    debug_print(f"\n调试: LaTeX内容中的图片引用:")
+    for img_ref in img_refs:
+        img_path = tex_dir / img_ref
+        debug_print(f"  图片引用: {img_ref}")
+        debug_print(f"  文件存在: {img_path.exists()}, 大小: {img_path.stat().st_size if img_path.exists() else 0} 字节")
+
+def post_process_latex_text(content, output_dir=None, svg_files=None):
+    """在内存中后处理pandoc生成的LaTeX，修复一些特定问题，处理SVG引用
+
+    output_dir为LaTeX文件所在目录，缺失的图片会从项目资源索引复制到其中的pics目录；
+    为None时不访问文件系统。返回处理后的内容，出错时打印错误并返回None。
+    """
+    try:
+        # 1-2. 修正导言区：中文字体、特殊字符命令定义和图片相关的包
+        content = profile_pass('preamble', content, fix_latex_preamble(content))
         
-        # 3. 替换文本中的特殊字符为TeX命令
-        # 希腊字母替换 - 使用更简单的方式
-        greek_chars = {
-            "β": "\\betasym{}",
-            "γ": "\\gammasym{}",
-            "δ": "\\deltasym{}",
-            "τ": "\\tausym{}",
-            "↔": "\\doublearrow{}",
-            "⟺": "\\doublelarrow{}"
-        }
+        # 新增：移除lstlisting环境包装，保留图片引用代码
+        content = profile_pass('lstlisting', content, remove_lstlisting_wrappers(content, svg_files))
         
-        # 在普通文本中替换特殊字符（但避免替换命令定义等区域）
-        for char, command in greek_chars.items():
-            if char in content:
-                # 使用更安全的替换方法
-                parts = content.split(char)
-                new_content = parts[0]
-                for i in range(1, len(parts)):
-                    # 检查前一个字符，避免替换已有的命令
-                    if new_content and new_content[-1] not in '\\{':
-                        new_content += command
-                    else:
-                        new_content += char
-                    new_content += parts[i]
-                content = new_content
+        # 3. 替换文本中的特殊字符为TeX命令（单次扫描，跳过数学公式和原样输出区域）
+        content = profile_pass('special_chars', content, get_symbol_substituter(setting('SPECIAL_CHAR_MAP')).substitute(content))
         
         debug_print("已处理特殊字符")
         
-        # 4. 处理SVG图像引用
+        # 4. 处理SVG图像引用（一次扫描收集编辑，最后统一拼接）
         if svg_files:
-            for svg_info in svg_files:
-                image_file = svg_info['path'].split('/')[-1]
-                fig_caption = svg_info['caption'] if svg_info['caption'] else f"图 {svg_info['index']}"
-                
-                # 修复图像引用问题 - 查找各种可能的引用模式
-                placeholder_patterns = [
-                    f"图 {svg_info['index']}: SVG_PLACEHOLDER_{svg_info['index']-1}",
-                    f"SVG_PLACEHOLDER_{svg_info['index']-1}",
-                    f"图 {svg_info['index']}:"
-                ]
-                
-                # 查找图像引用并修复
-                for pattern in placeholder_patterns:
-                    # 检查是否有caption包含这个占位符
-                    caption_pattern = f"\\caption{{{pattern}}}"
-                    if caption_pattern in content:
-                        content = content.replace(caption_pattern, f"\\caption{{{fig_caption}}}")
-                        debug_print(f"替换了图像标题: '{pattern}' -> '{fig_caption}'")
-                        break
-                
-                # 查找缺失的图像引用并修复
-                svg_path = svg_info['path']
-                if f"\\includegraphics{{{svg_path}}}" not in content and \
-                   f"\\includegraphics[width=0.8\\textwidth]{{{svg_path}}}" not in content:
-                    
-                    # 检查是否存在不完整的图像引用
-                    image_name = svg_path.split('/')[-1]
-                    if f"\\includegraphics{{{image_name}}}" in content:
-                        # 修复相对路径问题
-                        content = content.replace(
-                            f"\\includegraphics{{{image_name}}}", 
-                            f"\\includegraphics[width=0.8\\textwidth]{{{svg_path}}}"
-                        )
-                        debug_print(f"修复了图像路径: '{image_name}' -> '{svg_path}'")
-                    elif "SVG_PLACEHOLDER" in content:
-                        # 查找包含占位符的段落，并添加正确的图像引用
-                        for placeholder in placeholder_patterns:
-                            if placeholder in content:
-                                paragraph_with_placeholder = re.search(
-                                    f"[^\n]*{re.escape(placeholder)}[^\n]*", 
-                                    content
-                                )
-                                if paragraph_with_placeholder:
-                                    # 创建图像代码
-                                    figure_code = f"""
-\\begin{{figure}}[htbp]
-\\centering
-\\includegraphics[width=0.8\\textwidth]{{{svg_path}}}
-\\caption{{{fig_caption}}}
-\\label{{fig:svg_{svg_info['index']}}}
-\\end{{figure}}
-"""
-                                    # 替换包含占位符的段落
-                                    content = content.replace(
-                                        paragraph_with_placeholder.group(0),
-                                        figure_code
-                                    )
-                                    debug_print(f"添加了图像引用: 图 {svg_info['index']}")
-                                    break
+            content = profile_pass('svg_refs', content, fix_svg_references(content, svg_files))
         
         # 5. 强化图片处理 - 确保在LaTeX中正确加载图片
-        img_packages = [
-            "\\usepackage{graphicx}",  # 基本图形包
-            "\\usepackage{float}"      # 用于控制图片位置
-        ]
-        
-        # 确保需要的包都被加载
-        for pkg in img_packages:
-            if pkg not in content:
-                content = content.replace('\\documentclass', f'{pkg}\n\\documentclass')
-        
         # 确保图片路径正确 - 移除路径中的多余空格
         img_pattern = r'\\includegraphics(\[.*?\])?\{\s*(.*?)\s*\}'
-        for match in re.finditer(img_pattern, content):
+        def normalize_img_tag(match):
             old_tag = match.group(0)
             options = match.group(1) or ''
             path = match.group(2).strip()  # 移除路径两端的空格
@@ -769,68 +3734,45 @@ def post_process_latex(tex_file, svg_files=None):
             # 构建新的图片标签，确保格式正确
             new_tag = f'\\includegraphics{options}{{{path}}}'
             if old_tag != new_tag:
-                content = content.replace(old_tag, new_tag)
                 debug_print(f"修复图片路径格式: {old_tag} -> {new_tag}")
+            return new_tag
+        content = profile_pass('normalize_images', content, re.sub(img_pattern, normalize_img_tag, content))
         
         # 6. 修复图像路径问题（特别是未指定pics/目录的图片）
         img_pattern = r'\\includegraphics(\[.*?\])?{((?!pics/).+?\.(?:pdf|png|jpg|jpeg))}'
+        edits = []
         for match in re.finditer(img_pattern, content):
-            options = match.group(1) or ''
             img_path = match.group(2)
             if not img_path.startswith('pics/') and not img_path.startswith('/'):
                 fixed_path = f"pics/{img_path}"
-                content = content.replace(
-                    f"\\includegraphics{options}{{{img_path}}}", 
-                    f"\\includegraphics[width=0.8\\textwidth]{{{fixed_path}}}"
-                )
+                edits.append((match.start(), match.end(),
+                              f"\\includegraphics[width=0.8\\textwidth]{{{fixed_path}}}"))
                 debug_print(f"修复了图像路径: '{img_path}' -> '{fixed_path}'")
-                
-                # 检查图片文件是否存在，不存在则尝试查找并复制
-                output_dir = Path(tex_file).parent
-                target_path = output_dir / fixed_path
-                if not target_path.exists():
-                    img_name = Path(img_path).name
-                    found = False
-                    
-                    # 递归查找图片
-                    for root, dirs, files in os.walk('.'):
-                        if img_name in files:
-                            source_path = Path(root) / img_name
-                            os.makedirs(target_path.parent, exist_ok=True)
-                            debug_print(f"找到并复制图片: {source_path} -> {target_path}")
-                            shutil.copy(source_path, target_path)
-                            found = True
-                            break
-                    
-                    if not found:
-                        debug_print(f"警告: 无法找到图片文件 {img_name} 以复制到 {target_path}")
+        content = profile_pass('image_paths', content, apply_splices(content, edits))
         
         # 7. 确保所有图片引用都被包装在figure环境中
-        img_refs = re.findall(r'\\includegraphics(?:\[.*?\])?\{(pics/[^}]+)\}', content)
-        for img_ref in img_refs:
-            # 检查这个引用是否已经在figure环境中
-            img_pattern = f'\\\\includegraphics(?:\\[.*?\\])?\\{{{re.escape(img_ref)}\\}}'
+        structure = LatexStructure(content)
+        svg_numbers = {svg_info['path']: str(svg_info['index']) for svg_info in (svg_files or [])}
+        edits = []
+        for match in re.finditer(r'\\includegraphics(?:\[.*?\])?\{(pics/[^}]+)\}', content):
+            img_ref = match.group(1)
             
-            # 查找匹配的includegraphics标签
-            match = re.search(img_pattern, content)
-            if match:
-                # 检查前后文是否已有figure环境
-                before_ctx = content[:match.start()].rfind('\\begin{figure')
-                after_ctx = content[match.end():].find('\\end{figure}')
+            # 检查这个引用是否已经在figure环境中
+            if not structure.inside(match.start(), 'figure'):
+                # 提取文件名和编号
+                file_name = Path(img_ref).name
+                fig_num = "1"
+                if "figure_" in file_name:
+                    fig_num_match = re.search(r'figure_(\d+)', file_name)
+                    if fig_num_match:
+                        fig_num = fig_num_match.group(1)
+                elif img_ref in svg_numbers:
+                    # SVG图片按内容哈希命名，从SVG信息中取得编号
+                    fig_num = svg_numbers[img_ref]
                 
-                # 如果没有在figure环境中
-                if before_ctx == -1 or content[before_ctx:match.start()].find('\\end{figure}') != -1 or after_ctx == -1:
-                    # 提取文件名和编号
-                    file_name = Path(img_ref).name
-                    fig_num = "1"
-                    if "figure_" in file_name:
-                        fig_num_match = re.search(r'figure_(\d+)', file_name)
-                        if fig_num_match:
-                            fig_num = fig_num_match.group(1)
-                    
-                    # 创建完整的figure环境
-                    img_tag = match.group(0)
-                    figure_env = f"""
+                # 创建完整的figure环境
+                img_tag = match.group(0)
+                figure_env = f"""
 \\begin{{figure}}[H]  % H强制图片在当前位置
 \\centering
 {img_tag}
@@ -838,13 +3780,15 @@ def post_process_latex(tex_file, svg_files=None):
 \\label{{fig:figure_{fig_num}}}
 \\end{{figure}}
 """
-                    # 替换原始图片标签
-                    content = content.replace(img_tag, figure_env)
-                    debug_print(f"为图片添加figure环境: {img_ref}")
+                # 替换原始图片标签
+                edits.append((match.start(), match.end(), figure_env))
+                debug_print(f"为图片添加figure环境: {img_ref}")
+        content = profile_pass('figure_wrap', content, apply_splices(content, edits))
         
         # 8. 处理特殊的图片引用格式
         # 8.1 处理 !(图 6: 普适性标度律示意图)(pics/figure_6.pdf) 格式
-        special_img_pattern = r'!\((图\s+\d+:.+?)\)\((pics/figure_\d+\.pdf)\)'
+        special_img_pattern = r'!\((图\s+\d+:.+?)\)\((pics/(?:figure_\d+|svg_[0-9a-f]+)\.pdf)\)'
+        edits = []
         for match in re.finditer(special_img_pattern, content):
             caption = match.group(1)
             img_path = match.group(2)
@@ -862,13 +3806,18 @@ def post_process_latex(tex_file, svg_files=None):
 \\end{{figure}}
 """
             # 替换原始的引用
-            content = content.replace(match.group(0), figure_code)
+            edits.append((match.start(), match.end(), figure_code))
             debug_print(f"修复了特殊图片引用: {caption}")
+        content = profile_pass('special_refs', content, apply_splices(content, edits))
         
         # 8.2 修复已有的未正确处理的图片引用
         # 查找类似 ! [ 图 6: 普适性标度律示意图 ] ( pics/figure_6.pdf ) 的模式
-        existing_img_pattern = r'!\s*\[\s*(图\s+\d+:.*?)\s*\]\s*\(\s*(pics/figure_\d+\.pdf)\s*\)'
-        for match in re.finditer(existing_img_pattern, content):
+        existing_img_pattern = r'!\s*\[\s*(图\s+\d+:.*?)\s*\]\s*\(\s*(pics/(?:figure_\d+|svg_[0-9a-f]+)\.pdf)\s*\)'
+        matches = list(re.finditer(existing_img_pattern, content))
+        if matches:
+            structure = LatexStructure(content)
+        edits = []
+        for match in matches:
             caption = match.group(1)
             img_path = match.group(2)
             
@@ -878,7 +3827,7 @@ def post_process_latex(tex_file, svg_files=None):
                 fig_num = fig_num_match.group(1)
                 
                 # 检查是否已经在figure环境中
-                if "\\begin{figure}" not in content.split(match.group(0))[0][-200:]:
+                if not structure.inside(match.start(), 'figure'):
                     # 创建figure环境
                     figure_code = f"""
 \\begin{{figure}}[htbp]
@@ -889,93 +3838,710 @@ def post_process_latex(tex_file, svg_files=None):
 \\end{{figure}}
 """
                     # 替换原始引用
-                    content = content.replace(match.group(0), figure_code)
+                    edits.append((match.start(), match.end(), figure_code))
                     debug_print(f"修复了标准图片引用: {caption}")
+        content = profile_pass('image_refs', content, apply_splices(content, edits))
         
         # 9. 处理可能在文本中直接出现的LaTeX图片代码 (防止被当作文本显示)
-        # 9.1 处理转义的LaTeX代码
+        # 9.1 处理转义的LaTeX代码，将双反斜杠替换为单反斜杠
         text_latex_pattern = r'\\\\begin\{figure\}.*?\\\\end\{figure\}'
-        for match in re.finditer(text_latex_pattern, content, re.DOTALL):
-            escaped_code = match.group(0)
-            # 将双反斜杠替换为单反斜杠
-            fixed_code = escaped_code.replace('\\\\', '\\')
-            content = content.replace(escaped_code, fixed_code)
+        def unescape_figure(match):
             debug_print(f"修复了转义的LaTeX代码")
+            return match.group(0).replace('\\\\', '\\')
+        content = profile_pass('unescape', content, re.sub(text_latex_pattern, unescape_figure, content, flags=re.DOTALL))
         
         # 9.2 处理图形环境中的空行，确保LaTeX正确处理
-        figure_blocks = re.findall(r'\\begin{figure}.*?\\end{figure}', content, re.DOTALL)
-        for block in figure_blocks:
+        def compact_figure(match):
+            block = match.group(0)
             # 删除多余的空行，但保留基本结构
             fixed_block = re.sub(r'\n\s*\n', '\n', block)
             if block != fixed_block:
-                content = content.replace(block, fixed_block)
                 debug_print("修复了figure环境中的空行")
+            return fixed_block
+        content = profile_pass('compact', content, re.sub(r'\\begin{figure}.*?\\end{figure}', compact_figure, content, flags=re.DOTALL))
         
-        # 10. 在preamble中添加额外的图片支持
-        if '\\begin{document}' in content:
-            preamble_additions = """
-% 增强图片处理支持
-\\usepackage{graphicx}
-\\usepackage{float}
-\\DeclareGraphicsExtensions{.pdf,.png,.jpg}
-\\graphicspath{{./pics/}}  % 指定图片搜索路径
-
-% 定义图片样式
-\\renewcommand{\\figurename}{图}
-"""
-            # 检查是否已经有这些设置
-            if '\\graphicspath' not in content:
-                # 在文档开始前添加这些设置
-                content = content.replace('\\begin{document}', preamble_additions + '\\begin{document}')
-                debug_print("添加了图片处理增强设置")
+        # 11. 确保图片文件存在，缺失的图片从项目资源索引中查找并复制
+        if output_dir is not None:
+            ensure_latex_images(content, output_dir)
         
-        # 11. 确保图片文件存在
-        tex_dir = Path(tex_file).parent
-        pics_dir = tex_dir / 'pics'
-        if not pics_dir.exists():
-            pics_dir.mkdir(parents=True)
-            debug_print(f"创建图片目录: {pics_dir}")
+        debug_print("已完成LaTeX后处理")
+        return content
+    except Exception as e:
+        print(f"后处理LaTeX文件时出错: {str(e)}")
+        import traceback
+        print(traceback.format_exc())  # 打印详细的错误堆栈
+        return None
+
+# pandoc AST中包含子块的块级节点类型
+PANDOC_BLOCK_TYPES = frozenset((
+    'Plain', 'Para', 'LineBlock', 'CodeBlock', 'RawBlock', 'BlockQuote', 'OrderedList',
+    'BulletList', 'DefinitionList', 'Header', 'HorizontalRule', 'Table', 'Figure', 'Div'
+))
+
+def _ast_str_inlines(text):
+    """将纯文本转换为AST行内节点列表（按空格拆分为Str和Space）"""
+    inlines = []
+    for i, word in enumerate(text.split(' ')):
+        if i:
+            inlines.append({'t': 'Space'})
+        if word:
+            inlines.append({'t': 'Str', 'c': word})
+    return inlines
+
+def _ast_stringify(inlines):
+    """提取行内节点的纯文本内容"""
+    parts = []
+    for node in inlines:
+        kind = node.get('t')
+        if kind == 'Str':
+            parts.append(node['c'])
+        elif kind in ('Space', 'SoftBreak', 'LineBreak'):
+            parts.append(' ')
+        elif kind in ('Code', 'Math', 'RawInline'):
+            parts.append(node['c'][1])
+        elif kind in ('Emph', 'Strong', 'Strikeout', 'Underline', 'SmallCaps', 'Superscript', 'Subscript'):
+            parts.append(_ast_stringify(node['c']))
+        elif kind in ('Link', 'Span', 'Quoted'):
+            parts.append(_ast_stringify(node['c'][1]))
+    return ''.join(parts)
+
+class PandocAstTransformer:
+    """在pandoc JSON AST上一次遍历完成图片、SVG、标题/标签和特殊字符的处理
+
+    独立成段的图片（pandoc的Figure节点或只含一张图片的段落）生成带标题和标签的
+    figure环境；只含图片引用的代码块（SVG被替换后的 ```xml 块）同样转换为figure，
+    空代码块直接删除；文本节点中的特殊字符替换为TeX命令，数学公式和代码不受影响。
+    """
+
+    IMAGE_REF_PATTERN = re.compile(r'!\[(.*?)\]\((.*?)\)')
+
+    def __init__(self, output_dir, svg_files=None, substituter=None):
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+        self.svg_files = {svg_info['path']: svg_info for svg_info in (svg_files or [])}
+        self.substituter = substituter
+        self.figures = 0
+
+    def transform(self, document):
+        document['blocks'] = self._blocks(document['blocks'])
+        return document
+
+    def _walk(self, value):
+        """通用遍历：按列表中节点的类型分派到块级或行内处理"""
+        if isinstance(value, list):
+            if value and all(isinstance(item, dict) and 't' in item for item in value):
+                if value[0]['t'] in PANDOC_BLOCK_TYPES:
+                    return self._blocks(value)
+                return self._inlines(value)
+            return [self._walk(item) for item in value]
+        if isinstance(value, dict) and 'c' in value:
+            value['c'] = self._walk(value['c'])
+        return value
+
+    def _blocks(self, blocks):
+        result = []
+        for block in blocks:
+            kind = block.get('t')
+            if kind == 'Figure':
+                # Figure: [属性, [短标题, 标题块], 内容块]
+                images = [node for node in self._figure_inlines(block['c'][2]) if node.get('t') == 'Image']
+                if len(images) == 1:
+                    caption_blocks = block['c'][1][1]
+                    caption = caption_blocks[0]['c'] if caption_blocks else images[0]['c'][1]
+                    result.append(self._figure(images[0]['c'][2][0], caption))
+                    continue
+            elif kind == 'Para':
+                # 旧版pandoc没有Figure节点，独立成段的图片仍是段落
+                content = [node for node in block['c'] if node.get('t') not in ('Space', 'SoftBreak')]
+                if len(content) == 1 and content[0].get('t') == 'Image':
+                    image = content[0]['c']
+                    result.append(self._figure(image[2][0], image[1]))
+                    continue
+            elif kind == 'CodeBlock':
+                text = block['c'][1].strip()
+                if not text:
+                    debug_print("删除空代码块")
+                    continue
+                if text.startswith('\\begin{figure}') and text.endswith('\\end{figure}'):
+                    # 代码块中是完整的LaTeX图片环境，按原始LaTeX输出
+                    result.append({'t': 'RawBlock', 'c': ['latex', text]})
+                    continue
+                refs = self.IMAGE_REF_PATTERN.findall(text)
+                if refs and not self.IMAGE_REF_PATTERN.sub('', text).strip():
+                    # 代码块中只有图片引用（如被替换的SVG代码），转换为图片
+                    for caption, url in refs:
+                        result.append(self._figure(url, _ast_str_inlines(caption)))
+                    continue
+                result.append(block)
+                continue
+            result.append(self._walk(block))
+        return result
+
+    def _figure_inlines(self, blocks):
+        inlines = []
+        for block in blocks:
+            if block.get('t') in ('Plain', 'Para'):
+                inlines.extend(block['c'])
+        return inlines
+
+    def _inlines(self, inlines):
+        result = []
+        for node in inlines:
+            kind = node.get('t')
+            if kind == 'Str' and self.substituter is not None:
+                for text, tex in self.substituter.split(node['c']):
+                    if tex is None:
+                        result.append({'t': 'Str', 'c': text})
+                    else:
+                        result.append({'t': 'RawInline', 'c': ['latex', tex]})
+                continue
+            if kind == 'Image':
+                node['c'][2][0] = self._resolve_image(node['c'][2][0])
+            result.append(self._walk(node))
+        return result
+
+    def _resolve_image(self, url):
+        """图片统一引用输出目录pics/下的文件，缺失时从项目资源索引中查找并复制"""
+        if url.startswith(('pics/', '/')) or '://' in url:
+            return url
+        img_name = Path(url).name
+        if self.output_dir is None:
+            return f"pics/{img_name}"
+        target_path = self.output_dir / 'pics' / img_name
+        if not target_path.exists():
+            source_path = get_project_asset_index().lookup(img_name)
+            if source_path:
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                debug_print(f"找到并复制图片: {source_path} -> {target_path}")
+                copy_asset(source_path, target_path)
+            else:
+                debug_print(f"警告: 无法找到图片文件 {img_name} 以复制到 {target_path}")
+        return f"pics/{img_name}"
+
+    def _figure(self, url, caption):
+        """生成figure环境，标题中的行内节点交由pandoc渲染"""
+        url = self._resolve_image(url)
+        self.figures += 1
+        caption_text = _ast_stringify(caption)
+        svg_info = self.svg_files.get(url)
+        if svg_info and (not caption_text.strip() or 'SVG_PLACEHOLDER' in caption_text):
+            caption = _ast_str_inlines(f"图 {svg_info['index']}")
+
+        # SVG按自身序号生成标签，与正文中手写的图号相互独立，避免标签重复；
+        # 其他图片取标题中的"图 N"，其次是figure_N文件名
+        label = ''
+        if svg_info:
+            label = f"\\label{{fig:svg_{svg_info['index']}}}\n"
+        else:
+            num_match = re.search(r'图\s*(\d+)', caption_text) or re.search(r'figure_(\d+)', url)
+            if num_match:
+                label = f"\\label{{fig:figure_{num_match.group(1)}}}\n"
+        debug_print(f"生成figure环境: {url}")
+        return {'t': 'Plain', 'c': [
+            {'t': 'RawInline', 'c': ['latex',
+                                     f"\\begin{{figure}}[htbp]\n\\centering\n"
+                                     f"\\includegraphics[width=0.8\\textwidth]{{{url}}}\n\\caption{{"]},
+            *self._inlines(caption),
+            {'t': 'RawInline', 'c': ['latex', f"}}\n{label}\\end{{figure}}"]}
+        ]}
+
+def pandoc_ast_to_latex(markdown_text, output_dir=None, bib_file=None, svg_files=None):
+    """AST模式：pandoc输出JSON AST，在进程内完成转换后再由pandoc一次渲染为LaTeX
+
+    取代对生成的LaTeX进行多轮正则修补，后处理只需修正导言区。返回LaTeX文本；
+    pandoc失败时抛出subprocess.CalledProcessError，找不到pandoc时抛出FileNotFoundError。
+    """
+    document = json.loads(pandoc_convert_text(markdown_text, 'markdown', 'json'))
+
+    substituter = get_symbol_substituter(setting('SPECIAL_CHAR_MAP'))
+    transformer = PandocAstTransformer(output_dir, svg_files, substituter)
+    with profile_stage('ast_transform'):
+        document = transformer.transform(document)
+    profile_count('ast_figures', transformer.figures)
+    debug_print(f"AST转换完成，共生成 {transformer.figures} 个figure环境")
+
+    content = pandoc_convert_text(json.dumps(document, ensure_ascii=False), 'json', 'latex',
+                                  standalone=True, listings=True, bib_file=bib_file)
+    print("pandoc成功将Markdown转换为LaTeX (AST模式)")
+    return fix_latex_preamble(content)
+
+def render_latex(markdown_text, output_dir=None, bib_file=None, svg_files=None):
+    """在内存中将完整的Markdown（含YAML头）转换为最终的LaTeX文本
+
+    Markdown通过常驻pandoc服务或标准输入输出交给pandoc，不经过临时文件；
+    生成的LaTeX只在内存中后处理一次。异常同pandoc_convert_text。
+    """
+    if setting('PANDOC_AST'):
+        with profile_stage('pandoc'):
+            latex = pandoc_ast_to_latex(markdown_text, output_dir, bib_file, svg_files)
+    else:
+        with profile_stage('pandoc'):
+            content = pandoc_convert_text(markdown_text, 'markdown', 'latex', standalone=True, listings=True,
+                                          bib_file=bib_file)
+        print("pandoc成功将Markdown转换为LaTeX")
         
-        for img_ref in img_refs:
-            img_path = tex_dir / img_ref
-            if not img_path.exists():
-                debug_print(f"警告: 图片文件不存在 {img_path}")
-                # 搜索整个项目查找同名图片
-                img_name = img_path.name
-                for root, dirs, files in os.walk('.'):
-                    for file in files:
-                        if file == img_name:
-                            source = Path(root) / file
-                            debug_print(f"找到替代图片: {source}")
-                            # 确保目标目录存在
-                            img_path.parent.mkdir(parents=True, exist_ok=True)
-                            shutil.copy(source, img_path)
-                            debug_print(f"已复制图片: {source} -> {img_path}")
-                            break
-                    if img_path.exists():
+        # 对生成的LaTeX进行后处理，包括SVG引用处理；出错时保留pandoc的原始输出
+        with profile_stage('post_process'):
+            processed = post_process_latex_text(content, output_dir, svg_files)
+        latex = content if processed is None else processed
+    if setting('LATEX_FORMAT'):
+        # 预编译格式的转储结束标记在写入文件之前插入，编译时不再改写LaTeX文件
+        latex, _ = insert_endofdump_marker(latex)
+    return latex
+
+def latex_stage_inputs(manifest, tex_file, fix_images):
+    """xelatex编译阶段的输入：LaTeX文件、输出目录中的图片/样式/参考文献、xelatex版本和编译选项"""
+    tex_dir = Path(tex_file).parent
+    assets = [path for path in (tex_dir / 'pics').rglob('*') if path.is_file()]
+    assets += list(tex_dir.glob('*.sty')) + list(tex_dir.glob('*.bib'))
+    return {
+        'tex': manifest.digest_file(tex_file),
+        'assets': manifest.digest_files(assets),
+        'xelatex': get_tool_version('xelatex'),
+        'fix_images': fix_images,
+        'latex_format': setting('LATEX_FORMAT'),
+        'split_chapters': setting('SPLIT_CHAPTERS'),
+        'max_passes': setting('MAX_LATEX_PASSES')
+    }
+
+def build_document(markdown_file, output_dir, template, fix_images=False, incremental=False, latex_lock=None):
+    """完整处理一个Markdown文件：转换为LaTeX、后处理并编译为PDF
+
+    latex_lock用于限制同时运行的xelatex数量（批处理模式）。
+    返回 (是否成功, PDF路径, 各阶段耗时)。启用 --profile 时在输出目录中写入
+    <文件名>.profile.json。
+    """
+    if not setting('PROFILE'):
+        return _build_document(markdown_file, output_dir, template, fix_images, incremental, latex_lock)
+    
+    profiler = BuildProfiler()
+    token = _ACTIVE_PROFILER.set(profiler)
+    result = (False, None, {})
+    try:
+        result = _build_document(markdown_file, output_dir, template, fix_images, incremental, latex_lock)
+        return result
+    finally:
+        _ACTIVE_PROFILER.reset(token)
+        profile = profiler.report(document=str(markdown_file), success=result[0],
+                                  timings={name: round(value, 4) for name, value in result[2].items()})
+        profile_file = Path(get_output_dir(markdown_file, output_dir)) / f"{Path(markdown_file).stem}.profile.json"
+        try:
+            profile_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(profile_file, 'w', encoding='utf-8') as f:
+                json.dump(profile, f, ensure_ascii=False, indent=2)
+            print(f"性能剖析报告: {profile_file}")
+        except OSError as e:
+            print(f"无法写入性能剖析报告: {e}")
+
+def _build_document(markdown_file, output_dir, template, fix_images=False, incremental=False, latex_lock=None):
+    timings = {}
+    start = time.monotonic()
+    
+    # 增量构建清单保存在输出目录中
+    manifest = None
+    if incremental:
+        manifest = BuildManifest(get_output_dir(markdown_file, output_dir))
+    
+    # 转换Markdown为LaTeX
+    with profile_stage('convert'):
+        tex_file = convert_md_to_latex(markdown_file, output_dir, template, manifest)
+    if not tex_file:
+        print("转换失败，请检查错误信息")
+        return False, None, timings
+    
+    timings['convert'] = time.monotonic() - start
+    
+    # 编译LaTeX生成PDF
+    start = time.monotonic()
+    pdf_file = Path(tex_file).with_suffix('.pdf')
+    if manifest is not None and manifest.is_fresh('pdf', latex_stage_inputs(manifest, tex_file, fix_images)):
+        manifest.skip('pdf', f"LaTeX文件及图片未变化，跳过xelatex编译: {pdf_file}")
+        success, pdf_path = True, pdf_file
+    else:
+        try:
+            with latex_lock if latex_lock is not None else contextlib.nullcontext():
+                timings['latex_wait'] = time.monotonic() - start
+                with profile_stage('compile'):
+                    success, pdf_path = compile_latex(tex_file, fix_images)
+        except BuildCancelled:
+            # 保留已完成阶段的记录，下次构建可以跳过
+            if manifest is not None:
+                manifest.save()
+            raise
+        if manifest is not None:
+            # 强化图片修复模式和预编译格式可能原地改写LaTeX文件，更新其记录的哈希，
+            # 下次构建不会因此重新运行pandoc
+            manifest.update_outputs('tex', [tex_file])
+        if manifest is not None and success:
+            # 编译后重新计算输入，包含上述改写
+            manifest.record('pdf', latex_stage_inputs(manifest, tex_file, fix_images), [pdf_path])
+    if manifest is not None:
+        manifest.save()
+    timings['compile'] = time.monotonic() - start
+    if not success:
+        print("编译失败，请检查LaTeX错误")
+        return False, None, timings
+    return True, pdf_path, timings
+
+# 监视模式的轮询间隔和去抖时间（秒）
+WATCH_INTERVAL = 0.5
+WATCH_DEBOUNCE = 0.3
+
+class DocumentWatcher:
+    """监视模式：轮询Markdown、引用的图片、参考文献和模板，文件变化后增量重新构建
+
+    连续保存在去抖时间内合并为一次构建；构建过程中出现新的修改时终止正在运行的
+    xelatex，立即开始新的构建。借助增量构建清单，只重新执行受影响的阶段。
+    """
+
+    def __init__(self, markdown_file, output_dir, template, fix_images=False):
+        self.markdown_file = markdown_file
+        self.output_dir = output_dir
+        self.template = template
+        self.fix_images = fix_images
+        self.files = []
+        self.last = {}
+        self.thread = None
+        # 构建线程结束后通过pending_files交给轮询线程的新监视列表，读写都持有pending_lock
+        self.pending_files = None
+        self.pending_lock = threading.Lock()
+
+    def watched_files(self):
+        """需要监视的文件（绝对路径），图片列表取自上次构建的清单"""
+        markdown_path = Path(self.markdown_file).resolve()
+        template_path = Path(self.template).resolve()
+        files = {markdown_path, template_path}
+        files.update(markdown_path.parent.glob('*.bib'))
+        files.update(template_path.parent.glob('*.sty'))
+        manifest = BuildManifest(get_output_dir(self.markdown_file, self.output_dir))
+        previous = manifest.stage('preprocess')
+        if previous:
+            files.update(Path(path) for path in previous['extra'].get('images', []))
+        return sorted(str(path) for path in files)
+
+    @staticmethod
+    def snapshot(files):
+        state = {}
+        for path in files:
+            try:
+                st = os.stat(path)
+                state[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                state[path] = None
+        return state
+
+    def changed_files(self):
+        """返回自上次检查以来发生变化的文件；新加入监视的文件只记录状态"""
+        with self.pending_lock:
+            pending, self.pending_files = self.pending_files, None
+        if pending is not None:
+            self.files = pending
+        current = self.snapshot(self.files)
+        changed = {path for path, state in current.items()
+                   if path in self.last and self.last[path] != state}
+        self.last = current
+        return changed
+
+    def start_build(self, changed):
+        if self.thread is not None and self.thread.is_alive():
+            print("检测到新的修改，取消正在进行的构建")
+            BUILD_CANCEL_EVENT.set()
+            self.thread.join()
+        BUILD_CANCEL_EVENT.clear()
+        if changed:
+            names = ', '.join(sorted(Path(path).name for path in changed))
+            print(f"\n[{time.strftime('%H:%M:%S')}] 文件已修改: {names}")
+        # 构建线程继承当前上下文中的配置（如 --char-map 合并后的映射表）
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self._build,), daemon=True)
+        self.thread.start()
+
+    def _build(self):
+        start = time.monotonic()
+        try:
+            success, pdf_path, _ = build_document(self.markdown_file, self.output_dir, self.template,
+                                                  self.fix_images, incremental=True)
+        except BuildCancelled:
+            return
+        except Exception:
+            print(traceback.format_exc())
+            success, pdf_path = False, None
+        finally:
+            files = self.watched_files()
+            with self.pending_lock:
+                self.pending_files = files
+        if success:
+            print(f"[{time.strftime('%H:%M:%S')}] 构建完成 ({time.monotonic() - start:.1f}秒): {pdf_path}")
+        else:
+            print(f"[{time.strftime('%H:%M:%S')}] 构建失败，等待下一次修改")
+
+    def run(self):
+        print(f"监视模式: {self.markdown_file} (按Ctrl+C退出)")
+        self.files = self.watched_files()
+        self.last = self.snapshot(self.files)
+        self.start_build(set())
+        try:
+            while True:
+                time.sleep(WATCH_INTERVAL)
+                changed = self.changed_files()
+                if not changed:
+                    continue
+                # 去抖：等待连续的保存操作结束后再构建
+                while True:
+                    time.sleep(WATCH_DEBOUNCE)
+                    more = self.changed_files()
+                    if not more:
                         break
+                    changed |= more
+                self.start_build(changed)
+        except KeyboardInterrupt:
+            BUILD_CANCEL_EVENT.set()
+            if self.thread is not None:
+                self.thread.join()
+            print("\n已退出监视模式")
+
+def expand_markdown_inputs(inputs):
+    """将命令行输入（文件、目录、通配符）展开为Markdown文件列表，保持顺序并去重"""
+    files = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            candidates = sorted(path.rglob('*.md'))
+        elif glob.has_magic(item):
+            candidates = sorted(Path(p) for p in glob.glob(item, recursive=True))
+        else:
+            candidates = [path]
+        for candidate in candidates:
+            # 跳过转换过程中生成的临时文件
+            if candidate.name.endswith('_temp.md'):
+                continue
+            if candidate not in files:
+                files.append(candidate)
+    return [str(f) for f in files]
+
+# 批处理工作进程需要继承的全局配置
+_BATCH_SETTINGS = (
+    'VERBOSE', 'CACHE_ENABLED', 'CACHE_DIR', 'CACHE_MAX_BYTES', 'SVG_JOBS',
+    'INKSCAPE_SHELL', 'ASSET_INDEX_FILE', 'MAX_LATEX_PASSES', 'SPECIAL_CHAR_MAP', 'PANDOC_AST',
+    'PANDOC_SERVER', 'LATEX_FORMAT', 'PROFILE', 'IMAGE_DPI', 'IMAGE_QUALITY', 'SPLIT_CHAPTERS', 'SVG_BACKENDS'
+)
+_BATCH_LATEX_LOCK = None
+
+def _init_batch_worker(settings, latex_lock):
+    """批处理工作进程初始化：恢复全局配置并保存xelatex并发信号量"""
+    global _BATCH_LATEX_LOCK
+    globals().update(settings)
+    _BATCH_LATEX_LOCK = latex_lock
+
+def _batch_build(markdown_file, output_dir, template, fix_images, incremental):
+    """在工作进程中构建一个文件，输出写入该文件的构建日志，任何异常都只影响本文件"""
+    start = time.monotonic()
+    result = {'file': markdown_file, 'success': False, 'pdf': None, 'timings': {}, 'log': None}
+    try:
+        out_dir = get_output_dir(markdown_file, output_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        log_path = out_dir / f"{Path(markdown_file).stem}.build.log"
+        result['log'] = str(log_path)
+        with open(log_path, 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+            try:
+                success, pdf_path, timings = build_document(markdown_file, output_dir, template, fix_images,
+                                                            incremental, _BATCH_LATEX_LOCK)
+                result.update(success=success, pdf=str(pdf_path) if pdf_path else None, timings=timings)
+            except Exception:
+                print(traceback.format_exc())
+    except Exception as e:
+        result['error'] = str(e)
+    result['duration'] = time.monotonic() - start
+    return result
+
+def run_batch(markdown_files, output_dir, template, fix_images=False, incremental=False,
+              batch_jobs=None, latex_jobs=None):
+    """批处理模式：使用进程池并行构建多个Markdown文件
+
+    batch_jobs限制同时处理的文件数（pandoc、后处理等较轻的阶段），latex_jobs单独限制
+    同时运行的xelatex数量。单个文件失败不影响其他文件，最后打印各文件的状态和耗时。
+    """
+    cpu_count = os.cpu_count() or 1
+    batch_jobs = max(1, batch_jobs or cpu_count)
+    latex_jobs = max(1, latex_jobs or max(1, cpu_count // 2))
+    print(f"批处理 {len(markdown_files)} 个文件 (并行文件数: {batch_jobs}, 并行xelatex数: {latex_jobs})")
+    
+    results = []
+    # 输出目录相同的文件会互相覆盖，只处理其中第一个
+    seen_dirs = {}
+    pending = []
+    for markdown_file in markdown_files:
+        if not Path(markdown_file).is_file():
+            results.append({'file': markdown_file, 'success': False, 'duration': 0.0, 'timings': {},
+                            'error': "文件不存在"})
+            continue
+        out_dir = get_output_dir(markdown_file, output_dir).resolve()
+        if out_dir in seen_dirs:
+            results.append({'file': markdown_file, 'success': False, 'duration': 0.0, 'timings': {},
+                            'error': f"输出目录与 {seen_dirs[out_dir]} 冲突"})
+            continue
+        seen_dirs[out_dir] = markdown_file
+        pending.append(markdown_file)
+    
+    settings = {name: setting(name) for name in _BATCH_SETTINGS}
+    latex_lock = multiprocessing.Semaphore(latex_jobs)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(batch_jobs, max(1, len(pending))),
+                                                initializer=_init_batch_worker,
+                                                initargs=(settings, latex_lock)) as executor:
+        futures = {executor.submit(_batch_build, markdown_file, output_dir, template, fix_images, incremental):
+                   markdown_file for markdown_file in pending}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'file': futures[future], 'success': False, 'duration': 0.0, 'timings': {},
+                          'error': f"工作进程异常退出: {e}"}
+            results.append(result)
+            status = "成功" if result['success'] else "失败"
+            print(f"[{done}/{len(pending)}] {status}: {result['file']} ({result['duration']:.1f}秒)")
+    
+    print_batch_summary(results, markdown_files)
+    return results
+
+def print_batch_summary(results, markdown_files):
+    """按输入顺序打印批处理结果汇总"""
+    order = {markdown_file: i for i, markdown_file in enumerate(markdown_files)}
+    results = sorted(results, key=lambda result: order.get(result['file'], len(order)))
+    failed = [result for result in results if not result['success']]
+    print("\n批处理结果汇总:")
+    print("  状态     总耗时     转换     编译  文件")
+    for result in results:
+        timings = result.get('timings', {})
+        status = "成功" if result['success'] else "失败"
+        convert = f"{timings['convert']:.1f}s" if 'convert' in timings else '-'
+        compile_time = f"{timings['compile']:.1f}s" if 'compile' in timings else '-'
+        print(f"  {status:<4} {result['duration']:>7.1f}s {convert:>8} {compile_time:>8}  {result['file']}")
+        if not result['success']:
+            detail = result.get('error') or (f"详见日志: {result['log']}" if result.get('log') else '')
+            if detail:
+                print(f"       {detail}")
+    print(f"共 {len(results)} 个文件，成功 {len(results) - len(failed)} 个，失败 {len(failed)} 个")
+
+# Converter可以设置的配置项，对应同名的大写全局变量
+CONVERTER_SETTINGS = _BATCH_SETTINGS + ('PROJECT_ROOT',)
+
+ConversionResult = collections.namedtuple('ConversionResult', ['success', 'pdf_path', 'timings'])
+
+# Converter.convert() 的输出流，None 表示标准输出
+_ACTIVE_OUTPUT = contextvars.ContextVar('md2tex_output', default=None)
+_OUTPUT_LOCK = threading.Lock()
+
+class _ContextOutput:
+    """sys.stdout的代理：当前上下文指定了输出流时写入该流，否则写入原来的标准输出"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def _target(self):
+        return _ACTIVE_OUTPUT.get() or self._stream
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def _install_context_output():
+    with _OUTPUT_LOCK:
+        if not isinstance(sys.stdout, _ContextOutput):
+            sys.stdout = _ContextOutput(sys.stdout)
+
+class Converter:
+    """可重入、线程安全的转换接口，供其他程序嵌入使用
+
+    配置在创建时确定（默认取自模块级全局配置），只在convert()的上下文中生效，
+    不修改全局变量，也不切换工作目录；图片等资源相对于输入文件所在目录（或
+    project_root）查找。同一个Converter可以在多个线程中同时使用：
+
+        converter = Converter(output_dir='build', verbose=False, svg_jobs=2)
+        result = converter.convert('paper.md')
+        if result.success:
+            print(result.pdf_path)
+
+    可用的配置项为CONVERTER_SETTINGS中的名称（小写），以及output_dir、template、
+    fix_images、incremental和latex_jobs（同时运行的xelatex数上限）。
+    """
+
+    def __init__(self, config=None, **options):
+        options = dict(config or {}, **options)
+        self.output_dir = options.pop('output_dir', None)
+        template = options.pop('template', None) or Path(__file__).resolve().parent / 'latex_style' / 'template.tex'
+        self.template = str(Path(template).resolve())
+        self.fix_images = options.pop('fix_images', False)
+        self.incremental = options.pop('incremental', False)
+        latex_jobs = options.pop('latex_jobs', None)
+        self.latex_lock = threading.BoundedSemaphore(latex_jobs) if latex_jobs else None
         
-        # 添加调试输出 - 列出所有图片引用和状态
-        debug_print(f"\n调试: LaTeX内容中的图片引用:")
-        for img_ref in img_refs:
-            img_path = tex_dir / img_ref
-            debug_print(f"  图片引用: {img_ref}")
-            debug_print(f"  文件存在: {img_path.exists()}, 大小: {img_path.stat().st_size if img_path.exists() else 0} 字节")
+        self.settings = {name: globals()[name] for name in CONVERTER_SETTINGS}
+        self.settings['SPECIAL_CHAR_MAP'] = dict(self.settings['SPECIAL_CHAR_MAP'])
+        for name, value in options.items():
+            if name.upper() not in self.settings:
+                raise TypeError(f"未知的配置项: {name}")
+            self.settings[name.upper()] = value
         
-        # 写回文件
-        with open(tex_file, 'w', encoding='utf-8') as f:
-            f.write(content)
+        self._cancel_events = set()
+        self._lock = threading.Lock()
+
+    def convert(self, markdown_file, output_dir=None, log=None):
+        """转换一个Markdown文件并编译为PDF，返回ConversionResult(success, pdf_path, timings)
+
+        log为接收输出信息的文本流（默认为标准输出）。转换被cancel()取消时抛出BuildCancelled。
+        """
+        markdown_path = Path(markdown_file).resolve()
+        output_dir = output_dir or self.output_dir
+        settings = dict(self.settings)
+        if not settings['PROJECT_ROOT']:
+            settings['PROJECT_ROOT'] = str(markdown_path.parent)
+        cancel_event = threading.Event()
+        with self._lock:
+            self._cancel_events.add(cancel_event)
+        if log is not None:
+            _install_context_output()
+        try:
+            # 在独立的上下文中运行，配置、取消事件和输出流只对本次转换生效
+            return contextvars.copy_context().run(
+                self._convert, markdown_path, Path(output_dir).resolve() if output_dir else None,
+                settings, cancel_event, log
+            )
+        finally:
+            with self._lock:
+                self._cancel_events.discard(cancel_event)
+
+    def _convert(self, markdown_path, output_dir, settings, cancel_event, log):
+        _ACTIVE_SETTINGS.set(settings)
+        _ACTIVE_CANCEL_EVENT.set(cancel_event)
+        _ACTIVE_OUTPUT.set(log)
+        return ConversionResult(*build_document(str(markdown_path), output_dir, self.template, self.fix_images,
+                                                self.incremental, self.latex_lock))
+
+    def convert_string(self, markdown, output_dir=None, bib_file=None, title=None, log=None):
+        """在内存中将Markdown文本转换为LaTeX文本（见模块级convert_string），使用本Converter的配置"""
+        if log is not None:
+            _install_context_output()
         
-        debug_print("已完成LaTeX文件后处理")
-        return True
-    except Exception as e:
-        print(f"后处理LaTeX文件时出错: {str(e)}")
-        import traceback
-        print(traceback.format_exc())  # 打印详细的错误堆栈
-        return False
+        def run():
+            _ACTIVE_SETTINGS.set(dict(self.settings))
+            _ACTIVE_OUTPUT.set(log)
+            return convert_string(markdown, output_dir, bib_file, title)
+        return contextvars.copy_context().run(run)
+
+    def cancel(self):
+        """取消本Converter上所有正在进行的转换"""
+        with self._lock:
+            for event in self._cancel_events:
+                event.set()
 
 def main():
     """处理主程序逻辑"""
+    global VERBOSE, CACHE_ENABLED, CACHE_DIR, CACHE_MAX_BYTES, SVG_JOBS, INKSCAPE_SHELL, ASSET_INDEX_FILE, MAX_LATEX_PASSES, PANDOC_AST, PANDOC_SERVER, \
+        LATEX_FORMAT, PROFILE, IMAGE_DPI, IMAGE_QUALITY, SPLIT_CHAPTERS, SVG_BACKENDS
+    
     parser = argparse.ArgumentParser(
         description='将Markdown文件转换为LaTeX并编译成PDF - 支持中文、数学公式和图片',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -992,44 +4558,139 @@ def main():
     
   使用自定义模板:
     python md2latex_pandoc.py ./example.md -t ./my_template.tex
+    
+  批处理多个文件:
+    python md2latex_pandoc.py ./chapters/ "./drafts/*.md" --batch-jobs 8 --latex-jobs 4
 """
     )
-    parser.add_argument('markdown_file', help='输入的Markdown文件路径')
+    parser.add_argument('markdown_file', nargs='+',
+                        help='输入的Markdown文件路径；多个文件、目录或通配符时进入批处理模式')
     parser.add_argument('-o', '--output-dir', help='输出目录路径 (默认为Markdown文件所在目录)', default=None)
     parser.add_argument('-t', '--template', help='LaTeX模板文件路径 (默认使用内置模板)', 
                         default=str(Path('latex_style/template.tex')))
     parser.add_argument('--open', action='store_true', help='编译完成后自动打开PDF文件')
     parser.add_argument('--fix-images', action='store_true', help='使用更强的图片修复模式，尝试解决图片不显示问题')
+    parser.add_argument('--max-passes', type=int, default=MAX_LATEX_PASSES,
+                        help='xelatex最多编译次数，交叉引用稳定后提前停止 (默认: %(default)s)')
+    parser.add_argument('--latex-format', action='store_true',
+                        help='将固定的导言区预编译为xelatex格式文件并缓存，之后的编译直接加载（需要mylatexformat）')
+    parser.add_argument('--split-chapters', nargs='?', type=int, const=0, default=None, metavar='N',
+                        help='在顶层标题处拆分为\\include的章节，用\\includeonly并行编译发生变化的章节后合并PDF '
+                             '(N为同时编译的章节数，默认为CPU核数)')
     parser.add_argument('--quiet', action='store_true', help='减少输出信息，仅显示必要信息')
+    parser.add_argument('--pandoc-server', nargs='?', const='auto', default=None, metavar='URL',
+                        help='通过常驻的pandoc server转换，不指定地址时在本机启动；不可用时自动改用pandoc命令')
+    parser.add_argument('--ast', action='store_true',
+                        help='使用pandoc JSON AST模式：在语法树上处理图片、标题和特殊字符，代替对LaTeX的正则后处理')
+    parser.add_argument('--watch', action='store_true',
+                        help='监视模式：Markdown、图片、参考文献或模板修改后自动增量重新构建')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量构建：在输出目录中记录各阶段的输入哈希，只重新执行输入发生变化的阶段')
+    parser.add_argument('--cache-dir', help='转换结果缓存目录 (默认为 ~/.cache/md2tex)', default=None)
+    parser.add_argument('--cache-size', type=int, default=CACHE_MAX_BYTES // (1024 * 1024),
+                        help='缓存总大小上限，单位MB，超出后淘汰最久未使用的条目 (默认: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='禁用SVG等转换结果的持久化缓存')
+    parser.add_argument('-j', '--jobs', type=int, default=SVG_JOBS,
+                        help='SVG转换的并行工作线程数 (默认: %(default)s)')
+    parser.add_argument('--inkscape-shell', action='store_true',
+                        help='每个工作线程使用一个长期运行的 inkscape --shell 进程批量转换SVG')
+    parser.add_argument('--svg-backends', metavar='LIST', default=None,
+                        help='限定SVG转换后端，逗号分隔 (%s，默认使用所有可用的后端)'
+                             % ', '.join(backend.name for backend in SVG_BACKEND_REGISTRY))
+    parser.add_argument('--calibrate-svg', action='store_true',
+                        help='以输入文件中的内嵌SVG（没有时使用内置样本）测量各SVG转换后端的吞吐量，'
+                             '保存到缓存目录后退出；之后按测量结果选择最快的后端')
+    parser.add_argument('--char-map', metavar='FILE', default=None,
+                        help='JSON格式的额外特殊字符映射表 {"字符": "TeX命令"}，与内置映射合并')
+    parser.add_argument('--batch', action='store_true', help='强制使用批处理模式（输出汇总表和每个文件的构建日志）')
+    parser.add_argument('--batch-jobs', type=int, default=None,
+                        help='批处理模式下同时处理的文件数 (默认为CPU核数)')
+    parser.add_argument('--latex-jobs', type=int, default=None,
+                        help='批处理模式下同时运行的xelatex数 (默认为CPU核数的一半)')
+    parser.add_argument('--profile', action='store_true',
+                        help='输出各阶段耗时、外部进程调用、缓存命中和峰值内存的性能剖析报告 (<文件名>.profile.json)')
+    parser.add_argument('--asset-index', metavar='FILE', default=None,
+                        help='将图片资源索引持久化到指定文件，下次运行时只重新扫描发生变化的目录')
+    parser.add_argument('--optimize-images', nargs='?', type=int, const=150, default=None, metavar='DPI',
+                        help='按0.8\\textwidth渲染宽度下的目标DPI缩小PNG/JPEG并重新压缩 (默认DPI: 150，需要Pillow)')
+    parser.add_argument('--image-quality', type=int, default=IMAGE_QUALITY,
+                        help='优化图片时JPEG的压缩质量 (默认: %(default)s)')
     
     args = parser.parse_args()
     
     # 设置全局输出模式
-    global VERBOSE
     VERBOSE = not args.quiet
+    CACHE_ENABLED = not args.no_cache
+    CACHE_DIR = args.cache_dir
+    CACHE_MAX_BYTES = args.cache_size * 1024 * 1024
+    SVG_JOBS = max(1, args.jobs)
+    INKSCAPE_SHELL = args.inkscape_shell
+    ASSET_INDEX_FILE = args.asset_index
+    MAX_LATEX_PASSES = max(1, args.max_passes)
+    PANDOC_AST = args.ast
+    PANDOC_SERVER = args.pandoc_server
+    LATEX_FORMAT = args.latex_format
+    PROFILE = args.profile
+    IMAGE_DPI = args.optimize_images
+    IMAGE_QUALITY = min(95, max(1, args.image_quality))
+    SPLIT_CHAPTERS = None if args.split_chapters is None else max(0, args.split_chapters)
+    if args.svg_backends:
+        SVG_BACKENDS = tuple(name.strip() for name in args.svg_backends.split(',') if name.strip())
+        unknown = set(SVG_BACKENDS) - {backend.name for backend in SVG_BACKEND_REGISTRY}
+        if unknown:
+            parser.error(f"未知的SVG转换后端: {', '.join(sorted(unknown))}")
+    if args.char_map:
+        # 合并后的映射表通过配置传递，不修改模块级的默认映射表
+        try:
+            _ACTIVE_SETTINGS.set({'SPECIAL_CHAR_MAP': dict(SPECIAL_CHAR_MAP, **load_char_map(args.char_map))})
+        except (OSError, ValueError) as e:
+            print(f"无法加载字符映射文件: {e}")
+            sys.exit(1)
+    
+    # 展开目录和通配符，多个输入时进入批处理模式
+    markdown_files = expand_markdown_inputs(args.markdown_file)
+    if not markdown_files:
+        print(f"错误: 未找到Markdown文件: {' '.join(args.markdown_file)}")
+        sys.exit(1)
+    if args.calibrate_svg:
+        svg_codes = []
+        for markdown_file in markdown_files:
+            if not os.path.isfile(markdown_file):
+                continue
+            with open(markdown_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+            svg_codes.extend(content[start:end] for start, end in iter_svg_blocks(content))
+        calibrate_svg_backends(svg_codes)
+        return
+    if args.batch or len(args.markdown_file) > 1 or len(markdown_files) > 1 or Path(args.markdown_file[0]).is_dir():
+        if args.watch:
+            print("错误: 监视模式只支持单个Markdown文件")
+            sys.exit(1)
+        if PANDOC_SERVER == 'auto':
+            # 由主进程启动一个服务，所有工作进程共用
+            server = get_pandoc_server()
+            PANDOC_SERVER = server.url if server else None
+        results = run_batch(markdown_files, args.output_dir, args.template, args.fix_images,
+                            args.incremental, args.batch_jobs, args.latex_jobs)
+        sys.exit(0 if all(result['success'] for result in results) else 1)
+    markdown_file = markdown_files[0]
     
     if VERBOSE:
-        print(f"处理Markdown文件: {args.markdown_file}")
+        print(f"处理Markdown文件: {markdown_file}")
         if args.output_dir:
             print(f"输出目录: {args.output_dir}")
         if args.open:
             print("编译完成后将自动打开PDF文件")
     else:
-        print(f"处理文件: {args.markdown_file}")
-    
-    # 转换Markdown为LaTeX
-    tex_file = convert_md_to_latex(args.markdown_file, args.output_dir, args.template)
-    if not tex_file:
-        print("转换失败，请检查错误信息")
-        sys.exit(1)
+        print(f"处理文件: {markdown_file}")
     
-    # 后处理LaTeX文件
-    post_process_latex(tex_file)
+    if args.watch:
+        DocumentWatcher(markdown_file, args.output_dir, args.template, args.fix_images).run()
+        return
     
-    # 编译LaTeX生成PDF
-    success, pdf_path = compile_latex(tex_file, args.fix_images)
+    success, pdf_path, _ = build_document(markdown_file, args.output_dir, args.template,
+                                          args.fix_images, args.incremental)
     if not success:
-        print("编译失败，请检查LaTeX错误")
         sys.exit(1)
     
     print("转换和编译完成。")
@@ -1053,7 +4714,7 @@ VERBOSE = True
 
 def debug_print(*args, **kwargs):
     """只在非静默模式下打印调试信息"""
-    if VERBOSE:
+    if setting('VERBOSE'):
         print(*args, **kwargs)
 
 def extract_titles_and_images(md_file):
@@ -1116,23 +4777,13 @@ def extract_titles_and_images(md_file):
             debug_print(f"尝试将SVG转换为PDF: figure_{i+1}.svg")
             
             try:
-                # 使用不同的工具尝试转换
-                # 首先尝试使用cairosvg（通常需要安装）
-                try:
-                    import cairosvg
-                    cairosvg.svg2pdf(file_obj=open(svg_file, 'rb'), write_to=pdf_file)
+                # 依次尝试可用的转换后端（cairosvg、rsvg-convert、Inkscape）
+                converter = SvgConverter(svg_backends())
+                ok, error = converter.convert(svg_file, pdf_file)
+                if ok:
                     debug_print(f"成功将SVG转换为PDF: figure_{i+1}.pdf")
-                except (ImportError, Exception) as e:
-                    # 如果cairosvg不可用，尝试使用Inkscape
-                    if shutil.which('inkscape'):
-                        os.system(f'inkscape -z -D --file="{svg_file}" --export-pdf="{pdf_file}"')
-                        debug_print(f"成功将SVG转换为PDF: figure_{i+1}.pdf")
-                    # 如果Inkscape不可用，尝试使用rsvg-convert
-                    elif shutil.which('rsvg-convert'):
-                        os.system(f'rsvg-convert -f pdf -o "{pdf_file}" "{svg_file}"')
-                        debug_print(f"成功将SVG转换为PDF: figure_{i+1}.pdf")
-                    else:
-                        debug_print(f"警告: 无法转换SVG到PDF，请安装cairosvg、Inkscape或rsvg-convert")
+                else:
+                    debug_print(f"警告: 无法转换SVG到PDF: {error}")
                 
                 # 记录PDF文件信息
                 if os.path.exists(pdf_file):
@@ -9,16 +9,28 @@ NC='\033[0m' # 无颜色
 
 # 打印帮助信息的函数
 print_help() {
-    echo -e "${BLUE}用法: $0 <file_path>${NC}"
+    echo -e "${BLUE}用法: $0 <file_path> [file_path|directory ...]${NC}"
     echo -e "  该脚本用于将Markdown或LaTeX文件转换为PDF"
     echo -e "  支持的文件类型: .md, .tex"
+    echo -e "  提供多个文件或目录时，Markdown文件将并行批量转换"
     echo -e "  例如: $0 gemini_paper/绪论/绪论.tex"
     echo -e "        $0 gemini_paper/绪论.md"
+    echo -e "        $0 gemini_paper/ other/附录.md"
     echo
     echo -e "${YELLOW}选项:${NC}"
     echo -e "  -h, --help     显示帮助信息"
     echo -e "  -c, --clean    清理临时文件（编译后）"
     echo -e "  -o, --open     编译成功后打开PDF文件"
+    echo -e "  -w, --watch    监视Markdown文件及其图片、参考文献和模板，修改后自动重新构建"
+    echo
+    echo -e "${YELLOW}环境变量:${NC}"
+    echo -e "  MAX_PASSES     xelatex最多编译次数，交叉引用稳定后提前停止 (默认: 4)"
+}
+
+# 计算交叉引用辅助文件的校验和，内容变化说明需要再编译一遍
+aux_checksum() {
+    local base_name="$1"
+    cat "${base_name}.aux" "${base_name}.toc" "${base_name}.lof" "${base_name}.lot" "${base_name}.out" 2>/dev/null | cksum
 }
 
 # 编译LaTeX文件的函数
@@ -32,26 +44,51 @@ compile_tex() {
     # 切换到LaTeX文件所在目录
     cd "$tex_dir" || { echo -e "${RED}错误: 无法切换到目录 '$tex_dir'${NC}"; return 1; }
     
-    echo -e "${BLUE}[$(date +%H:%M:%S)] 开始第一次编译...${NC}"
-    # 将编译输出重定向到临时日志文件
-    xelatex -interaction=nonstopmode "$tex_filename" > "$log_file" 2>&1
-    local compile_status=$?
-    
-    if [ $compile_status -ne 0 ]; then
-        echo -e "${YELLOW}第一次编译返回状态: $compile_status (可能有警告)${NC}"
-    else
-        echo -e "${GREEN}第一次编译成功${NC}"
+    local max_passes="${MAX_PASSES:-4}"
+    local pass=1
+    local compile_status=0
+    # 存在xdvipdfmx时各次编译只生成XDV，交叉引用稳定后再转换一次PDF
+    local no_pdf=""
+    if command -v xdvipdfmx &> /dev/null; then
+        no_pdf="-no-pdf"
     fi
+    # 保留上次的.aux/.toc等辅助文件，交叉引用稳定后即停止编译
+    local aux_before=$(aux_checksum "$tex_name")
     
-    echo -e "${BLUE}[$(date +%H:%M:%S)] 开始第二次编译...${NC}"
-    # 将编译输出重定向到临时日志文件
-    xelatex -interaction=nonstopmode "$tex_filename" > "$log_file" 2>&1
-    compile_status=$?
+    while true; do
+        echo -e "${BLUE}[$(date +%H:%M:%S)] 开始第${pass}次编译...${NC}"
+        # 将编译输出重定向到临时日志文件
+        max_print_line=10000 xelatex -interaction=nonstopmode $no_pdf "$tex_filename" > "$log_file" 2>&1
+        compile_status=$?
+        
+        if [ $compile_status -ne 0 ]; then
+            echo -e "${YELLOW}第${pass}次编译返回状态: $compile_status (可能有警告)${NC}"
+        else
+            echo -e "${GREEN}第${pass}次编译成功${NC}"
+        fi
+        
+        local aux_after=$(aux_checksum "$tex_name")
+        if [ "$aux_after" = "$aux_before" ] && \
+           ! grep -qE "Rerun to get|Label\(s\) may have changed|Please rerun LaTeX" "${tex_name}.log" 2>/dev/null; then
+            break
+        fi
+        if [ $pass -ge "$max_passes" ]; then
+            echo -e "${YELLOW}已达到最大编译次数 ${max_passes}，交叉引用可能仍未稳定${NC}"
+            break
+        fi
+        aux_before="$aux_after"
+        pass=$((pass + 1))
+    done
     
-    if [ $compile_status -ne 0 ]; then
-        echo -e "${YELLOW}第二次编译返回状态: $compile_status (可能有警告)${NC}"
-    else
-        echo -e "${GREEN}第二次编译成功${NC}"
+    if [ -n "$no_pdf" ]; then
+        if [ -f "${tex_name}.xdv" ] && xdvipdfmx -q -o "${tex_name}.pdf" "${tex_name}.xdv" >> "$log_file" 2>&1; then
+            echo -e "${GREEN}xdvipdfmx生成PDF成功${NC}"
+        else
+            echo -e "${RED}错误: xdvipdfmx无法生成PDF${NC}"
+            tail -n 20 "$log_file"
+            rm -f "$log_file"
+            return 1
+        fi
     fi
     
     # 检查PDF是否生成
@@ -136,14 +173,53 @@ clean_temp_files() {
     echo -e "${BLUE}清理临时文件...${NC}"
     rm -f "${base_name}.aux" "${base_name}.log" "${base_name}.out" "${base_name}.toc" \
           "${base_name}.lof" "${base_name}.lot" "${base_name}.bbl" "${base_name}.blg" \
-          "${base_name}.nav" "${base_name}.snm" "${base_name}.synctex.gz"
+          "${base_name}.nav" "${base_name}.snm" "${base_name}.synctex.gz" "${base_name}.xdv"
     echo -e "${GREEN}清理完成${NC}"
 }
 
+# 批量处理多个输入：Markdown文件和目录交给Python脚本的批处理模式并行转换，
+# LaTeX文件逐个编译
+process_batch() {
+    local md_inputs=()
+    local tex_inputs=()
+    local status=0
+    local input
+    
+    for input in "$@"; do
+        if [ -d "$input" ]; then
+            md_inputs+=("$input")
+        elif [ ! -f "$input" ]; then
+            echo -e "${RED}错误: 文件 '$input' 不存在${NC}"
+            status=1
+        elif [[ "$input" == *.md ]]; then
+            md_inputs+=("$input")
+        else
+            tex_inputs+=("$input")
+        fi
+    done
+    
+    if [ ${#md_inputs[@]} -gt 0 ]; then
+        echo -e "${BLUE}批量转换 ${#md_inputs[@]} 个Markdown输入${NC}"
+        python md2latex_pandoc.py --batch --fix-images --quiet "${md_inputs[@]}" || status=1
+    fi
+    
+    for input in "${tex_inputs[@]}"; do
+        # 在子shell中编译，避免compile_tex切换目录影响后续文件
+        ( compile_tex "$input" ) || status=1
+        if [ "$CLEAN_TEMP" = true ]; then
+            clean_temp_files "${input%.*}"
+        fi
+    done
+    
+    return $status
+}
+
 # 参数解析
 INPUT_FILE=""
+INPUT_FILES=()
 CLEAN_TEMP=false
 OPEN_PDF=false
+WATCH=false
 
 for arg in "$@"; do
     case $arg in
@@ -157,12 +233,27 @@ for arg in "$@"; do
         -o|--open)
             OPEN_PDF=true
             ;;
+        -w|--watch)
+            WATCH=true
+            ;;
         *.tex|*.md)
             INPUT_FILE="$arg"
+            INPUT_FILES+=("$arg")
+            ;;
+        *)
+            if [ -d "$arg" ]; then
+                INPUT_FILES+=("$arg")
+            fi
             ;;
     esac
 done
 
+# 多个输入或目录时进入批处理模式
+if [ ${#INPUT_FILES[@]} -gt 1 ] || { [ ${#INPUT_FILES[@]} -eq 1 ] && [ -d "${INPUT_FILES[0]}" ]; }; then
+    process_batch "${INPUT_FILES[@]}"
+    exit $?
+fi
+
 # 检查是否提供了输入文件
 if [ -z "$INPUT_FILE" ]; then
     echo -e "${RED}错误: 必须提供输入文件路径 (.md 或 .tex)${NC}"
@@ -176,6 +267,15 @@ if [ ! -f "$INPUT_FILE" ]; then
     exit 1
 fi
 
+# 监视模式交给Python脚本，在同一进程中持续增量重新构建
+if [ "$WATCH" = true ]; then
+    if [[ "$INPUT_FILE" != *.md ]]; then
+        echo -e "${RED}错误: 监视模式只支持Markdown文件${NC}"
+        exit 1
+    fi
+    exec python md2latex_pandoc.py "$INPUT_FILE" --watch --fix-images --quiet
+fi
+
 # 保存当前目录
 CURRENT_DIR=$(pwd)
 
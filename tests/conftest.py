@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""测试共用的夹具：benchmarks/fake_toolchain.py 提供的模拟工具链"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / 'benchmarks'))
+
+import bench_md2tex as bench
+import md2latex_pandoc as md2tex
+
+
+@pytest.fixture
+def fake_toolchain(tmp_path, monkeypatch):
+    """把模拟的pandoc、xelatex、xdvipdfmx等放到PATH最前面，缓存写入临时目录"""
+    bin_dir = bench.install_fake_toolchain(tmp_path / 'bin')
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.setattr(md2tex, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(md2tex, 'VERBOSE', False)
+    bench.reset_state()
+    yield bin_dir
+    bench.reset_state()
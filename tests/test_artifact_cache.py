@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""ArtifactCache：内容哈希缓存及其LRU淘汰"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+def entries(cache):
+    return sorted(path.name for path in cache.root.rglob('*') if path.is_file())
+
+
+def set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_make_key_separates_parts():
+    key = md2tex.ArtifactCache.make_key('svg2pdf', 'inkscape 1.2', '<svg/>')
+    assert key == md2tex.ArtifactCache.make_key('svg2pdf', 'inkscape 1.2', b'<svg/>')
+    assert len(key) == 64
+    # 组成部分之间有分隔符，拼接相同但划分不同的输入得到不同的键
+    assert md2tex.ArtifactCache.make_key('ab', 'c') != md2tex.ArtifactCache.make_key('a', 'bc')
+
+
+def test_get_misses_and_touches_mtime_on_hit(tmp_path):
+    cache = md2tex.ArtifactCache(tmp_path, 'ns', max_bytes=0)
+    key = cache.make_key('entry')
+    assert cache.get(key, '.pdf') is None
+
+    path = cache.put_bytes(key, '.pdf', b'%PDF')
+    assert path == tmp_path / 'ns' / key[:2] / f"{key}.pdf"
+    set_mtime(path, 1000)
+    assert cache.get(key, '.pdf') == path
+    assert path.stat().st_mtime > 1000
+    # 不同后缀是不同的条目
+    assert cache.get(key, '.svg') is None
+
+
+def test_store_replaces_atomically_without_leftovers(tmp_path):
+    cache = md2tex.ArtifactCache(tmp_path, 'ns', max_bytes=0)
+    key = cache.make_key('entry')
+    cache.put_bytes(key, '.bin', b'old')
+    path = cache.put_bytes(key, '.bin', b'new content')
+    assert path.read_bytes() == b'new content'
+    assert entries(cache) == [f"{key}.bin"]
+    assert oct(path.stat().st_mode & 0o777) == oct(0o644)
+
+
+def test_put_never_shares_inode_with_source(tmp_path):
+    cache = md2tex.ArtifactCache(tmp_path / 'cache', 'ns', max_bytes=0)
+    source = tmp_path / 'figure.pdf'
+    source.write_bytes(b'%PDF original')
+    path = cache.put(cache.make_key('figure'), '.pdf', source)
+    assert path.read_bytes() == b'%PDF original'
+    assert path.stat().st_ino != source.stat().st_ino
+    assert source.stat().st_nlink == 1
+
+    # 原地改写源文件不影响缓存条目
+    with open(source, 'r+b') as f:
+        f.write(b'%PDF modified')
+    assert path.read_bytes() == b'%PDF original'
+
+
+def test_refusing_hardlink_keeps_hardlinks_for_staging(tmp_path):
+    source = tmp_path / 'a.pdf'
+    source.write_bytes(b'%PDF')
+    assert md2tex.link_or_copy(source, tmp_path / 'b.pdf', allow_hardlink=False) in ('reflink', 'copy')
+    # 只是本次调用不用硬链接，同一文件系统上暂存资源时仍可使用
+    assert md2tex.link_or_copy(source, tmp_path / 'c.pdf') in ('reflink', 'hardlink')
+
+
+def test_running_total_accounts_for_replaced_entries(tmp_path):
+    cache = md2tex.ArtifactCache(tmp_path, 'ns', max_bytes=10000)
+    cache.put_bytes(cache.make_key('a'), '.bin', b'x' * 100)
+    cache.put_bytes(cache.make_key('b'), '.bin', b'x' * 200)
+    assert md2tex._CACHE_SIZES[str(cache.root)] == 300
+    # 覆盖已有条目只计算大小的差值
+    cache.put_bytes(cache.make_key('a'), '.bin', b'x' * 50)
+    assert md2tex._CACHE_SIZES[str(cache.root)] == 250
+
+
+def test_eviction_removes_least_recently_used_down_to_ratio(tmp_path, monkeypatch):
+    cache = md2tex.ArtifactCache(tmp_path, 'ns', max_bytes=1000)
+    paths = [cache.put_bytes(cache.make_key(str(i)), '.bin', b'x' * 200) for i in range(5)]
+    for i, path in enumerate(paths):
+        set_mtime(path, 1000 + i)
+    # 命中刷新使用时间，最早写入的条目不再是最久未使用的
+    assert cache.get(cache.make_key('0'), '.bin') is not None
+
+    scans = []
+    evict = md2tex.ArtifactCache.evict
+    monkeypatch.setattr(md2tex.ArtifactCache, 'evict', lambda self: scans.append(1) or evict(self))
+    cache.put_bytes(cache.make_key('5'), '.bin', b'x' * 200)
+    assert scans == [1]
+
+    # 1200字节超过上限，淘汰到 1000 * CACHE_EVICT_RATIO 以下
+    remaining = entries(cache)
+    assert 200 * len(remaining) <= 1000 * md2tex.CACHE_EVICT_RATIO
+    assert f"{cache.make_key('0')}.bin" in remaining
+    assert f"{cache.make_key('5')}.bin" in remaining
+    assert f"{cache.make_key('1')}.bin" not in remaining
+    assert f"{cache.make_key('2')}.bin" not in remaining
+    assert md2tex._CACHE_SIZES[str(cache.root)] == 200 * len(remaining)
+
+    # 淘汰后留有余量，下一次写入不需要重新扫描
+    cache.put_bytes(cache.make_key('6'), '.bin', b'x' * 100)
+    assert scans == [1]
+
+
+def test_evict_ignores_temporary_files(tmp_path):
+    cache = md2tex.ArtifactCache(tmp_path, 'ns', max_bytes=100)
+    cache.root.mkdir(parents=True)
+    (cache.root / 'partial.tmp').write_bytes(b'x' * 500)
+    assert cache.evict() == 0
+    assert (cache.root / 'partial.tmp').exists()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""AssetIndex：按文件名查找图片资源"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+def touch(path, content=b''):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def bump_mtime(directory, mtime):
+    # 目录的修改时间由测试控制，不依赖文件系统的时间精度
+    os.utime(directory, (mtime, mtime))
+
+
+def test_lookup_follows_root_order_then_top_down(tmp_path):
+    paper = tmp_path / 'gemini_paper'
+    touch(tmp_path / 'fig.png')
+    touch(tmp_path / 'a' / 'b' / 'deep.png')
+    touch(tmp_path / 'z' / 'deep.png')
+    touch(paper / 'chapter' / 'fig.png')
+
+    index = md2tex.AssetIndex([paper, tmp_path])
+    # 先搜索的根目录优先，即使其中的文件层级更深
+    assert index.lookup('fig.png') == paper.resolve() / 'chapter' / 'fig.png'
+    assert index.lookup_all('fig.png') == [paper.resolve() / 'chapter' / 'fig.png', tmp_path.resolve() / 'fig.png']
+    # 同一根目录内与os.walk自顶向下的顺序一致：a先于z，进入a的子目录后才轮到z
+    expected = [path for root, dirs, files in os.walk(tmp_path.resolve()) for path in
+                [Path(root) / name for name in files if name == 'deep.png']]
+    assert index.lookup_all('deep.png') == expected
+    assert index.lookup('fig.png', predicate=lambda path: 'chapter' not in path.parts) == tmp_path.resolve() / 'fig.png'
+    assert index.lookup('missing.png') is None
+
+
+def test_hidden_and_dependency_directories_are_not_indexed(tmp_path):
+    # 与原来的 os.walk('.') 不同：.git 等隐藏目录、node_modules 和 __pycache__ 不参与扫描
+    touch(tmp_path / '.git' / 'objects' / 'fig.png')
+    touch(tmp_path / 'node_modules' / 'pkg' / 'fig.png')
+    touch(tmp_path / '__pycache__' / 'fig.png')
+    index = md2tex.AssetIndex([tmp_path])
+    assert index.lookup('fig.png') is None
+
+    touch(tmp_path / 'pics' / '.hidden.png')
+    index.refresh()
+    # 隐藏的文件本身仍然可以找到，只是不进入隐藏目录
+    assert index.lookup('.hidden.png') == tmp_path.resolve() / 'pics' / '.hidden.png'
+
+
+def test_refresh_rereads_only_directories_whose_mtime_changed(tmp_path, monkeypatch):
+    touch(tmp_path / 'pics' / 'old.png')
+    touch(tmp_path / 'other' / 'x.png')
+    bump_mtime(tmp_path / 'pics', 1000)
+    index = md2tex.AssetIndex([tmp_path])
+
+    touch(tmp_path / 'pics' / 'new.png')
+    bump_mtime(tmp_path / 'pics', 2000)
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(md2tex.os, 'scandir', lambda path: scanned.append(path) or scandir(path))
+    index.refresh()
+    assert scanned == [str(tmp_path.resolve() / 'pics')]
+    assert index.lookup('new.png') == tmp_path.resolve() / 'pics' / 'new.png'
+
+
+def test_lookup_miss_refreshes_and_deleted_files_are_dropped(tmp_path):
+    touch(tmp_path / 'pics' / 'a.png')
+    index = md2tex.AssetIndex([tmp_path])
+    touch(tmp_path / 'pics' / 'late.png')
+    bump_mtime(tmp_path / 'pics', 3000)
+    # 未命中时超过一秒未刷新才重新扫描
+    index._last_refresh = 0.0
+    assert index.lookup('late.png') == tmp_path.resolve() / 'pics' / 'late.png'
+
+    (tmp_path / 'pics' / 'a.png').unlink()
+    assert index.lookup('a.png') is None
+
+
+def test_persisted_index_round_trip(tmp_path, monkeypatch):
+    project = tmp_path / 'project'
+    touch(project / 'pics' / 'fig.png')
+    touch(project / 'sub' / 'table.png')
+    persist = tmp_path / 'index' / 'assets.json'
+    md2tex.AssetIndex([project], persist)
+    assert persist.exists()
+
+    # 再次运行时目录都未变化，直接使用持久化的列表，不再读取目录
+    scanned = []
+    scandir = os.scandir
+    monkeypatch.setattr(md2tex.os, 'scandir', lambda path: scanned.append(path) or scandir(path))
+    reloaded = md2tex.AssetIndex([project], persist)
+    assert scanned == []
+    assert reloaded.lookup('table.png') == project.resolve() / 'sub' / 'table.png'
+
+
+def test_invalid_persisted_index_is_ignored(tmp_path):
+    touch(tmp_path / 'pics' / 'fig.png')
+    persist = tmp_path / 'assets.json'
+    persist.write_text('{"dirs": {"x": [1]}}', encoding='utf-8')
+    index = md2tex.AssetIndex([tmp_path], persist)
+    assert index.lookup('fig.png') == tmp_path.resolve() / 'pics' / 'fig.png'
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""增量构建：BuildManifest及各阶段的跳过与失效"""
+
+import io
+import os
+import shutil
+import contextlib
+from pathlib import Path
+
+import pytest
+
+import bench_md2tex as bench
+import md2latex_pandoc as md2tex
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_digest_is_cached_by_size_and_mtime(tmp_path):
+    source = tmp_path / 'a.txt'
+    source.write_text('one', encoding='utf-8')
+    manifest = md2tex.BuildManifest(tmp_path / 'out')
+    digest = manifest.digest_file(source)
+    assert digest == md2tex.file_sha256(source)
+    assert manifest.digest_file(tmp_path / 'missing.txt') is None
+
+    # 大小和修改时间都未变化时使用缓存的哈希，不重新读取文件
+    stat = source.stat()
+    source.write_text('two', encoding='utf-8')
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert manifest.digest_file(source) == digest
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert manifest.digest_file(source) == md2tex.file_sha256(source)
+
+
+def test_stage_freshness_checks_inputs_and_outputs(tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+    tex = out / 'doc.tex'
+    tex.write_text('v1', encoding='utf-8')
+    manifest = md2tex.BuildManifest(out)
+    manifest.record('tex', {'template': 'abc'}, [tex], {'note': 1})
+    manifest.save()
+
+    reloaded = md2tex.BuildManifest(out)
+    assert reloaded.is_fresh('tex', {'template': 'abc'})
+    assert reloaded.stage('tex')['extra'] == {'note': 1}
+    assert not reloaded.is_fresh('tex', {'template': 'xyz'})
+    assert not reloaded.is_fresh('pdf', {'template': 'abc'})
+
+    # 输出文件被原地改写后阶段失效，update_outputs记录新的哈希后恢复
+    tex.write_text('v2 rewritten', encoding='utf-8')
+    assert not reloaded.is_fresh('tex', {'template': 'abc'})
+    reloaded.update_outputs('tex', [tex])
+    assert reloaded.is_fresh('tex', {'template': 'abc'})
+    tex.unlink()
+    assert not reloaded.is_fresh('tex', {'template': 'abc'})
+
+
+def test_save_drops_unused_file_hashes_and_ignores_other_versions(tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+    used, unused = tmp_path / 'used.txt', tmp_path / 'unused.txt'
+    used.write_text('u', encoding='utf-8')
+    unused.write_text('x', encoding='utf-8')
+    manifest = md2tex.BuildManifest(out)
+    manifest.digest_file(used)
+    manifest.digest_file(unused)
+    manifest.save()
+
+    second = md2tex.BuildManifest(out)
+    second.digest_file(used)
+    second.save()
+    assert list(md2tex.BuildManifest(out).data['files']) == [str(used.resolve())]
+
+    manifest_file = out / md2tex.BuildManifest.FILENAME
+    manifest_file.write_text('{"version": 0, "stages": {"tex": {}}}', encoding='utf-8')
+    assert md2tex.BuildManifest(out).stage('tex') is None
+    manifest_file.write_text('not json', encoding='utf-8')
+    assert md2tex.BuildManifest(out).stage('tex') is None
+
+
+@pytest.fixture
+def project(tmp_path, fake_toolchain, monkeypatch):
+    """含引用、图片和特殊字符的文档，以及可修改的模板副本"""
+    doc = tmp_path / 'doc'
+    (doc / 'pics').mkdir(parents=True)
+    (doc / 'pics' / 'plot.png').write_bytes(bench.TINY_PNG)
+    (doc / 'refs.bib').write_text("@article{a1,\n  title = {T},\n  author = {A},\n  year = {2020}\n}\n",
+                                  encoding='utf-8')
+    (doc / 'paper.md').write_text("# 论文\n\n正文引用[@a1]。\n\n![示意图](pics/plot.png)\n\n参数β。\n",
+                                  encoding='utf-8')
+    style = tmp_path / 'style'
+    shutil.copytree(REPO_ROOT / 'latex_style', style)
+    for name in ('SPECIAL_CHAR_MAP', 'MAX_LATEX_PASSES'):
+        monkeypatch.setattr(md2tex, name, getattr(md2tex, name))
+
+    skipped = []
+    monkeypatch.setattr(md2tex.BuildManifest, 'skip', lambda self, name, message: skipped.append(name))
+
+    def build():
+        skipped.clear()
+        bench.reset_state()
+        with contextlib.redirect_stdout(io.StringIO()):
+            success, pdf_path, _ = md2tex.build_document(str(doc / 'paper.md'), str(tmp_path / 'out'),
+                                                         str(style / 'template.tex'), incremental=True)
+        assert success and Path(pdf_path).exists()
+        return set(skipped)
+
+    assert build() == set()
+    assert build() == {'preprocess', 'tex', 'pdf'}
+    return doc, style, build
+
+
+ALL_STAGES = {'preprocess', 'tex', 'pdf'}
+
+
+def test_template_change_reruns_pandoc(project):
+    doc, style, build = project
+    with open(style / 'template.tex', 'a', encoding='utf-8') as f:
+        f.write('% changed\n')
+    assert 'tex' not in build()
+    assert build() == ALL_STAGES
+
+
+def test_bib_change_reruns_pandoc(project):
+    doc, style, build = project
+    with open(doc / 'refs.bib', 'a', encoding='utf-8') as f:
+        f.write("@article{b2,\n  title = {U},\n  author = {B},\n  year = {2021}\n}\n")
+    assert 'tex' not in build()
+    assert build() == ALL_STAGES
+
+
+def test_image_change_reruns_preprocess_and_xelatex_only(project):
+    doc, style, build = project
+    (doc / 'pics' / 'plot.png').write_bytes(bench.TINY_PNG + b'\0')
+    # 图片只影响资源复制和编译，预处理后的Markdown不变，pandoc不需要重新运行
+    assert build() == {'tex'}
+    assert build() == ALL_STAGES
+
+
+def test_char_map_change_reruns_pandoc(project, monkeypatch):
+    doc, style, build = project
+    monkeypatch.setattr(md2tex, 'SPECIAL_CHAR_MAP', dict(md2tex.SPECIAL_CHAR_MAP, **{"β": "\\beta{}"}))
+    assert 'tex' not in build()
+    assert build() == ALL_STAGES
+
+
+def test_max_passes_change_reruns_xelatex_only(project, monkeypatch):
+    doc, style, build = project
+    monkeypatch.setattr(md2tex, 'MAX_LATEX_PASSES', 2)
+    assert build() == {'preprocess', 'tex'}
+    assert build() == ALL_STAGES
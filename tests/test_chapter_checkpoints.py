@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""章节拆分编译：结束计数器的推测、.aux检查点的改写以及章节PDF的合并"""
+
+import io
+import contextlib
+from pathlib import Path
+
+import pytest
+
+from fake_toolchain import minimal_pdf
+import md2latex_pandoc as md2tex
+
+CHAPTER_AUX = ("\\relax\n"
+               "\\setcounter{page}{2}\n"
+               "\\newlabel{sec:method}{{2}{5}}\n"
+               "\\@writefile{toc}{\\contentsline {section}{\\numberline {2}方法}{5}}\n"
+               "\\@setckpt{chapters/chapter-02}{\n"
+               "\\setcounter{page}{9}\n"
+               "\\setcounter{section}{2}\n"
+               "\\setcounter{figure}{3}\n"
+               "\\setcounter{equation}{0}\n"
+               "}\n")
+
+
+@pytest.mark.parametrize('end, old_start, new_start, expected', [
+    # 前一章节多出3页、1张图：结束时的页码和图编号随之平移
+    ({'page': 9, 'figure': 3, 'section': 2}, {'page': 5, 'figure': 1}, {'page': 8, 'figure': 2},
+     {'page': 12, 'figure': 4, 'section': 2}),
+    # 前一章节变短时向前平移
+    ({'page': 9}, {'page': 5}, {'page': 3}, {'page': 7}),
+    # 缺少的起始计数器按LaTeX的初始值计算：页码为1，其余为0
+    ({'page': 4, 'table': 2}, {}, {'page': 3, 'table': 1}, {'page': 6, 'table': 3}),
+    # 章节内被重置的计数器（结束值小于起始值）保持不变
+    ({'figure': 1, 'page': 6}, {'figure': 5, 'page': 2}, {'figure': 7, 'page': 2}, {'figure': 1, 'page': 6}),
+    # 结束时没有记录的计数器不会被加入
+    ({'page': 6}, {'page': 2}, {'page': 3, 'equation': 4}, {'page': 7}),
+])
+def test_predict_chapter_checkpoint(end, old_start, new_start, expected):
+    assert md2tex.predict_chapter_checkpoint(end, old_start, new_start) == expected
+    assert md2tex.predict_chapter_checkpoint(end, old_start, old_start) == end
+
+
+def test_rewrite_aux_checkpoint_only_changes_the_checkpoint(tmp_path):
+    aux = tmp_path / 'chapter-02.aux'
+    aux.write_text(CHAPTER_AUX, encoding='utf-8')
+    md2tex.rewrite_aux_checkpoint(aux, {'page': 12, 'figure': 4, 'table': 7})
+
+    text = aux.read_text(encoding='utf-8')
+    # \@setckpt之前的\setcounter、标签和目录条目保持原样；检查点中没有的计数器不会被加入
+    assert text == CHAPTER_AUX.replace('{page}{9}', '{page}{12}').replace('{figure}{3}', '{figure}{4}')
+    labels, contents, counters = md2tex.read_chapter_aux(aux)
+    assert counters == {'page': 12, 'section': 2, 'figure': 4, 'equation': 0}
+    assert labels == {'sec:method': '\\newlabel{sec:method}{{2}{5}}'}
+    assert len(contents) == 1
+
+
+def test_rewrite_aux_without_checkpoint_is_untouched(tmp_path):
+    aux = tmp_path / 'paper.aux'
+    aux.write_text("\\relax\n\\setcounter{page}{3}\n", encoding='utf-8')
+    md2tex.rewrite_aux_checkpoint(aux, {'page': 10})
+    assert aux.read_text(encoding='utf-8') == "\\relax\n\\setcounter{page}{3}\n"
+    assert md2tex.read_chapter_aux(tmp_path / 'missing.aux') == ({}, [], {})
+
+
+def document(first_chapter_chars):
+    """三个章节，各自引用下一章节的编号和页码；第一个章节的长度决定后续章节的起始页"""
+    body = ''
+    for i in range(3):
+        text = '正文' * (first_chapter_chars if i == 0 else 500)
+        body += (f"\\section{{第{i}章}}\\label{{sec:{i}}}\n\n{text}\n"
+                 f"见第\\ref{{sec:{(i + 1) % 3}}}节，第\\pageref{{sec:{(i + 1) % 3}}}页。\n\n")
+    return "\\documentclass{ctexart}\n\\begin{document}\n" + body + "\\end{document}\n"
+
+
+def test_changed_chapter_shifts_the_predicted_checkpoints(tmp_path, fake_toolchain, monkeypatch):
+    monkeypatch.setattr(md2tex, 'SPLIT_CHAPTERS', 2)
+    tex = tmp_path / 'out' / 'paper.tex'
+    tex.parent.mkdir()
+    chapter_dir = tex.parent / md2tex.CHAPTER_DIR
+
+    def build(first_chapter_chars):
+        tex.write_text(document(first_chapter_chars), encoding='utf-8')
+        with contextlib.redirect_stdout(io.StringIO()):
+            result, log = md2tex.run_chapter_passes(tex)
+        assert result.returncode == 0 and not log.fatal
+        return [md2tex.read_chapter_aux(chapter_dir / f"chapter-{i:02d}.aux")[2]['page'] for i in range(3)]
+
+    # 每个章节一页，检查点记录的是章节结束后的页码
+    assert build(500) == [2, 3, 4]
+
+    rewritten = []
+    rewrite = md2tex.rewrite_aux_checkpoint
+
+    def record(path, counters):
+        rewrite(path, counters)
+        rewritten.append((Path(path).name, md2tex.read_chapter_aux(path)[2]['page']))
+    monkeypatch.setattr(md2tex, 'rewrite_aux_checkpoint', record)
+    # 第一个章节变为4页：后两个章节内容未变，只按起始页的变化推测并改写其检查点
+    assert build(3000) == [5, 6, 7]
+    assert rewritten == [('chapter-01.aux', 6), ('chapter-02.aux', 7)]
+    labels = {}
+    for i in range(3):
+        labels.update(md2tex.read_chapter_aux(chapter_dir / f"chapter-{i:02d}.aux")[0])
+    assert labels['sec:1'] == '\\newlabel{sec:1}{{1}{5}}'
+    assert labels['sec:2'] == '\\newlabel{sec:2}{{1}{6}}'
+    if md2tex.pypdf is not None:
+        assert pdf_pages(tex.with_suffix('.pdf')) == 6
+
+
+def pdf_pages(path):
+    return len(md2tex.pypdf.PdfReader(str(path)).pages)
+
+
+@pytest.fixture
+def chapter_pdfs(tmp_path):
+    paths = []
+    for i, pages in enumerate((1, 3, 2)):
+        path = tmp_path / f"chapter-{i}.pdf"
+        path.write_bytes(minimal_pdf(pages))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.skipif(md2tex.pypdf is None, reason='未安装pypdf')
+def test_merge_pdfs_with_pypdf(tmp_path, chapter_pdfs):
+    output = tmp_path / 'paper.pdf'
+    output.write_bytes(b'old')
+    assert md2tex.merge_pdfs(chapter_pdfs, output)
+    assert pdf_pages(output) == 6
+    assert not (tmp_path / 'paper.pdf.tmp').exists()
+
+
+@pytest.mark.skipif(md2tex.pypdf is None, reason='未安装pypdf')
+def test_merge_pdfs_failure_keeps_previous_output(tmp_path, chapter_pdfs):
+    chapter_pdfs[1].write_bytes(b'not a pdf')
+    output = tmp_path / 'paper.pdf'
+    output.write_bytes(b'old')
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert not md2tex.merge_pdfs(chapter_pdfs, output)
+    assert output.read_bytes() == b'old'
+
+
+def write_tool(bin_dir, name, script):
+    bin_dir.mkdir(exist_ok=True)
+    tool = bin_dir / name
+    tool.write_text('#!/bin/sh\n' + script, encoding='utf-8')
+    tool.chmod(0o755)
+
+
+@pytest.mark.parametrize('tool, script, merged', [
+    # qpdf只有警告时返回3，输出仍然可用
+    ('qpdf', 'for last; do :; done\necho merged > "$last"\nexit 3\n', True),
+    ('qpdf', 'exit 2\n', False),
+    ('pdfunite', 'for last; do :; done\necho merged > "$last"\n', True),
+    # 返回0但没有生成输出
+    ('pdfunite', 'exit 0\n', False),
+])
+def test_merge_pdfs_with_command_line_tools(tmp_path, chapter_pdfs, monkeypatch, tool, script, merged):
+    monkeypatch.setattr(md2tex, 'pypdf', None)
+    write_tool(tmp_path / 'bin', tool, script)
+    monkeypatch.setenv('PATH', str(tmp_path / 'bin'))
+    output = tmp_path / 'paper.pdf'
+    assert md2tex.merge_pdfs(chapter_pdfs, output) is merged
+    assert output.exists() is merged
+
+
+def test_merge_pdfs_without_tools(tmp_path, chapter_pdfs, monkeypatch):
+    monkeypatch.setattr(md2tex, 'pypdf', None)
+    monkeypatch.setenv('PATH', str(tmp_path / 'empty'))
+    assert not md2tex.merge_pdfs(chapter_pdfs, tmp_path / 'paper.pdf')
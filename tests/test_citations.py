@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""引用键提取与.bib条目键扫描"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+@pytest.mark.parametrize('markdown, expected', [
+    ("见[@smith2020; @lee2019, 第3页]。", {'smith2020', 'lee2019'}),
+    ("@smith2020 指出，", {'smith2020'}),
+    # 键末尾的标点不属于键
+    ("如 @smith2020. 后文", {'smith2020'}),
+    # @前是单词字符（包括汉字）时不视为引用，与排除邮箱地址的规则相同
+    ("如@smith2020所述", set()),
+    ("参见 [-@smith2020]", {'smith2020'}),
+    ("@{a:b.c}，@{x/y}", {'a:b.c', 'x/y'}),
+    ("@doe:2021-x。", {'doe:2021-x'}),
+    # 邮箱地址和 @@ 不是引用
+    ("联系 someone@example.com 或 @@notkey", set()),
+    ("", set()),
+])
+def test_citation_forms(markdown, expected):
+    assert md2tex.extract_citation_keys(markdown) == expected
+
+
+@pytest.mark.parametrize('markdown, expected', [
+    ("```java\n@Override\npublic void run() {}\n```\n\n正文[@real]", {'real'}),
+    ("~~~css\n@media print { }\n~~~\n@real", {'real'}),
+    # 围栏可以缩进至多3个空格，闭合围栏可以更长
+    ("   ````\n@inside\n`````\n@after", {'after'}),
+    # 较短的反引号序列不会闭合代码块
+    ("````\n```\n@inside\n````\n@after", {'after'}),
+    # 未闭合的代码块到文末为止
+    ("@before\n```\n@inside\n", {'before'}),
+    ("使用 `@Override` 注解和 ``a ` @media``，引用 @real", {'real'}),
+    # 落单的反引号不跨段落吞掉后面的引用
+    ("单个`反引号 @first\n\n下一段 @second", {'first', 'second'}),
+    ("前`code`@after", {'after'}),
+])
+def test_code_is_not_scanned(markdown, expected):
+    assert md2tex.extract_citation_keys(markdown) == expected
+
+
+def test_scan_bib_keys(tmp_path):
+    bib = tmp_path / 'refs.bib'
+    bib.write_text(
+        "@string{jan = \"January\"}\n"
+        "@Article{smith2020,\n  title = {A},\n}\n"
+        "@book( lee2019 , title = {B})\n"
+        "@comment{ignored, x}\n"
+        "@preamble{\"\\newcommand{\\x}{}\"}\n"
+        "@misc{doe:2021-x, note = {me@example.com}}\n",
+        encoding='utf-8')
+    assert md2tex.scan_bib_keys(bib) == {'smith2020', 'lee2019', 'doe:2021-x'}
+
+    empty = tmp_path / 'empty.bib'
+    empty.write_bytes(b'')
+    assert md2tex.scan_bib_keys(empty) == set()
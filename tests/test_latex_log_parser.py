@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""LatexLogParser：用xelatex的实际输出片段检验逐行解析的结果"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+MISSING_PACKAGE = r"""This is XeTeX, Version 3.141592653-2.6-0.999995 (TeX Live 2023) (preloaded format=xelatex)
+ restricted \write18 enabled.
+entering extended mode
+(./paper.tex
+LaTeX2e <2022-11-01> patch level 1
+(/usr/share/texlive/texmf-dist/tex/latex/base/article.cls
+Document Class: article 2022/07/02 v1.4n Standard LaTeX document class
+(/usr/share/texlive/texmf-dist/tex/latex/base/size10.clo))
+
+! LaTeX Error: File `nosuchpkg.sty' not found.
+
+Type X to quit or <RETURN> to proceed,
+or enter new name. (Default extension: sty)
+
+Enter file name:
+! Emergency stop.
+<read *>
+
+l.3 \usepackage
+               {graphicx}^^M
+*** (cannot \read from terminal in nonstop modes)
+"""
+
+UNDEFINED_CONTROL_SEQUENCE = r"""(./paper.aux)
+! Undefined control sequence.
+l.12 这里有一个\foo
+                   命令。
+[1] (./paper.aux) )
+Output written on paper.xdv (1 page, 3456 bytes).
+"""
+
+MISSING_IMAGE = r"""! Unable to load picture or PDF file 'pics/absent.png'.
+<to be read again>
+                   }
+l.40 ...ics[width=0.8\textwidth]{pics/absent.png}
+
+"""
+
+UNDEFINED_REFERENCES = r"""(./paper.aux)
+
+LaTeX Warning: Reference `fig:missing' on page 1 undefined on input line 15.
+
+
+LaTeX Warning: Citation `smith2020' on page 2 undefined on input line 20.
+
+[1] [2]
+
+LaTeX Warning: Reference `fig:missing' on page 2 undefined on input line 31.
+
+(./paper.aux)
+
+LaTeX Warning: There were undefined references.
+
+"""
+
+RERUN = r"""(./paper.aux)
+
+LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.
+
+"""
+
+RERUN_FILE_CHECK = r"""Package rerunfilecheck Warning: File `paper.out' has changed.
+(rerunfilecheck)                Rerun to get outlines right
+(rerunfilecheck)                or use package `bookmark'.
+
+"""
+
+OVERFULL_AND_FONTS = r"""Overfull \hbox (12.34567pt too wide) in paragraph at lines 10--12
+[]\TU/lmr/m/n/10 这是一个很长的行
+Missing character: There is no 丂 in font lmroman10-regular!
+Overfull \vbox (3.0pt too high) has occurred while \output is active []
+
+LaTeX Font Warning: Font shape `TU/SimSun(0)/b/n' undefined
+(Font)              using `TU/SimSun(0)/m/n' instead on input line 7.
+
+"""
+
+
+def parse(text):
+    log = md2tex.LatexLogParser()
+    for line in text.splitlines(keepends=True):
+        log.feed(line)
+    log.finish()
+    return log
+
+
+def wrap(text, width=79):
+    """按TeX的方式在第width个字符处折行"""
+    return '\n'.join(line[i:i + width] for line in text.split('\n')
+                     for i in range(0, max(len(line), 1), width))
+
+
+def test_missing_package_is_fatal_and_aborts_at_emergency_stop():
+    log = md2tex.LatexLogParser()
+    aborted_at = None
+    for line in MISSING_PACKAGE.splitlines():
+        if log.feed(line):
+            aborted_at = line
+            break
+    # feed()在致命错误处返回True，调用方据此立即终止xelatex
+    assert aborted_at == '! Emergency stop.'
+    assert log.fatal and not log.rerun
+    assert log.missing_files == ['nosuchpkg.sty']
+    assert log.errors[0] == {'message': "LaTeX Error: File `nosuchpkg.sty' not found.", 'line': None, 'context': None}
+
+
+def test_emergency_stop_gets_the_line_number():
+    log = parse(MISSING_PACKAGE)
+    assert [error['message'] for error in log.errors] == ["LaTeX Error: File `nosuchpkg.sty' not found.",
+                                                           'Emergency stop.']
+    assert log.errors[1]['line'] == 3 and log.errors[1]['context'] == '\\usepackage'
+
+
+def test_undefined_control_sequence_is_not_fatal():
+    log = parse(UNDEFINED_CONTROL_SEQUENCE)
+    assert not log.fatal
+    assert log.errors == [{'message': 'Undefined control sequence.', 'line': 12, 'context': '这里有一个\\foo'}]
+    assert log.summary() == '1个错误'
+
+
+def test_missing_image():
+    log = parse(MISSING_IMAGE)
+    assert log.missing_files == ['pics/absent.png']
+    assert log.errors[0]['line'] == 40
+    assert not log.fatal
+
+
+def test_undefined_references_are_listed_once():
+    log = parse(UNDEFINED_REFERENCES)
+    assert log.undefined_references == ['fig:missing', 'smith2020']
+    assert log.counts['undefined_references'] == 2
+    # "There were undefined references" 本身不要求重新编译
+    assert not log.rerun and not log.fatal
+    assert log.summary() == '2个未定义的引用'
+
+
+@pytest.mark.parametrize('text', [RERUN, RERUN_FILE_CHECK])
+def test_rerun_hints(text):
+    log = parse(text)
+    assert log.rerun and not log.fatal and log.summary() == ''
+
+
+def test_overfull_boxes_and_font_warnings():
+    log = parse(OVERFULL_AND_FONTS)
+    assert log.overfull_boxes == [{'box': 'hbox', 'amount': '12.34567pt too wide', 'lines': [10, 12]},
+                                  {'box': 'vbox', 'amount': '3.0pt too high', 'lines': None}]
+    assert log.font_warnings == ['There is no 丂 in font lmroman10-regular!',
+                                 "Font shape `TU/SimSun(0)/b/n' undefined"]
+
+
+# max_print_line未生效时xelatex在第79个字符处折行，以下片段与实际折行后的输出一致
+def test_wrapped_missing_file_and_fatal_error():
+    text = wrap(MISSING_PACKAGE.replace('nosuchpkg', 'a-package-with-a-rather-long-name-for-testing'))
+    assert "! LaTeX Error: File `a-package-with-a-rather-long-name-for-testing.sty' not fou\nnd." in text
+    log = parse(text)
+    assert log.missing_files == ['a-package-with-a-rather-long-name-for-testing.sty']
+    assert log.fatal and log.errors[1]['line'] == 3
+
+
+def test_wrapped_reference_rerun_and_overfull_lines():
+    text = wrap("LaTeX Warning: Reference `fig:a-rather-long-label-name-for-testing' on page 1 "
+                "undefined on input line 42.\n"
+                "Package rerunfilecheck Warning: File `chapters/introduction-chapter.out' has changed. "
+                "Rerun to get outlines right\n"
+                "Overfull \\hbox (123.45678pt too wide) in paragraph at lines 1234--1240 with extra words\n")
+    assert len(text.splitlines()) == 6
+    log = parse(text)
+    assert log.undefined_references == ['fig:a-rather-long-label-name-for-testing']
+    assert log.rerun
+    assert log.overfull_boxes == [{'box': 'hbox', 'amount': '123.45678pt too wide', 'lines': [1234, 1240]}]
+
+
+def test_full_width_line_is_not_joined_with_a_new_message():
+    line = 'x' * md2tex.LatexLogParser.WRAP_WIDTH
+    log = parse(f"{line}\n! Undefined control sequence.\nl.7 \\foo\n")
+    assert log.errors == [{'message': 'Undefined control sequence.', 'line': 7, 'context': '\\foo'}]
+
+
+def test_finish_parses_a_held_last_line():
+    line = ("! LaTeX Error: File `x.sty' not found." + ' ' * 79)[:md2tex.LatexLogParser.WRAP_WIDTH]
+    log = md2tex.LatexLogParser()
+    log.feed(line)
+    assert log.counts['errors'] == 0
+    log.finish()
+    assert log.counts['errors'] == 1 and log.missing_files == ['x.sty']
+
+
+def test_merge_combines_chapter_logs():
+    first, second = parse(UNDEFINED_CONTROL_SEQUENCE), parse(RERUN + UNDEFINED_REFERENCES)
+    first.merge(second)
+    assert first.counts['errors'] == 1 and first.counts['undefined_references'] == 2
+    assert first.rerun and not first.fatal
+    assert set(first.diagnostics()) == {'fatal', 'rerun', 'counts', 'errors', 'missing_files',
+                                        'undefined_references', 'overfull_boxes', 'font_warnings'}
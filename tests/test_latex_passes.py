@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""run_xelatex_passes：自适应编译次数及XDV到PDF的转换"""
+
+import io
+import contextlib
+from pathlib import Path
+
+import pytest
+
+import md2latex_pandoc as md2tex
+
+DOCUMENT = ("\\documentclass{article}\n\\begin{document}\n"
+            "\\section{引言}\\label{sec:intro}\n见第\\ref{sec:intro}节。\n\\end{document}\n")
+
+
+@pytest.fixture
+def commands(fake_toolchain, monkeypatch):
+    """记录run_cancellable运行的命令名和参数"""
+    calls = []
+    run_cancellable = md2tex.run_cancellable
+
+    def record(cmd, *args, **kwargs):
+        calls.append([Path(cmd[0]).name] + list(cmd[1:]))
+        return run_cancellable(cmd, *args, **kwargs)
+    monkeypatch.setattr(md2tex, 'run_cancellable', record)
+    return calls
+
+
+def write_tex(tmp_path, content=DOCUMENT):
+    tex = tmp_path / 'doc' / 'paper.tex'
+    tex.parent.mkdir()
+    tex.write_text(content, encoding='utf-8')
+    return tex
+
+
+def run_passes(tex, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return md2tex.run_xelatex_passes(tex, **kwargs)
+
+
+def tools(calls):
+    return [call[0] for call in calls]
+
+
+def test_stops_when_aux_is_stable_and_no_rerun_hint(tmp_path, commands):
+    tex = write_tex(tmp_path)
+    result, log = run_passes(tex, max_passes=5)
+    # 第一次写入.aux并提示重新编译，第二次.aux不变且没有提示，随后转换XDV
+    assert tools(commands) == ['xelatex', 'xelatex', 'xdvipdfmx']
+    assert all('-no-pdf' in call for call in commands[:2])
+    assert result.returncode == 0 and not log.rerun
+    assert (tex.parent / 'paper.pdf').exists()
+
+    # 保留的辅助文件已经稳定，再次构建只需一次编译
+    commands.clear()
+    run_passes(tex, max_passes=5)
+    assert tools(commands) == ['xelatex', 'xdvipdfmx']
+
+
+def test_respects_max_passes(tmp_path, commands):
+    tex = write_tex(tmp_path)
+    result, log = run_passes(tex, max_passes=1)
+    assert tools(commands) == ['xelatex', 'xdvipdfmx']
+    # 达到上限时交叉引用仍未稳定，但仍然生成PDF
+    assert log.rerun
+    assert (tex.parent / 'paper.pdf').exists()
+
+
+def test_max_passes_defaults_to_setting(tmp_path, commands, monkeypatch):
+    monkeypatch.setattr(md2tex, 'MAX_LATEX_PASSES', 1)
+    run_passes(write_tex(tmp_path))
+    assert tools(commands).count('xelatex') == 1
+
+
+def test_without_xdvipdfmx_xelatex_writes_pdf(tmp_path, commands, fake_toolchain):
+    (fake_toolchain / 'xdvipdfmx').unlink()
+    tex = write_tex(tmp_path)
+    run_passes(tex, max_passes=5)
+    assert tools(commands) == ['xelatex', 'xelatex']
+    assert not any('-no-pdf' in call for call in commands)
+    assert (tex.parent / 'paper.pdf').exists()
+    assert not (tex.parent / 'paper.xdv').exists()
+
+
+def test_falls_back_to_xelatex_when_xdvipdfmx_fails(tmp_path, commands, fake_toolchain):
+    failing = fake_toolchain / 'xdvipdfmx'
+    failing.write_text('#!/bin/sh\necho "xdvipdfmx: fatal" >&2\nexit 1\n', encoding='utf-8')
+    failing.chmod(0o755)
+    tex = write_tex(tmp_path)
+    result, log = run_passes(tex, max_passes=5)
+    assert tools(commands) == ['xelatex', 'xelatex', 'xdvipdfmx', 'xelatex']
+    # 回退时直接生成PDF，不再使用 -no-pdf
+    assert '-no-pdf' not in commands[-1]
+    assert result.returncode == 0
+    assert (tex.parent / 'paper.pdf').exists()
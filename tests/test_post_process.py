@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""LaTeX后处理：环境结构索引、批量拼接编辑以及与原实现逐字节一致的输出"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+PREAMBLE = "\\documentclass{ctexart}\n\\usepackage{amsmath}\n\\usepackage{graphicx}\n\\begin{document}\n"
+END = "\\end{document}\n"
+
+SVG_FILES = [
+    {'path': 'pics/figure_1.pdf', 'caption': '流程图', 'index': 1},
+    {'path': 'pics/figure_2.pdf', 'caption': '', 'index': 2},
+]
+
+WRAPPED = ("\n\\begin{{figure}}[H]  % H强制图片在当前位置\n\\centering\n{graphic}\n"
+           "\\caption{{图 {num}}}\n\\label{{fig:figure_{num}}}\n\\end{{figure}}\n")
+
+
+def wrapped(graphic, num):
+    return WRAPPED.format(graphic=graphic, num=num)
+
+
+def post_process(body, svg_files=SVG_FILES):
+    content = md2tex.post_process_latex_text(PREAMBLE + body + END, None, [dict(svg) for svg in svg_files])
+    return content[content.index('\\begin{document}') + len('\\begin{document}\n'):]
+
+
+def test_apply_splices_sorts_edits_and_drops_overlaps():
+    content = "0123456789"
+    assert md2tex.apply_splices(content, []) is content
+    assert md2tex.apply_splices(content, [(6, 8, 'b'), (1, 3, 'a')]) == "0a345b89"
+    # 与前一个编辑重叠的编辑被忽略，起始位置相同时先应用较短的编辑
+    assert md2tex.apply_splices(content, [(2, 6, 'X'), (4, 8, 'Y')]) == "01X6789"
+    assert md2tex.apply_splices(content, [(2, 6, 'X'), (2, 4, 'Y')]) == "01Y456789"
+    # 相邻的编辑和同一位置的插入都会保留
+    assert md2tex.apply_splices(content, [(2, 4, 'A'), (4, 6, 'B'), (6, 6, '+')]) == "01AB+6789"
+
+
+def test_latex_structure_inside_and_next_span():
+    content = ("\\documentclass{article}\n\\begin{document}\n"
+               "\\begin{figure}\\begin{figure*}x\\end{figure*} y\\end{figure}\n"
+               "\\begin{lstlisting}\n\\begin{figure}\n\\end{lstlisting}\n"
+               "z\\begin{figure}w\\end{figure}\n\\end{document}\n")
+    structure = md2tex.LatexStructure(content)
+    outer, inner, last = structure.spans('figure')
+    assert outer[0] < inner[0] < inner[1] < outer[1] < last[0]
+    # 内层环境结束后仍位于外层环境内
+    assert structure.inside(content.index(' y'), 'figure')
+    assert structure.inside(content.index('x\\end'), 'figure')
+    assert not structure.inside(content.index('z'), 'figure')
+    assert structure.inside(content.index('w'), 'figure')
+    # lstlisting中的\begin{figure}是原样文本，不计入结构
+    assert len(structure.spans('lstlisting')) == 1
+    assert structure.inside(content.index('\\begin{figure}\n\\end{lstlisting}'), 'lstlisting')
+    assert structure.next_span(outer[0] + 1, 'figure') == inner
+    assert structure.next_span(content.index('z'), 'figure') == last
+    assert structure.next_span(last[0] + 1, 'figure') is None
+    assert structure.in_preamble(0)
+    assert not structure.in_preamble(content.index('\\begin{figure}'))
+
+
+# 以下期望输出由原实现（逐个SVG在整篇文档中查找替换）生成
+def test_placeholder_captions_are_replaced():
+    body = ("\\begin{figure}\n\\centering\n\\includegraphics{pics/figure_1.pdf}\n"
+            "\\caption{图 1: SVG_PLACEHOLDER_0}\n\\end{figure}\n\n"
+            "\\begin{figure}\n\\includegraphics{pics/figure_2.pdf}\n\\caption{SVG_PLACEHOLDER_1}\n\\end{figure}\n")
+    assert post_process(body) == (
+        "\\begin{figure}\n\\centering\n\\includegraphics{pics/figure_1.pdf}\n\\caption{流程图}\n\\end{figure}\n\n"
+        "\\begin{figure}\n\\includegraphics{pics/figure_2.pdf}\n\\caption{图 2}\n\\end{figure}\n" + END)
+
+
+def test_bare_includegraphics_paths_are_fixed_and_wrapped():
+    body = "正文\n\n\\includegraphics{figure_1.pdf}\n\n\\includegraphics{figure_2.pdf}\n"
+    assert post_process(body) == (
+        "正文\n\n" + wrapped("\\includegraphics[width=0.8\\textwidth]{pics/figure_1.pdf}", 1) + "\n\n" +
+        wrapped("\\includegraphics[width=0.8\\textwidth]{pics/figure_2.pdf}", 2) + "\n" + END)
+
+
+def test_placeholder_paragraph_becomes_figure():
+    assert post_process("前文\n\nSVG_PLACEHOLDER_0 说明\n\n后文\n") == (
+        "前文\n\n\n\\begin{figure}[htbp]\n\\centering\n\\includegraphics[width=0.8\\textwidth]{pics/figure_1.pdf}\n"
+        "\\caption{流程图}\n\\label{fig:svg_1}\n\\end{figure}\n\n\n后文\n" + END)
+
+
+def test_only_graphics_outside_figures_are_wrapped():
+    body = ("文字\n\n\\includegraphics{pics/plot.png}\n\n"
+            "\\begin{figure}\n\\includegraphics{pics/a.png}\n\\caption{已有}\n\\end{figure}\n\n"
+            "\\includegraphics[width=3cm]{pics/figure_3.pdf}\n")
+    # 文件名中没有编号的图片使用编号1，figure_N 使用N
+    assert post_process(body) == (
+        "文字\n\n" + wrapped("\\includegraphics{pics/plot.png}", 1) + "\n\n"
+        "\\begin{figure}\n\\includegraphics{pics/a.png}\n\\caption{已有}\n\\end{figure}\n\n" +
+        wrapped("\\includegraphics[width=3cm]{pics/figure_3.pdf}", 3) + "\n" + END)
+
+
+def test_graphic_after_nested_figure_stays_in_outer_figure():
+    # 原实现只看最近的\begin{figure}之后是否出现过\end{figure}，会在外层figure中再套一层figure；
+    # 按环境区间判断后外层figure中的图片保持不变
+    body = ("\\begin{figure}\n\\begin{figure}\n\\includegraphics{pics/a.png}\n\\end{figure}\n"
+            "\\includegraphics{pics/plot.png}\n\\end{figure}\n\n\\includegraphics{pics/figure_4.pdf}\n")
+    assert post_process(body) == (
+        "\\begin{figure}\n\\begin{figure}\n\\includegraphics{pics/a.png}\n\\end{figure}\n"
+        "\\includegraphics{pics/plot.png}\n\\end{figure}\n\n" +
+        wrapped("\\includegraphics{pics/figure_4.pdf}", 4) + "\n" + END)
+
+
+def test_lstlisting_bodies():
+    body = ("\\begin{lstlisting}\n\\includegraphics{pics/figure_1.pdf}\n\\end{lstlisting}\n\n"
+            "\\begin{lstlisting}[language=Python]\nprint('hi')\n\\end{lstlisting}\n")
+    assert post_process(body) == (
+        "\\begin{lstlisting}\n" + wrapped("\\includegraphics{pics/figure_1.pdf}", 1) + "\n\\end{lstlisting}\n\n"
+        "\\begin{lstlisting}[language=Python]\nprint('hi')\n\\end{lstlisting}\n" + END)
+
+
+@pytest.mark.parametrize('index', [1, 4])
+def test_hash_named_svg_keeps_figure_number(index):
+    # SVG改为按内容哈希命名后，标签编号取自SVG的序号，与原来的 pics/figure_N.pdf 命名时相同
+    svg_files = [{'path': 'pics/svg_0123456789abcdef.pdf', 'caption': '', 'index': index}]
+    graphic = "\\includegraphics{pics/svg_0123456789abcdef.pdf}"
+    assert post_process(graphic + "\n", svg_files) == wrapped(graphic, index) + "\n" + END
+
+
+def test_fix_svg_references_matches_per_svg_replacement():
+    content = ("\\caption{SVG_PLACEHOLDER_0}\n\\includegraphics{figure_2.pdf}\n"
+               "\\includegraphics{pics/figure_1.pdf}\n图 2: SVG_PLACEHOLDER_1\n")
+    assert md2tex.fix_svg_references(content, SVG_FILES) == (
+        "\\caption{流程图}\n\\includegraphics[width=0.8\\textwidth]{pics/figure_2.pdf}\n"
+        "\\includegraphics{pics/figure_1.pdf}\n图 2: SVG_PLACEHOLDER_1\n")
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""--split-chapters 的章节拆分"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+def latex_document(body):
+    return ("\\documentclass{ctexart}\n\\begin{document}\n\\maketitle\n" + body +
+            "\\end{document}\n")
+
+
+def test_title_heading_with_subsections_splits_at_subsection():
+    # 常见的写法：一个 # 文档标题（\section）加多个 ## 小节（\subsection）
+    body = ("\\section{论文标题}\\label{title}\n\n引言。\n\n"
+            "\\subsection{背景}\\label{bg}\n\n背景。\n\n"
+            "\\subsection{方法}\\label{method}\n\n方法。\n\n"
+            "\\subsection{结果}\\label{result}\n\n结果。\n\n")
+    split = md2tex.split_latex_chapters(latex_document(body))
+    assert split is not None
+    preamble, chapters, tail, level = split
+    assert level == 'subsection'
+    assert md2tex.INCLUDE_ONLY_HOOK in preamble
+    assert tail.startswith('\\end{document}')
+    # 单独的文档标题和引言作为第一个章节，其后每个小节一个章节
+    assert len(chapters) == 4
+    assert '\\section{论文标题}' in chapters[0] and '\\subsection' not in chapters[0]
+    assert [chapter.split('}')[0] for chapter in chapters[1:]] == [
+        '\\subsection{背景', '\\subsection{方法', '\\subsection{结果']
+    assert ''.join(chapters) == '\\maketitle\n' + body
+
+
+def test_only_subsections_are_split():
+    body = ''.join(f"\\subsection{{第{i}节}}\n\n正文{i}。\n\n" for i in range(3))
+    split = md2tex.split_latex_chapters(latex_document(body))
+    assert split is not None
+    assert split[3] == 'subsection'
+    assert len(split[1]) == 4
+
+
+def test_highest_repeated_level_wins():
+    body = ("\\section{第一章}\n\n\\subsection{一}\n\n\\subsection{二}\n\n"
+            "\\section{第二章}\n\n\\subsection{三}\n\n")
+    split = md2tex.split_latex_chapters(latex_document(body))
+    assert split[3] == 'section'
+    assert len(split[1]) == 3
+
+
+def test_single_heading_is_not_split():
+    body = "\\section{标题}\n\n正文。\n\n"
+    assert md2tex.split_latex_chapters(latex_document(body)) is None
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""convert_svgs_async：外部后端作为asyncio子进程运行，回退顺序与线程池版本相同"""
+
+import io
+import asyncio
+import contextlib
+from pathlib import Path
+
+import pytest
+
+import md2latex_pandoc as md2tex
+
+SVG = '<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><rect width="10" height="10"/></svg>'
+
+
+class FileBackend(md2tex.SvgBackend):
+    """在本进程中写出PDF的测试后端"""
+
+    name = 'in-process'
+    in_process = True
+
+    def version(self):
+        return 'test'
+
+    def convert(self, svg_path, pdf_path):
+        Path(pdf_path).write_bytes(b'%PDF-1.4\n')
+        return True, None
+
+
+class StubRsvgBackend(md2tex.RsvgBackend):
+    def version(self):
+        return 'rsvg-convert stub'
+
+
+class StubInkscapeBackend(md2tex.InkscapeBackend):
+    def version(self):
+        return 'inkscape stub'
+
+
+def write_tool(bin_dir, name, script):
+    tool = bin_dir / name
+    tool.write_text('#!/bin/sh\n' + script, encoding='utf-8')
+    tool.chmod(0o755)
+
+
+@pytest.fixture
+def svgs(tmp_path):
+    tasks = []
+    for i in range(4):
+        svg_path = tmp_path / f"svg_{i}.svg"
+        svg_path.write_text(SVG, encoding='utf-8')
+        tasks.append((svg_path, tmp_path / f"svg_{i}.pdf"))
+    return tasks
+
+
+@pytest.fixture
+def no_blocking_export(monkeypatch):
+    """线程池版本的导出函数在异步路径中不应被调用"""
+    def blocked(*args, **kwargs):
+        raise AssertionError('阻塞的导出函数被调用')
+    monkeypatch.setattr(md2tex, 'run_svg_export', blocked)
+    monkeypatch.setattr(md2tex, 'convert_svgs_parallel', blocked)
+
+
+def convert(tasks, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return asyncio.run(md2tex.convert_svgs_async(tasks, **kwargs))
+
+
+def test_external_backend_runs_as_asyncio_subprocess(svgs, fake_toolchain, no_blocking_export, monkeypatch):
+    started = []
+    create = asyncio.create_subprocess_exec
+
+    async def record(*command, **kwargs):
+        started.append(Path(command[0]).name)
+        return await create(*command, **kwargs)
+    monkeypatch.setattr(md2tex.asyncio, 'create_subprocess_exec', record)
+    results = convert(svgs, jobs=2, backends=[StubInkscapeBackend()])
+    assert results == {str(svg_path): (True, None, 'inkscape') for svg_path, _ in svgs}
+    assert started == ['inkscape'] * len(svgs)
+    assert all(pdf_path.exists() for _, pdf_path in svgs)
+
+
+def test_failed_backend_falls_back_in_order(svgs, fake_toolchain, no_blocking_export):
+    write_tool(fake_toolchain, 'rsvg-convert', 'echo "rsvg: cannot render" >&2\nexit 1\n')
+    results = convert(svgs[:2], jobs=2, backends=[StubRsvgBackend(), StubInkscapeBackend()])
+    assert {backend for _, _, backend in results.values()} == {'inkscape'}
+
+    # 外部后端都失败时交给进程内渲染的后端（图片少于SVG_PROCESS_POOL_MIN时在线程中运行）
+    write_tool(fake_toolchain, 'inkscape', 'exit 1\n')
+    results = convert(svgs[:2], backends=[StubRsvgBackend(), StubInkscapeBackend(), FileBackend()])
+    assert {backend for _, _, backend in results.values()} == {'in-process'}
+
+
+def test_all_backends_failing_reports_each_error(svgs, tmp_path, no_blocking_export, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    write_tool(bin_dir, 'rsvg-convert', 'echo "rsvg: cannot render" >&2\nexit 1\n')
+    monkeypatch.setenv('PATH', str(bin_dir))
+    ok, error, backend = convert(svgs[:1], backends=[StubRsvgBackend(), StubInkscapeBackend()])[str(svgs[0][0])]
+    assert not ok and backend is None
+    assert error.startswith('rsvg-convert: rsvg: cannot render') and '; inkscape: ' in error
+    assert convert(svgs[:1], backends=[]) == {str(svgs[0][0]): (False, md2tex.SvgConverter._failure([]), None)}
+
+
+def test_concurrency_is_bounded_by_jobs(svgs, tmp_path, fake_toolchain, no_blocking_export):
+    running = tmp_path / 'running'
+    running.mkdir()
+    log = tmp_path / 'concurrency.log'
+    # 每个进程运行期间在running目录中留下标记，记录同时存在的标记数
+    write_tool(fake_toolchain, 'rsvg-convert',
+               f'touch "{running}/$$"\nls "{running}" | wc -l >> "{log}"\nsleep 0.2\n'
+               f'rm "{running}/$$"\n'
+               'while [ $# -gt 0 ]; do [ "$1" = -o ] && out=$2; shift; done\necho pdf > "$out"\n')
+    results = convert(svgs, jobs=2, backends=[StubRsvgBackend()])
+    assert all(ok for ok, _, _ in results.values())
+    assert max(int(line) for line in log.read_text().split()) <= 2
+
+
+def test_inkscape_shell_uses_threaded_conversion(svgs, monkeypatch):
+    calls = []
+
+    def parallel(tasks, jobs, use_shell, backends):
+        calls.append((len(tasks), jobs, use_shell))
+        return {}
+    monkeypatch.setattr(md2tex, 'convert_svgs_parallel', parallel)
+    backends = [StubInkscapeBackend()]
+    convert(svgs, jobs=3, use_shell=True, backends=backends)
+    assert calls == ([(4, 3, True)] if md2tex.os.name == 'posix' else [])
+
+
+def test_backend_commands():
+    assert FileBackend().command('a.svg', 'a.pdf') is None
+    assert StubRsvgBackend().command('a.svg', 'a.pdf') == md2tex.rsvg_export_command('a.svg', 'a.pdf')
+    assert StubInkscapeBackend().command('a.svg', 'a.pdf') == md2tex.inkscape_export_command('a.svg', 'a.pdf')
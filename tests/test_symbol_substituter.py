@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""SymbolSubstituter：特殊字符替换及其跳过的区域"""
+
+import contextvars
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+MAPPING = {"β": "\\betasym{}", "→": "\\rightarrowsym{}", "->": "\\longarrow{}"}
+
+
+@pytest.fixture
+def substituter():
+    return md2tex.SymbolSubstituter(MAPPING)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("参数β", "参数\\betasym{}"),
+    ("a → b", "a \\rightarrowsym{} b"),
+    # 较长的字符序列优先匹配
+    ("a->b", "a\\longarrow{}b"),
+    ("没有特殊字符", "没有特殊字符"),
+    # 数学公式保持不变
+    ("行内 $β$ 与 β", "行内 $β$ 与 \\betasym{}"),
+    ("$$β → γ$$ β", "$$β → γ$$ \\betasym{}"),
+    ("\\(β\\) β", "\\(β\\) \\betasym{}"),
+    ("\\[β\\] β", "\\[β\\] \\betasym{}"),
+    ("价格 \\$5 和 β \\$6", "价格 \\$5 和 \\betasym{} \\$6"),
+    ("\\begin{equation}\nβ\n\\end{equation}\nβ", "\\begin{equation}\nβ\n\\end{equation}\n\\betasym{}"),
+    ("\\begin{align*}β\\end{align*}β", "\\begin{align*}β\\end{align*}\\betasym{}"),
+    # 原样输出区域保持不变
+    ("\\verb|β| β", "\\verb|β| \\betasym{}"),
+    ("\\verb*+a->b+ β", "\\verb*+a->b+ \\betasym{}"),
+    ("\\begin{lstlisting}\nx -> β\n\\end{lstlisting}\nβ", "\\begin{lstlisting}\nx -> β\n\\end{lstlisting}\n\\betasym{}"),
+    ("\\begin{verbatim}β\\end{verbatim}β", "\\begin{verbatim}β\\end{verbatim}\\betasym{}"),
+    # 紧跟在 \ 或 { 之后的字符视为已有命令的一部分
+    ("\\β {β} β", "\\β {β} \\betasym{}"),
+])
+def test_substitute(substituter, text, expected):
+    assert substituter.substitute(text) == expected
+
+
+def test_substitute_skips_until_matching_environment_end(substituter):
+    # 不同的跳过环境互不匹配：lstlisting 不会在 \end{verbatim} 处结束
+    text = "\\begin{lstlisting}\nβ \\end{verbatim} β\n\\end{lstlisting} β"
+    assert substituter.substitute(text) == "\\begin{lstlisting}\nβ \\end{verbatim} β\n\\end{lstlisting} \\betasym{}"
+
+
+def test_empty_mapping_leaves_text_unchanged():
+    substituter = md2tex.SymbolSubstituter({})
+    assert substituter.substitute("β $x$") == "β $x$"
+    assert substituter.split("β") == [("β", None)]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("", [("", None)]),
+    ("纯文本", [("纯文本", None)]),
+    ("β", [("β", "\\betasym{}")]),
+    ("aβb->c", [("a", None), ("β", "\\betasym{}"), ("b", None), ("->", "\\longarrow{}"), ("c", None)]),
+    # AST文本节点中没有公式或命令，$ 和 \ 不影响拆分
+    ("$β\\", [("$", None), ("β", "\\betasym{}"), ("\\", None)]),
+])
+def test_split(substituter, text, expected):
+    assert substituter.split(text) == expected
+
+
+def test_get_symbol_substituter_caches_by_mapping_content():
+    first = md2tex.get_symbol_substituter(dict(MAPPING))
+    assert md2tex.get_symbol_substituter(dict(reversed(list(MAPPING.items())))) is first
+    assert md2tex.get_symbol_substituter({"β": "\\beta"}) is not first
+
+
+def test_char_map_option_is_passed_through_settings(tmp_path, monkeypatch):
+    markdown = tmp_path / 'doc.md'
+    markdown.write_text("# 标题\n", encoding='utf-8')
+    char_map = tmp_path / 'map.json'
+    char_map.write_text('{"★": "\\\\starsym{}"}', encoding='utf-8')
+    default = dict(md2tex.SPECIAL_CHAR_MAP)
+    seen = []
+
+    def build_document(*args, **kwargs):
+        seen.append(md2tex.setting('SPECIAL_CHAR_MAP'))
+        return True, None, {}
+
+    # main() 会设置模块级配置，测试结束后恢复
+    for name in md2tex.CONVERTER_SETTINGS:
+        monkeypatch.setattr(md2tex, name, getattr(md2tex, name))
+    monkeypatch.setattr(md2tex, 'build_document', build_document)
+    monkeypatch.setattr(sys, 'argv', ['md2latex_pandoc.py', str(markdown), '--quiet', '--char-map', str(char_map)])
+    contextvars.copy_context().run(md2tex.main)
+
+    assert seen[0]["★"] == "\\starsym{}"
+    assert seen[0]["β"] == default["β"]
+    # 模块级的默认映射表不变，之后在其他上下文中的转换不受影响
+    assert md2tex.SPECIAL_CHAR_MAP == default
+    assert "★" not in md2tex.setting('SPECIAL_CHAR_MAP')
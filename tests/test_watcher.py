@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""DocumentWatcher：变化检测以及构建线程与轮询线程之间的监视列表交接"""
+
+import io
+import os
+import sys
+import threading
+import contextlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import md2latex_pandoc as md2tex
+
+
+def make_watcher(tmp_path):
+    markdown = tmp_path / 'doc.md'
+    markdown.write_text("# 标题\n", encoding='utf-8')
+    return md2tex.DocumentWatcher(str(markdown), None, str(tmp_path / 'template.tex'))
+
+
+def test_changed_files_reports_modified_and_ignores_new(tmp_path):
+    watcher = make_watcher(tmp_path)
+    a, b = tmp_path / 'a.md', tmp_path / 'b.png'
+    a.write_text('1', encoding='utf-8')
+    b.write_bytes(b'x')
+    watcher.files = [str(a)]
+    watcher.last = watcher.snapshot(watcher.files)
+
+    os.utime(a, ns=(0, 10 ** 9))
+    watcher.pending_files = [str(a), str(b)]
+    # 新加入监视的文件只记录状态，不算作修改
+    assert watcher.changed_files() == {str(a)}
+    assert watcher.files == [str(a), str(b)] and watcher.pending_files is None
+    assert watcher.changed_files() == set()
+
+    b.unlink()
+    assert watcher.changed_files() == {str(b)}
+
+
+def test_build_hands_over_watched_files(tmp_path, monkeypatch):
+    watcher = make_watcher(tmp_path)
+    monkeypatch.setattr(md2tex, 'build_document', lambda *args, **kwargs: (True, 'doc.pdf', {}))
+    monkeypatch.setattr(watcher, 'watched_files', lambda: ['x', 'y'])
+    with contextlib.redirect_stdout(io.StringIO()):
+        watcher._build()
+    assert watcher.pending_files == ['x', 'y']
+
+    # 构建被取消时同样交出新的监视列表
+    def cancelled(*args, **kwargs):
+        raise md2tex.BuildCancelled()
+    monkeypatch.setattr(md2tex, 'build_document', cancelled)
+    monkeypatch.setattr(watcher, 'watched_files', lambda: ['z'])
+    watcher._build()
+    watcher.changed_files()
+    assert watcher.files == ['z']
+
+
+def test_concurrent_handover_never_loses_the_latest_list(tmp_path, monkeypatch):
+    watcher = make_watcher(tmp_path)
+    monkeypatch.setattr(watcher, 'snapshot', lambda files: {})
+    lists = [[f'file{i}'] for i in range(20000)]
+    done = threading.Event()
+
+    def builder():
+        for files in lists:
+            with watcher.pending_lock:
+                watcher.pending_files = files
+        done.set()
+
+    thread = threading.Thread(target=builder)
+    thread.start()
+    while not done.is_set():
+        watcher.changed_files()
+    thread.join()
+    watcher.changed_files()
+    # 最后一次交接的列表一定会被轮询线程取走，不会被并发的读取覆盖为None
+    assert watcher.files == lists[-1]
+    assert watcher.pending_files is None